@@ -2,64 +2,572 @@
 
 # terminal.py - Embeded VTE terminal for gedit (Multi-Tab version)
 # Based on original gedit terminal plugin, modified to support multi-tab
+import collections
+import contextlib
+import fcntl
+import functools
+import gzip
+import json
+import logging
 import os
+import re
+import shlex
+import signal
+import struct
 import sys
-import traceback
+import termios
+import time
+
+# 日志：GEDIT_TERMINAL_MULTITAB_LOG 设置级别（debug/info/warning/error），默认只输出警告和错误
+LOG = logging.getLogger('gedit.plugins.terminal_multitab')
+if not LOG.handlers:
+    _log_handler = logging.StreamHandler(sys.stderr)
+    _log_handler.setFormatter(logging.Formatter('[Terminal Multitab] %(levelname)s: %(message)s'))
+    LOG.addHandler(_log_handler)
+    LOG.propagate = False
+try:
+    LOG.setLevel(os.environ.get('GEDIT_TERMINAL_MULTITAB_LOG', 'WARNING').upper())
+except ValueError:
+    LOG.setLevel(logging.WARNING)
+
+_IMPORT_START = time.monotonic()
 
 import gi
 # 强制指定版本，避免自动适配出错
 gi.require_version('Gedit', '3.0')
 gi.require_version('Gtk', '3.0')
-gi.require_version('Vte', '2.91')
-# Tepl库兼容处理（6.x/5.x）
-try:
-    gi.require_version('Tepl', '6')
-except ValueError:
+
+# 导入时只加载注册插件所需的库；Vte和Tepl在首次创建终端面板时才加载（见load_terminal_support）
+from gi.repository import GObject, GLib, Gio, Pango, Gdk, Gtk, Gedit
+Vte = None
+Tepl = None  # Tepl不可用时保持None
+
+def load_terminal_support():
+    """加载Vte/Tepl并创建终端类（只执行一次，首个面板创建时调用）"""
+    global Vte, Tepl, GeditTerminal
+    if Vte is not None:
+        return
+    with log_span("Load terminal support"):
+        gi.require_version('Vte', '2.91')
+        from gi.repository import Vte as vte_module
+        # Tepl库兼容处理（6.x/5.x）
+        for version in ('6', '5'):
+            try:
+                gi.require_version('Tepl', version)
+                from gi.repository import Tepl as tepl_module
+                Tepl = tepl_module
+                break
+            except (ValueError, ImportError):
+                continue
+        else:
+            LOG.warning("Tepl 5/6 not found, use fallback config")
+        Vte = vte_module
+        GeditTerminal = _create_terminal_class()
+
+def __getattr__(name):
+    """模块级延迟属性：首次访问GeditTerminal时加载终端支持"""
+    if name == 'GeditTerminal':
+        load_terminal_support()
+        return GeditTerminal
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+# 翻译在首次使用时才绑定文本域
+_translate = None
+
+def _(message):
+    global _translate
+    if _translate is None:
+        try:
+            import gettext
+            gettext.bindtextdomain('gedit-plugins')
+            gettext.textdomain('gedit-plugins')
+            _translate = gettext.gettext
+        except Exception:
+            _translate = lambda s: s
+    return _translate(message)
+
+# 插件配置：读取 GEDIT_TERMINAL_MULTITAB_<NAME> 环境变量
+ENV_PREFIX = 'GEDIT_TERMINAL_MULTITAB_'
+
+def env_int(name, default):
+    """读取整数型配置，未设置或无效时返回默认值"""
     try:
-        gi.require_version('Tepl', '5')
+        return int(os.environ.get(ENV_PREFIX + name, default))
     except ValueError:
-        print("[Terminal Multitab] Tepl 5/6 not found, use fallback config", file=sys.stderr)
-
-# 导入核心库，添加异常捕获
-try:
-    from gi.repository import GObject, GLib, Gio, Pango, Gdk, Gtk, Gedit, Tepl, Vte
-except ImportError as e:
-    print(f"[Terminal Multitab] Import error: {e}", file=sys.stderr)
-    print(traceback.format_exc(), file=sys.stderr)
-    # 缺失核心库时，至少保证Gtk/Gedit可用
-    from gi.repository import GObject, GLib, Gio, Pango, Gdk, Gtk, Gedit
-    Tepl = None  # 标记Tepl不可用
+        LOG.warning("Invalid %s, use %s", ENV_PREFIX + name, default)
+        return default
+
+class Metrics(object):
+    """性能指标收集（GEDIT_TERMINAL_MULTITAB_METRICS 设为JSON文件路径时开启）
+
+    记录计时区间（log_span/traced）的耗时分布和若干计数器，插件释放时连同各终端的
+    行数、滚动回滚内存估算一起写入JSON，用于比较不同版本的性能。未开启时不做任何记录。
+    """
+    path = os.environ.get(ENV_PREFIX + 'METRICS') or None
+    enabled = path is not None
+    # 每个计时项保留的最近样本数（用于计算分位数）
+    MAX_SAMPLES = 1000
+
+    _timings = {}  # 名称 -> deque(毫秒)
+    _totals = {}  # 名称 -> [次数, 总毫秒]
+    _counters = collections.Counter()
+    _start = time.monotonic()
+
+    @classmethod
+    def record(cls, name, ms):
+        samples = cls._timings.get(name)
+        if samples is None:
+            samples = cls._timings[name] = collections.deque(maxlen=cls.MAX_SAMPLES)
+            cls._totals[name] = [0, 0.0]
+        samples.append(ms)
+        totals = cls._totals[name]
+        totals[0] += 1
+        totals[1] += ms
+
+    @classmethod
+    def count(cls, name, n=1):
+        cls._counters[name] += n
+
+    @classmethod
+    def report(cls):
+        """汇总当前指标"""
+        elapsed = time.monotonic() - cls._start
+        timings = {}
+        for name, samples in cls._timings.items():
+            ordered = sorted(samples)
+            count, total = cls._totals[name]
+            timings[name] = {
+                'count': count,
+                'mean_ms': total / count,
+                'p50_ms': ordered[len(ordered) // 2],
+                'p95_ms': ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+                'max_ms': ordered[-1],
+            }
+        terminals = []
+        for tab in TerminalSessionManager.get_default().get_sessions():
+            for term in tab.get_terminals():
+                if isinstance(term, GeditTerminal):
+                    rows, nbytes = term.get_scrollback_usage()
+                    terminals.append({'title': tab.title, 'rows': rows, 'scrollback_bytes': nbytes,
+                                      'invalidations': term.invalidation_count})
+        return {
+            'elapsed_s': elapsed,
+            'timings': timings,
+            'counters': dict(cls._counters),
+            'output_rows_per_s': cls._counters['output rows'] / elapsed if elapsed > 0 else 0,
+            'terminals': terminals,
+            'profile_changes': [
+                {'key': key, 'group': group, 'terminals': n, 'invalidations': invalidations}
+                for key, group, n, invalidations in
+                (TerminalProfileSettings._default.get_invalidation_stats() if TerminalProfileSettings._default else ())],
+        }
 
-try:
-    import gettext
-    gettext.bindtextdomain('gedit-plugins')
-    gettext.textdomain('gedit-plugins')
-    _ = gettext.gettext
-except:
-    _ = lambda s: s
-
-# 调试日志装饰器（简化日志输出）
-def debug_log(func):
+    @classmethod
+    def dump(cls, path=None):
+        """把指标写入JSON文件"""
+        path = path or cls.path
+        if path is None:
+            return
+        try:
+            with open(path, 'w') as f:
+                json.dump(cls.report(), f, indent=2, ensure_ascii=False)
+        except (OSError, TypeError, ValueError) as e:
+            LOG.warning("Dump metrics failed: %s", e)
+
+class _NullSpan(object):
+    """日志关闭时使用的空计时区间"""
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+_NULL_SPAN = _NullSpan()
+
+class _Span(object):
+    """计时区间：结束时以DEBUG级别记录耗时，并计入性能指标"""
+    __slots__ = ('msg', 'args', 'start')
+
+    def __init__(self, msg, args):
+        self.msg = msg
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.monotonic()
+        return self
+
+    def __exit__(self, *exc_info):
+        ms = (time.monotonic() - self.start) * 1000
+        LOG.debug(self.msg + " took %.2f ms", *self.args, ms)
+        if Metrics.enabled:
+            Metrics.record(self.msg, ms)
+        return False
+
+def log_span(msg, *args):
+    """返回计时区间（with语句使用）；未开启DEBUG级别和性能指标时几乎没有开销"""
+    if Metrics.enabled or LOG.isEnabledFor(logging.DEBUG):
+        return _Span(msg, args)
+    return _NULL_SPAN
+
+def traced(func):
+    """记录函数耗时的装饰器；定义时未开启DEBUG级别和性能指标则直接返回原函数"""
+    if not (Metrics.enabled or LOG.isEnabledFor(logging.DEBUG)):
+        return func
+    msg = func.__qualname__
+
+    @functools.wraps(func)
     def wrapper(*args, **kwargs):
-        func_name = func.__name__
+        with _Span(msg, ()):
+            return func(*args, **kwargs)
+    return wrapper
+
+FALLBACK_SHELL = "/bin/bash"
+
+# 获取PTY从设备编号的ioctl（Linux），termios模块未导出该常量
+TIOCGPTN = getattr(termios, 'TIOCGPTN', 0x80045430)
+
+# Vte.Regex使用的PCRE2编译选项（GI未导出这些常量）
+PCRE2_CASELESS = 0x00000008
+PCRE2_MULTILINE = 0x00000400
+PCRE2_UTF = 0x00080000
+
+# 导出终端内容时去除的ANSI转义序列（CSI/OSC）和控制字符（保留换行和制表符）
+CONTROL_SEQUENCES = re.compile(r'\x1b\[[0-?]*[ -/]*[@-~]|\x1b\][^\x07\x1b]*(?:\x07|\x1b\\)|'
+                               r'\x1b[@-_]|[\x00-\x08\x0b-\x1f\x7f]')
+
+def spawn_shell_async(term, shells, on_done, working_directory=None):
+    """在终端中异步启动shell：按顺序尝试shells，失败时在回调里尝试下一个
+
+    shells中的项是shell路径、完整的argv列表或 (argv列表, 附加环境变量列表)。
+    全部完成后调用 on_done(term, pid)，全部失败时 pid 为 -1。
+    """
+    shells = list(shells)
+
+    def on_spawned(terminal, pid, error, *user_data):
+        ms = (time.monotonic() - start[0]) * 1000
+        LOG.debug("Spawn %s took %.2f ms", argv[0], ms)
+        if Metrics.enabled:
+            Metrics.record("spawn_shell_async", ms)
+        if error is None and pid > 0:
+            on_done(term, pid)
+            return
+        LOG.warning("Spawn %s failed: %s", argv[0], error)
+        if getattr(term, '_destroyed', False):
+            # 终端已销毁，不再尝试其他shell
+            on_done(term, -1)
+            return
+        attempt()
+
+    def attempt():
+        if not shells:
+            on_done(term, -1)
+            return
+        entry = shells.pop(0)
+        envv = None
+        if isinstance(entry, tuple):
+            entry, envv = entry
+        argv[:] = entry if isinstance(entry, list) else [entry]
+        start[0] = time.monotonic()
+        if not hasattr(term, "spawn_async"):
+            # 旧版VTE（<0.48）没有spawn_async，只能同步启动
+            try:
+                ok, pid = term.spawn_sync(Vte.PtyFlags.DEFAULT, working_directory, list(argv), envv,
+                                          GLib.SpawnFlags.SEARCH_PATH, None, None, None)
+                on_spawned(term, pid if ok else -1, None)
+            except Exception as e:
+                on_spawned(term, -1, e)
+            return
         try:
-            print(f"[Terminal Multitab] Running: {func_name}", file=sys.stdout)
-            result = func(*args, **kwargs)
-            print(f"[Terminal Multitab] Success: {func_name}", file=sys.stdout)
-            return result
+            term.spawn_async(Vte.PtyFlags.DEFAULT, working_directory, list(argv), envv,
+                             GLib.SpawnFlags.SEARCH_PATH, None, None, -1, None,
+                             on_spawned, None)
         except Exception as e:
-            print(f"[Terminal Multitab] Error in {func_name}: {e}", file=sys.stderr)
-            print(traceback.format_exc(), file=sys.stderr)
-            raise
-    return wrapper
+            on_spawned(term, -1, e)
+
+    argv = [None]
+    start = [0.0]
+    attempt()
+
+class _ChildFeeder(object):
+    """向终端的子进程分块输入数据，不阻塞主循环
+
+    数据先排队，PTY可写时每次写入一块（CHUNK_SIZE字节），写满时等待下一次可写，
+    大量输入既不会阻塞gedit也不会撑爆PTY输入缓冲区。没有PTY时退化为在空闲回调中
+    分块feed_child。
+    """
+    CHUNK_SIZE = 4096
+
+    def __init__(self, terminal):
+        self.terminal = terminal
+        self._queue = collections.deque()
+        self._offset = 0  # 队首数据已写入的字节数
+        self._source_id = 0
+
+    def feed(self, data):
+        """排队输入数据（bytes）"""
+        if data:
+            self._queue.append(data)
+            self._schedule()
+
+    def pending(self):
+        """还未写完的字节数"""
+        return sum(len(data) for data in self._queue) - self._offset
+
+    def cancel(self):
+        """丢弃未写完的数据"""
+        self._queue.clear()
+        self._offset = 0
+        if self._source_id:
+            GLib.source_remove(self._source_id)
+            self._source_id = 0
+
+    def _schedule(self):
+        if self._source_id:
+            return
+        pty = self.terminal.get_pty()
+        if pty is None:
+            self._source_id = GLib.idle_add(self._on_idle)
+        else:
+            self._source_id = GLib.unix_fd_add_full(
+                GLib.PRIORITY_DEFAULT_IDLE, pty.get_fd(),
+                GLib.IOCondition.OUT | GLib.IOCondition.HUP | GLib.IOCondition.ERR,
+                self._on_writable)
+
+    def _next_chunk(self):
+        return self._queue[0][self._offset:self._offset + self.CHUNK_SIZE]
+
+    def _consume(self, written):
+        """记录已写入的字节，返回是否还有数据"""
+        self._offset += written
+        if self._offset >= len(self._queue[0]):
+            self._queue.popleft()
+            self._offset = 0
+        if self._queue:
+            return True
+        self._source_id = 0
+        return False
+
+    def _on_writable(self, fd, condition):
+        if condition & (GLib.IOCondition.HUP | GLib.IOCondition.ERR):
+            self._source_id = 0
+            self.cancel()
+            return False
+        try:
+            written = os.write(fd, self._next_chunk())
+        except BlockingIOError:
+            return True
+        except OSError as e:
+            LOG.warning("Write to terminal failed: %s", e)
+            self._source_id = 0
+            self.cancel()
+            return False
+        return self._consume(written)
+
+    def _on_idle(self):
+        chunk = self._next_chunk()
+        self.terminal.feed_child(chunk)
+        return self._consume(len(chunk))
+
+class ChildReaper(object):
+    """回收已销毁终端的shell进程
+
+    终端销毁后VTE不再监视其子进程，挂断的shell在这里每INTERVAL毫秒以
+    waitpid(WNOHANG)回收一次，超过KILL_AFTER秒仍未退出时发送SIGKILL。
+    进程已被其他地方回收（ECHILD）时直接丢弃。
+    """
+    INTERVAL = 100
+    KILL_AFTER = 5
+
+    _pids = {}  # pid -> 开始回收的时间
+    _source_id = 0
+
+    @classmethod
+    def reap(cls, pid):
+        """开始回收已挂断的子进程"""
+        cls._pids.setdefault(pid, time.monotonic())
+        if not cls._source_id:
+            cls._source_id = GLib.timeout_add(cls.INTERVAL, cls._poll)
+
+    @classmethod
+    def pending(cls):
+        """还未回收的子进程"""
+        return list(cls._pids)
+
+    @classmethod
+    def _poll(cls):
+        now = time.monotonic()
+        for pid, start in list(cls._pids.items()):
+            try:
+                reaped, status = os.waitpid(pid, os.WNOHANG)
+            except ChildProcessError:
+                reaped = pid
+            if reaped == pid:
+                LOG.debug("Child %s reaped", pid)
+                del cls._pids[pid]
+            elif now - start >= cls.KILL_AFTER:
+                LOG.debug("Child %s ignored SIGHUP, kill", pid)
+                try:
+                    os.kill(pid, signal.SIGKILL)
+                except OSError:
+                    pass
+        if cls._pids:
+            return True
+        cls._source_id = 0
+        return False
+
+class ShellIntegration(object):
+    """shell集成（GEDIT_TERMINAL_MULTITAB_SHELL_INTEGRATION=1 开启）
+
+    启动bash/zsh时加载一小段rc脚本，在提示符和命令前后输出OSC 7（当前目录）、
+    OSC 133（提示符/命令开始/命令结束及退出码，供其他工具使用）以及VTE自己的
+    OSC 666 termprop序列（同vte.sh）。当前目录通过VTE的current-directory-uri-changed
+    信号获得；命令边界和退出码来自VTE 0.78+的termprop-changed信号（vte.shell.preexec
+    和vte.shell.postexec，VTE不会把OSC 133转换为termprop），旧版VTE仍由ProcessMonitor轮询。
+    rc脚本在首次使用时写入用户运行时目录，先加载用户自己的配置。
+    """
+    enabled = env_int('SHELL_INTEGRATION', 0) != 0
+
+    # OSC 7中的路径按URI规则转义（同vte.sh的__vte_urlencode），逐字节处理
+    URLENCODE = r"""__gedit_terminal_urlencode() (
+    LC_ALL=C
+    str="$1"
+    while [ -n "$str" ]; do
+        safe="${str%%[!a-zA-Z0-9/:_\.\-\!\'\(\)~]*}"
+        printf "%s" "$safe"
+        str="${str#"$safe"}"
+        if [ -n "$str" ]; then
+            printf "%%%02X" "'$str"
+            str="${str#?}"
+        fi
+    done
+)
+"""
+
+    BASH_RC = r"""# gedit terminal multitab: bash shell integration
+[ -f ~/.bashrc ] && . ~/.bashrc
+""" + URLENCODE + r"""__gedit_terminal_precmd() {
+    local ret=$?
+    printf '\e]133;D;%s\a\e]666;vte.shell.postexec=%s\e\\\e]7;file://%s%s\a\e]133;A\a' \
+        "$ret" "$ret" "$HOSTNAME" "$(__gedit_terminal_urlencode "$PWD")"
+}
+PROMPT_COMMAND="__gedit_terminal_precmd${PROMPT_COMMAND:+;$PROMPT_COMMAND}"
+PS0=$'\e]133;C\a\e]666;vte.shell.preexec!\e\\'"$PS0"
+PS1="$PS1"'\[\e]133;B\a\]'
+"""
+
+    ZSH_ENV = r"""# gedit terminal multitab: zsh shell integration
+[ -f "${GEDIT_TERMINAL_MULTITAB_USER_ZDOTDIR:-$HOME}/.zshenv" ] && . "${GEDIT_TERMINAL_MULTITAB_USER_ZDOTDIR:-$HOME}/.zshenv"
+"""
+
+    ZSH_RC = r"""# gedit terminal multitab: zsh shell integration
+ZDOTDIR="${GEDIT_TERMINAL_MULTITAB_USER_ZDOTDIR:-$HOME}"
+[ -f "$ZDOTDIR/.zshrc" ] && . "$ZDOTDIR/.zshrc"
+""" + URLENCODE + r"""__gedit_terminal_precmd() {
+    local ret=$?
+    printf '\e]133;D;%s\a\e]666;vte.shell.postexec=%s\e\\\e]7;file://%s%s\a\e]133;A\a' \
+        "$ret" "$ret" "$HOST" "$(__gedit_terminal_urlencode "$PWD")"
+}
+__gedit_terminal_preexec() { printf '\e]133;C\a\e]666;vte.shell.preexec!\e\\' }
+precmd_functions=(__gedit_terminal_precmd $precmd_functions)
+preexec_functions+=(__gedit_terminal_preexec)
+"""
+
+    _directory = None
+
+    @classmethod
+    def get_directory(cls):
+        """写入rc脚本（每个进程一次），返回所在目录，失败时返回None"""
+        if cls._directory is None:
+            directory = os.path.join(GLib.get_user_runtime_dir(), 'gedit-terminal-multitab')
+            try:
+                os.makedirs(os.path.join(directory, 'zsh'), mode=0o700, exist_ok=True)
+                for name, content in (('bashrc', cls.BASH_RC), ('zsh/.zshenv', cls.ZSH_ENV),
+                                      ('zsh/.zshrc', cls.ZSH_RC)):
+                    with open(os.path.join(directory, name), 'w') as f:
+                        f.write(content)
+            except OSError as e:
+                LOG.warning("Write shell integration scripts failed: %s", e)
+                cls.enabled = False
+                return None
+            cls._directory = directory
+        return cls._directory
+
+    @classmethod
+    def spawn_args(cls, shell):
+        """启动shell的 (argv, 附加环境变量)；不支持的shell或未开启时原样启动"""
+        name = os.path.basename(shell)
+        if not cls.enabled or name not in ('bash', 'zsh'):
+            return [shell], None
+        directory = cls.get_directory()
+        if directory is None:
+            return [shell], None
+        if name == 'bash':
+            return [shell, '--rcfile', os.path.join(directory, 'bashrc')], None
+        user_zdotdir = os.environ.get('ZDOTDIR') or os.path.expanduser('~')
+        return [shell], [f"ZDOTDIR={os.path.join(directory, 'zsh')}",
+                         f"GEDIT_TERMINAL_MULTITAB_USER_ZDOTDIR={user_zdotdir}"]
+
+class TerminalProfile(object):
+    """解析好的终端配置快照（字体/颜色可直接应用到VTE）
+
+    配置按组（GROUPS）比较和应用，每组对应终端上的一次设置调用。
+    """
+    __slots__ = ('font', 'fg', 'bg', 'palette', 'cursor_blink_mode', 'cursor_shape',
+                 'audible_bell', 'scroll_on_keystroke', 'scroll_on_output', 'scrollback_lines')
+
+    GROUPS = ('font', 'colors', 'cursor_blink_mode', 'cursor_shape', 'audible_bell',
+              'scroll_on_keystroke', 'scroll_on_output', 'scrollback_lines')
 
-class GeditTerminal(Vte.Terminal):
-    """原终端类，保留所有原有功能（配置同步、拖拽等）"""
-    defaults = {
-        'audible_bell'          : False,
-    }
+    def __init__(self):
+        self.font = Pango.font_description_from_string("Monospace 10")  # 默认字体
+        self.fg = None  # None表示使用主题颜色
+        self.bg = None
+        self.palette = []
+        self.cursor_blink_mode = Vte.CursorBlinkMode.SYSTEM
+        self.cursor_shape = Vte.CursorShape.BLOCK
+        self.audible_bell = False
+        self.scroll_on_keystroke = True
+        self.scroll_on_output = True
+        self.scrollback_lines = 1000  # 默认滚动行数
+
+    def copy(self):
+        profile = TerminalProfile.__new__(TerminalProfile)
+        for name in self.__slots__:
+            setattr(profile, name, getattr(self, name))
+        return profile
+
+    def group_key(self, group):
+        """返回某个配置组的可比较值"""
+        if group == 'font':
+            return self.font.to_string()
+        if group == 'colors':
+            return (self.fg.to_string() if self.fg else None,
+                    self.bg.to_string() if self.bg else None,
+                    tuple(c.to_string() for c in self.palette))
+        return getattr(self, group)
+
+    def __eq__(self, other):
+        return (isinstance(other, TerminalProfile) and
+                all(self.group_key(g) == other.group_key(g) for g in self.GROUPS))
+
+    def __ne__(self, other):
+        return not self == other
+
+def _parse_rgba(spec):
+    """解析颜色字符串，失败返回None"""
+    if not spec:
+        return None
+    rgba = Gdk.RGBA()
+    return rgba if rgba.parse(spec) else None
 
-    SETTINGS_SCHEMA_ID_BASE = "org.gnome.Terminal.ProfilesList"
+class TerminalProfileSettings(object):
+    """进程级共享的终端配置服务
+
+    全进程只创建一份Gio.Settings并只探测一次schema，配置解析成
+    TerminalProfile后推送给所有已注册的终端，仅在解析结果真正变化时刷新。
+    """
     SETTING_KEY_PROFILE_USE_SYSTEM_FONT = "use-system-font"
     SETTING_KEY_PROFILE_FONT = "font"
     SETTING_KEY_PROFILE_USE_THEME_COLORS = "use-theme-colors"
@@ -74,61 +582,57 @@ class GeditTerminal(Vte.Terminal):
     SETTING_KEY_PROFILE_SCROLLBACK_UNLIMITED = "scrollback-unlimited"
     SETTING_KEY_PROFILE_SCROLLBACK_LINES = "scrollback-lines"
 
-    TARGET_URI_LIST = 200
+    _default = None
 
-    @debug_log
-    def __init__(self):
-        Vte.Terminal.__init__(self)
+    @classmethod
+    def get_default(cls):
+        """获取进程内唯一的配置服务"""
+        if cls._default is None:
+            cls._default = cls()
+        return cls._default
 
-        # 基础初始化
-        self.set_size(self.get_column_count(), 5)
-        self.set_size_request(200, 50)
+    @classmethod
+    def release_default(cls):
+        """释放进程内的配置服务（插件在所有窗口停用时调用）"""
+        if cls._default is not None:
+            cls._default.shutdown()
+            cls._default = None
 
-        # 拖拽支持初始化
-        tl = Gtk.TargetList.new([])
-        tl.add_uri_targets(self.TARGET_URI_LIST)
-        self.drag_dest_set(Gtk.DestDefaults.HIGHLIGHT | Gtk.DestDefaults.DROP,
-                           [], Gdk.DragAction.DEFAULT | Gdk.DragAction.COPY)
-        self.drag_dest_set_target_list(tl)
+    def __init__(self):
+        self._terminals = set()
+        self._stats = collections.deque(maxlen=self.STATS_HISTORY)
+        self._handlers = []  # [(settings, handler_id)]
 
-        # 配置加载（容错处理）
+        # 配置加载（容错）
         try:
             self.profile_settings = self.get_profile_settings()
             if self.profile_settings:
-                self.profile_settings.connect("changed", self.on_profile_settings_changed)
+                self._handlers.append((self.profile_settings,
+                                       self.profile_settings.connect("changed", self.on_settings_changed)))
         except Exception as e:
-            print(f"[Terminal Multitab] Load profile settings failed: {e}, use default", file=sys.stderr)
+            LOG.warning("Load profile settings failed: %s, use default", e)
             self.profile_settings = None
 
         # 系统字体配置
-        self.system_settings = Gio.Settings.new("org.gnome.desktop.interface")
-        self.system_settings.connect("changed::monospace-font-name", self.font_changed)
-
-        # 终端配置应用
-        self.reconfigure_vte()
-
-        # 启动终端进程（容错）
         try:
-            shell = Vte.get_user_shell()
-            print(f"[Terminal Multitab] Spawn terminal with shell: {shell}", file=sys.stdout)
-            self.spawn_sync(Vte.PtyFlags.DEFAULT, None, [shell], None, 
-                           GLib.SpawnFlags.SEARCH_PATH, None, None, None)
+            self.system_settings = Gio.Settings.new("org.gnome.desktop.interface")
+            self._handlers.append((self.system_settings,
+                                   self.system_settings.connect("changed::monospace-font-name",
+                                                                self.on_settings_changed)))
         except Exception as e:
-            print(f"[Terminal Multitab] Spawn terminal failed: {e}, use /bin/bash", file=sys.stderr)
-            self.spawn_sync(Vte.PtyFlags.DEFAULT, None, ["/bin/bash"], None, 
-                           GLib.SpawnFlags.SEARCH_PATH, None, None, None)
+            LOG.warning("Load system settings failed: %s", e)
+            self.system_settings = None
 
-    def do_drag_data_received(self, drag_context, x, y, data, info, time):
-        try:
-            if info == self.TARGET_URI_LIST:
-                uris = Gedit.utils_drop_get_uris(data)
-                paths = ["'" + Gio.file_new_for_uri(item).get_path() + "'" for item in uris]
-                self.feed_child(' '.join(paths).encode('utf-8'))
-                Gtk.drag_finish(drag_context, True, False, time);
-            else:
-                Vte.Terminal.do_drag_data_received(self, drag_context, x, y, data, info, time)
-        except Exception as e:
-            print(f"[Terminal Multitab] Drag data received error: {e}", file=sys.stderr)
+        self.profile = self.parse_profile()
+
+    def shutdown(self):
+        """断开所有Gio.Settings信号并释放配置对象"""
+        for settings, handler in self._handlers:
+            settings.disconnect(handler)
+        self._handlers = []
+        self._terminals.clear()
+        self.profile_settings = None
+        self.system_settings = None
 
     def get_profile_settings(self):
         """移除自定义schema依赖，仅使用系统终端配置或默认值"""
@@ -141,15 +645,15 @@ class GeditTerminal(Vte.Terminal):
         try:
             # 尝试加载系统终端的默认配置
             profiles = Gio.Settings.new("org.gnome.Terminal.ProfilesList")
-            if not Tepl or not Tepl.utils_can_use_gsettings_key(profiles, "default"):
+            if not Tepl.utils_can_use_gsettings_key(profiles, "default"):
                 return None
 
             default_path = "/org/gnome/terminal/legacy/profiles:/:" + profiles.get_string("default") + "/"
-            if not Tepl or not Tepl.utils_can_use_gsettings_schema("org.gnome.Terminal.Legacy.Profile"):
+            if not Tepl.utils_can_use_gsettings_schema("org.gnome.Terminal.Legacy.Profile"):
                 return None
 
             settings = Gio.Settings.new_with_path("org.gnome.Terminal.Legacy.Profile", default_path)
-            
+
             # 检查核心配置项是否可用
             required_keys = [
                 self.SETTING_KEY_PROFILE_USE_SYSTEM_FONT,
@@ -157,116 +661,1472 @@ class GeditTerminal(Vte.Terminal):
                 self.SETTING_KEY_PROFILE_USE_THEME_COLORS
             ]
             for key in required_keys:
-                if not Tepl or not Tepl.utils_can_use_gsettings_key(settings, key):
+                if not Tepl.utils_can_use_gsettings_key(settings, key):
                     return None
             return settings
         except Exception as e:
-            print(f"[Terminal Multitab] Load system terminal settings failed: {e}", file=sys.stderr)
+            LOG.warning("Load system terminal settings failed: %s", e)
             return None  # 返回None，后续用硬编码默认值
 
     def get_font(self):
+        settings = self.profile_settings
         try:
-            if self.profile_settings and self.profile_settings.get_boolean(self.SETTING_KEY_PROFILE_USE_SYSTEM_FONT):
-                return self.system_settings.get_string("monospace-font-name")
-            elif self.profile_settings:
-                return self.profile_settings.get_string(self.SETTING_KEY_PROFILE_FONT)
+            if settings and settings.get_boolean(self.SETTING_KEY_PROFILE_USE_SYSTEM_FONT):
+                if self.system_settings:
+                    return self.system_settings.get_string("monospace-font-name")
+            elif settings:
+                return settings.get_string(self.SETTING_KEY_PROFILE_FONT)
         except:
             pass
-        return "Monospace 10"  # 默认字体
+        return None
 
-    def font_changed(self, settings=None, key=None):
-        try:
+    # 配置键 -> 受影响的配置组（未列出的键不影响终端）
+    KEY_GROUPS = {
+        SETTING_KEY_PROFILE_USE_SYSTEM_FONT: 'font',
+        SETTING_KEY_PROFILE_FONT: 'font',
+        "monospace-font-name": 'font',
+        SETTING_KEY_PROFILE_USE_THEME_COLORS: 'colors',
+        SETTING_KEY_PROFILE_FOREGROUND_COLOR: 'colors',
+        SETTING_KEY_PROFILE_BACKGROUND_COLOR: 'colors',
+        SETTING_KEY_PROFILE_PALETTE: 'colors',
+        SETTING_KEY_PROFILE_CURSOR_BLINK_MODE: 'cursor_blink_mode',
+        SETTING_KEY_PROFILE_CURSOR_SHAPE: 'cursor_shape',
+        SETTING_KEY_PROFILE_AUDIBLE_BELL: 'audible_bell',
+        SETTING_KEY_PROFILE_SCROLL_ON_KEYSTROKE: 'scroll_on_keystroke',
+        SETTING_KEY_PROFILE_SCROLL_ON_OUTPUT: 'scroll_on_output',
+        SETTING_KEY_PROFILE_SCROLLBACK_UNLIMITED: 'scrollback_lines',
+        SETTING_KEY_PROFILE_SCROLLBACK_LINES: 'scrollback_lines',
+    }
+
+    # 布尔型配置组 -> 配置键
+    BOOLEAN_GROUPS = {
+        'audible_bell': SETTING_KEY_PROFILE_AUDIBLE_BELL,
+        'scroll_on_keystroke': SETTING_KEY_PROFILE_SCROLL_ON_KEYSTROKE,
+        'scroll_on_output': SETTING_KEY_PROFILE_SCROLL_ON_OUTPUT,
+    }
+
+    # 配置值 -> Vte枚举成员名（Vte延迟加载，使用时再取枚举值）
+    CURSOR_BLINK_MODES = {
+        'system': 'SYSTEM',
+        'on': 'ON',
+        'off': 'OFF',
+    }
+
+    CURSOR_SHAPES = {
+        'block': 'BLOCK',
+        'ibeam': 'IBEAM',
+        'underline': 'UNDERLINE',
+    }
+
+    # 每次配置变化记录的失效统计条数
+    STATS_HISTORY = 32
+
+    def parse_profile(self):
+        """读取并解析当前配置，返回TerminalProfile"""
+        profile = TerminalProfile()
+        for group in TerminalProfile.GROUPS:
+            self.parse_group(profile, group)
+        return profile
+
+    def parse_group(self, profile, group):
+        """只解析一个配置组，写入profile（读取失败时保留默认值）"""
+        if group == 'font':
             font = self.get_font()
-            font_desc = Pango.font_description_from_string(font)
-            self.set_font(font_desc)
-        except Exception as e:
-            print(f"[Terminal Multitab] Font change error: {e}", file=sys.stderr)
+            if font:
+                profile.font = Pango.font_description_from_string(font)
+            return
 
-    def reconfigure_vte(self):
+        settings = self.profile_settings
+        if settings is None:
+            # 无配置时用硬编码默认值
+            return
         try:
-            # 字体配置
-            self.font_changed()
+            if group == 'colors':
+                profile.fg = profile.bg = None
+                profile.palette = []
+                # 仅当不使用主题颜色时才加载自定义颜色
+                if not settings.get_boolean(self.SETTING_KEY_PROFILE_USE_THEME_COLORS):
+                    profile.fg = _parse_rgba(settings.get_string(self.SETTING_KEY_PROFILE_FOREGROUND_COLOR))
+                    profile.bg = _parse_rgba(settings.get_string(self.SETTING_KEY_PROFILE_BACKGROUND_COLOR))
+                    palette = [_parse_rgba(c) for c in settings.get_strv(self.SETTING_KEY_PROFILE_PALETTE)]
+                    # 调色板中任意一项无效时整体放弃
+                    profile.palette = palette if None not in palette else []
+            elif group == 'cursor_blink_mode':
+                value = settings.get_string(self.SETTING_KEY_PROFILE_CURSOR_BLINK_MODE)
+                profile.cursor_blink_mode = getattr(Vte.CursorBlinkMode, self.CURSOR_BLINK_MODES.get(value, 'SYSTEM'))
+            elif group == 'cursor_shape':
+                value = settings.get_string(self.SETTING_KEY_PROFILE_CURSOR_SHAPE)
+                profile.cursor_shape = getattr(Vte.CursorShape, self.CURSOR_SHAPES.get(value, 'BLOCK'))
+            elif group == 'scrollback_lines':
+                # 滚动回滚配置
+                if settings.get_boolean(self.SETTING_KEY_PROFILE_SCROLLBACK_UNLIMITED):
+                    profile.scrollback_lines = -1
+                else:
+                    profile.scrollback_lines = settings.get_int(self.SETTING_KEY_PROFILE_SCROLLBACK_LINES)
+            else:
+                setattr(profile, group, settings.get_boolean(self.BOOLEAN_GROUPS[group]))
+        except:
+            pass
 
-            # 颜色配置
-            context = self.get_style_context()
-            fg = context.get_color(Gtk.StateFlags.NORMAL)
-            bg = context.get_background_color(Gtk.StateFlags.NORMAL)
-            palette = []
+    def register(self, terminal):
+        """登记终端并立即应用当前配置"""
+        self._terminals.add(terminal)
+        terminal.apply_profile(self.profile)
+
+    def unregister(self, terminal):
+        self._terminals.discard(terminal)
+
+    def get_invalidation_stats(self):
+        """最近配置变化的统计：[(key, group, 终端数, 整屏失效次数), ...]"""
+        return list(self._stats)
+
+    @traced
+    def on_settings_changed(self, settings, key):
+        """只重新解析并应用该键所属的配置组，值未变化时不触碰终端"""
+        try:
+            group = self.KEY_GROUPS.get(key)
+            if group is None:
+                return
+            profile = self.profile.copy()
+            self.parse_group(profile, group)
+            if profile.group_key(group) == self.profile.group_key(group):
+                return
+            self.profile = profile
+
+            invalidations = 0
+            terminals = list(self._terminals)
+            for terminal in terminals:
+                invalidations += terminal.apply_profile(profile, (group,))
+            self._stats.append((key, group, len(terminals), invalidations))
+            LOG.debug("Profile key %s changed: %d terminals, %d full-grid invalidations",
+                      key, len(terminals), invalidations)
+        except Exception as e:
+            LOG.warning("Profile settings change error: %s", e)
+
+class ScrollbackBudget(object):
+    """插件级滚动回滚预算
+
+    把总预算（GEDIT_TERMINAL_MULTITAB_SCROLLBACK_BUDGET_LINES 行或
+    GEDIT_TERMINAL_MULTITAB_SCROLLBACK_BUDGET_MB 兆字节）按权重分给所有终端：
+    可见的终端权重最高，后台终端次之，长时间无输出的终端最低。
+    两项都为0时不做限制，只使用配置中的滚动行数。
+    """
+    # 每个字符单元的估算内存（文本加属性）
+    BYTES_PER_CELL = 4
+    # 每个终端至少保留的行数
+    MIN_LINES = 100
+    # 分配权重：可见/后台/空闲
+    WEIGHT_ACTIVE = 4.0
+    WEIGHT_BACKGROUND = 1.0
+    WEIGHT_IDLE = 0.25
+    # 定期重新分配的间隔（秒），用于发现变为空闲的终端
+    REBALANCE_INTERVAL = 60
+
+    _default = None
+
+    @classmethod
+    def get_default(cls):
+        """获取进程内唯一的预算管理器"""
+        if cls._default is None:
+            cls._default = cls(env_int('SCROLLBACK_BUDGET_LINES', 0),
+                               env_int('SCROLLBACK_BUDGET_MB', 0),
+                               env_int('SCROLLBACK_IDLE_TIMEOUT', 600))
+        return cls._default
+
+    @classmethod
+    def release_default(cls):
+        """释放进程内的预算管理器"""
+        if cls._default is not None:
+            cls._default.shutdown()
+            cls._default = None
+
+    def __init__(self, budget_lines, budget_mb, idle_timeout):
+        self.budget_lines = max(0, budget_lines)
+        self.budget_bytes = max(0, budget_mb) * 1024 * 1024
+        self.idle_timeout = idle_timeout  # 秒
+        self._terminals = {}  # terminal -> [map/unmap处理器]
+        self._rebalance_id = 0
+        self._timer_id = 0
+
+    def is_enabled(self):
+        return self.budget_lines > 0 or self.budget_bytes > 0
+
+    def shutdown(self):
+        """注销所有终端并移除定时器"""
+        for terminal in list(self._terminals):
+            self.unregister(terminal)
+        for source_id in (self._rebalance_id, self._timer_id):
+            if source_id:
+                GLib.source_remove(source_id)
+        self._rebalance_id = self._timer_id = 0
+
+    def register(self, terminal):
+        if not self.is_enabled():
+            return
+        self._terminals[terminal] = [terminal.connect("map", self.schedule_rebalance),
+                                     terminal.connect("unmap", self.schedule_rebalance)]
+        self.schedule_rebalance()
+        if not self._timer_id:
+            self._timer_id = GLib.timeout_add_seconds(self.REBALANCE_INTERVAL, self._on_timer)
+
+    def unregister(self, terminal):
+        handlers = self._terminals.pop(terminal, None)
+        if handlers is None:
+            return
+        for handler in handlers:
+            terminal.disconnect(handler)
+        self.schedule_rebalance()
+
+    def schedule_rebalance(self, *args):
+        """在空闲时重新分配（合并同一轮中的多次请求）"""
+        if self.is_enabled() and not self._rebalance_id:
+            self._rebalance_id = GLib.idle_add(self.rebalance, priority=GLib.PRIORITY_LOW)
+
+    def _on_timer(self):
+        if not self._terminals:
+            self._timer_id = 0
+            return False
+        self.schedule_rebalance()
+        return True
+
+    def weight(self, terminal, now):
+        if terminal.get_mapped():
+            return self.WEIGHT_ACTIVE
+        if now - terminal.last_activity >= self.idle_timeout:
+            return self.WEIGHT_IDLE
+        return self.WEIGHT_BACKGROUND
+
+    def rebalance(self):
+        """按权重把预算分配给所有终端"""
+        self._rebalance_id = 0
+        if not self._terminals:
+            return False
+        now = time.monotonic()
+        weights = {term: self.weight(term, now) for term in self._terminals}
+        total = sum(weights.values())
+        for term, weight in weights.items():
+            share = weight / total
+            if self.budget_bytes:
+                row_bytes = max(1, term.get_column_count()) * self.BYTES_PER_CELL
+                lines = int(self.budget_bytes * share / row_bytes)
+                if self.budget_lines:
+                    lines = min(lines, int(self.budget_lines * share))
+            else:
+                lines = int(self.budget_lines * share)
+            term.set_scrollback_limit(max(self.MIN_LINES, lines))
+        return False
+
+def _create_terminal_class():
+    """创建终端类（继承Vte.Terminal，需在加载Vte之后调用）"""
+
+    class GeditTerminal(Vte.Terminal):
+        """原终端类，保留所有原有功能（配置同步、拖拽等）"""
+        __gsignals__ = {
+            # shell异步启动完成（pid为-1表示全部失败）
+            "shell-spawned": (
+                GObject.SignalFlags.RUN_LAST,
+                None,
+                (GObject.TYPE_INT,)
+            ),
+            # shell集成（VTE 0.78+ termprop）：命令开始执行 / 命令结束（退出码，未知时为-1）
+            "shell-command-started": (
+                GObject.SignalFlags.RUN_LAST,
+                None,
+                ()
+            ),
+            "shell-command-finished": (
+                GObject.SignalFlags.RUN_LAST,
+                None,
+                (GObject.TYPE_INT,)
+            )
+        }
 
-            # 仅当profile_settings存在时才加载自定义颜色
-            if self.profile_settings is not None and not self.profile_settings.get_boolean(self.SETTING_KEY_PROFILE_USE_THEME_COLORS):
-                # 自定义前景色
+        TARGET_URI_LIST = 200
+        # 拖放文件时每次空闲回调解析的URI数
+        DROP_SLICE = 256
+        # 为1时远程（GVFS）文件使用FUSE挂载路径（可用时），为0时直接输入URI
+        DROP_FUSE_PATHS = env_int('DROP_FUSE_PATHS', 1) != 0
+
+        # 后台终端（所在页不可见或面板隐藏）的输出限速，行/秒，0表示不限速
+        BACKGROUND_RATE_CAP = env_int('BACKGROUND_RATE_CAP', 0)
+        # 为1时后台终端的输出暂停到重新可见为止
+        BACKGROUND_PAUSE = env_int('BACKGROUND_PAUSE', 0) != 0
+
+        @traced
+        def __init__(self, working_directory=None, history=None, command=None):
+            Vte.Terminal.__init__(self)
+
+            # 基础初始化
+            self.set_size(self.get_column_count(), 5)
+            self.set_size_request(200, 50)
+
+            # 拖拽支持初始化
+            tl = Gtk.TargetList.new([])
+            tl.add_uri_targets(self.TARGET_URI_LIST)
+            self.drag_dest_set(Gtk.DestDefaults.HIGHLIGHT | Gtk.DestDefaults.DROP,
+                               [], Gdk.DragAction.DEFAULT | Gdk.DragAction.COPY)
+            self.drag_dest_set_target_list(tl)
+
+            # 终端配置应用（共享配置服务，销毁时注销）
+            self.profile = None
+            self.invalidation_count = 0  # set_font/set_colors引起的整屏失效次数
+            self.scrollback_limit = None  # 滚动回滚预算分配的行数上限，None表示不限制
+            self.last_activity = time.monotonic()
+            self._metrics_rows = 0
+            TerminalProfileSettings.get_default().register(self)
+            ScrollbackBudget.get_default().register(self)
+            self.connect("destroy", self.on_destroy)
+            self.connect("contents-changed", self.on_contents_changed)
+            self.connect("child-exited", self.on_child_exited)
+
+            # 命令行上是否有已输入但未执行的内容（按最后一次发给子进程的输入推断）
+            self.pending_input = False
+            self.connect("commit", self.on_commit)
+
+            # shell集成：收到过命令边界事件后不再需要轮询前台进程
+            self.shell_integrated = False
+            self._shell_command_running = False
+            if ShellIntegration.enabled and GObject.signal_lookup("termprop-changed", Vte.Terminal):
+                self.connect("termprop-changed", self.on_termprop_changed)
+
+            # 后台状态：不可见时VTE不绘制，可选地通过PTY流控限速或暂停输出
+            self.background = False
+            self._output_suspended = False
+            self._slave_fd = -1
+            self._rate_window_start = 0.0
+            self._rate_window_row = 0
+            self._rate_resume_id = 0
+            self.connect("map", lambda term: self.set_background(False))
+            self.connect("unmap", lambda term: self.set_background(True))
+
+            # 恢复保存的滚动回滚内容（只是显示，不发送给shell）
+            if history:
+                self.feed(history.replace('\n', '\r\n').encode('utf-8') + b'\r\n')
+
+            # 向子进程输入大量数据（拖放、粘贴）时分块写入
+            self._feeder = None
+            self._drop_uris = collections.deque()
+            self._drop_id = 0
+            self._drop_started = False
+
+            # 异步启动终端进程（不阻塞主循环）
+            self.child_pid = -1
+            self._hangup_pid = 0  # 已挂断、尚未由VTE回收的shell
+            self._destroyed = False
+            self.spawn_shell(working_directory, command)
+
+        def on_destroy(self, term):
+            # VTE销毁后不再监视子进程：挂断shell并交给ChildReaper回收
+            # （shell仍在启动时由_on_shell_spawned在启动完成后处理）
+            self._destroyed = True
+            self.terminate()
+            if self._hangup_pid > 0:
+                ChildReaper.reap(self._hangup_pid)
+                self._hangup_pid = 0
+            TerminalProfileSettings.get_default().unregister(self)
+            ScrollbackBudget.get_default().unregister(self)
+            self._resume_output()
+            if self._drop_id:
+                GLib.source_remove(self._drop_id)
+                self._drop_id = 0
+            if self._feeder is not None:
+                self._feeder.cancel()
+
+        def on_child_exited(self, term, status):
+            # 子进程已回收，pid可能被复用，之后不能再向它发信号
+            self.child_pid = 0
+            self._hangup_pid = 0
+
+        def terminate(self):
+            """向shell发送SIGHUP（终端存活时由VTE回收，销毁后由ChildReaper回收）"""
+            if self.child_pid > 0:
                 try:
-                    fg_color = self.profile_settings.get_string(self.SETTING_KEY_PROFILE_FOREGROUND_COLOR)
-                    if fg_color != "":
-                        fg = Gdk.RGBA()
-                        fg.parse(fg_color)
-                except:
-                    pass
-                # 自定义背景色
+                    os.kill(self.child_pid, signal.SIGHUP)
+                    self._hangup_pid = self.child_pid
+                except OSError as e:
+                    LOG.debug("SIGHUP %s failed: %s", self.child_pid, e)
+            self.child_pid = 0
+
+        def on_contents_changed(self, term):
+            self.last_activity = now = time.monotonic()
+            if Metrics.enabled:
+                rows = int(self.get_vadjustment().get_upper())
+                Metrics.count('output rows', max(0, rows - self._metrics_rows))
+                self._metrics_rows = rows
+            if self.background and self.BACKGROUND_RATE_CAP > 0 and not self._output_suspended:
+                self._throttle_output(now)
+
+        def set_background(self, background):
+            """标记终端是否处于后台（不可见）"""
+            if background == self.background:
+                return
+            self.background = background
+            if background:
+                self._rate_window_start = time.monotonic()
+                self._rate_window_row = int(self.get_vadjustment().get_upper())
+                if self.BACKGROUND_PAUSE:
+                    self._suspend_output()
+            else:
+                # 重新可见时立即恢复输出
+                if self._rate_resume_id:
+                    GLib.source_remove(self._rate_resume_id)
+                    self._rate_resume_id = 0
+                self._resume_output()
+
+        def _throttle_output(self, now):
+            """按行/秒限速：本秒内输出超过上限时暂停到本秒结束"""
+            row = int(self.get_vadjustment().get_upper())
+            elapsed = now - self._rate_window_start
+            if elapsed >= 1.0:
+                self._rate_window_start = now
+                self._rate_window_row = row
+                return
+            if row - self._rate_window_row > self.BACKGROUND_RATE_CAP and self._suspend_output():
+                delay = max(1, int((1.0 - elapsed) * 1000))
+                self._rate_resume_id = GLib.timeout_add(delay, self._on_rate_window_end)
+
+        def _on_rate_window_end(self):
+            self._rate_resume_id = 0
+            self._rate_window_start = time.monotonic()
+            self._rate_window_row = int(self.get_vadjustment().get_upper())
+            if not (self.background and self.BACKGROUND_PAUSE):
+                self._resume_output()
+            return False
+
+        def _open_slave_fd(self):
+            """打开PTY从设备（用于tcflow），失败返回-1"""
+            pty = self.get_pty()
+            if pty is None:
+                return -1
+            try:
+                buf = fcntl.ioctl(pty.get_fd(), TIOCGPTN, b'\0' * 4)
+                number = struct.unpack('I', buf)[0]
+                return os.open(f"/dev/pts/{number}", os.O_RDWR | os.O_NOCTTY)
+            except (AttributeError, OSError) as e:
+                LOG.warning("Open pty slave failed: %s", e)
+                return -1
+
+        def _suspend_output(self):
+            """暂停子进程的输出（相当于终端发送^S，但不依赖IXON也不写入字符）
+
+            子进程写满PTY缓冲区后会阻塞，VTE不再需要处理输出。
+            """
+            if self._output_suspended:
+                return True
+            self._slave_fd = self._open_slave_fd()
+            if self._slave_fd < 0:
+                return False
+            try:
+                termios.tcflow(self._slave_fd, termios.TCOOFF)
+            except termios.error as e:
+                LOG.warning("Suspend output failed: %s", e)
+                os.close(self._slave_fd)
+                self._slave_fd = -1
+                return False
+            self._output_suspended = True
+            return True
+
+        def _resume_output(self):
+            """恢复子进程的输出"""
+            if not self._output_suspended:
+                return
+            self._output_suspended = False
+            try:
+                termios.tcflow(self._slave_fd, termios.TCOON)
+            except termios.error as e:
+                LOG.warning("Resume output failed: %s", e)
+            finally:
+                os.close(self._slave_fd)
+                self._slave_fd = -1
+
+        def spawn_shell(self, working_directory=None, command=None):
+            """异步启动用户shell，失败时在回调中回退到/bin/bash
+
+            command不为None时用 shell -c 运行该命令（命令结束即子进程退出）。
+            """
+            self.child_pid = -1
+            shell = Vte.get_user_shell() or FALLBACK_SHELL
+            LOG.debug("Spawn terminal with shell: %s", shell)
+            shells = [shell]
+            if shell != FALLBACK_SHELL:
+                shells.append(FALLBACK_SHELL)
+            if command is not None:
+                shells = [[shell, '-c', command] for shell in shells]
+            else:
+                shells = [ShellIntegration.spawn_args(shell) for shell in shells]
+            spawn_shell_async(self, shells, self._on_shell_spawned, working_directory)
+
+        def on_termprop_changed(self, term, name):
+            """shell集成脚本通过OSC 666设置的命令边界termprop
+
+            每次显示提示符都会设置postexec，只有之前设置过preexec（确实执行了命令，
+            而不是空行或Ctrl+C）时才发出shell-command-finished。
+            """
+            if name == getattr(Vte, 'TERMPROP_SHELL_PREEXEC', 'vte.shell.preexec'):
+                self.shell_integrated = True
+                self._shell_command_running = True
+                self.emit("shell-command-started")
+            elif name == getattr(Vte, 'TERMPROP_SHELL_POSTEXEC', 'vte.shell.postexec'):
+                self.shell_integrated = True
+                if not self._shell_command_running:
+                    return
+                self._shell_command_running = False
                 try:
-                    bg_color = self.profile_settings.get_string(self.SETTING_KEY_PROFILE_BACKGROUND_COLOR)
-                    if bg_color != "":
-                        bg = Gdk.RGBA()
-                        bg.parse(bg_color)
-                except:
+                    ok, status = self.get_termprop_uint(name)
+                except Exception:
+                    ok, status = False, 0
+                self.emit("shell-command-finished", status if ok else -1)
+
+        def get_working_directory(self):
+            """shell的当前目录：优先用shell上报的目录URI（OSC 7），否则读/proc"""
+            uri = self.get_current_directory_uri()
+            if uri:
+                try:
+                    return GLib.filename_from_uri(uri)[0]
+                except GLib.Error:
                     pass
-                # 自定义调色板
+            if self.child_pid > 0:
                 try:
-                    str_colors = self.profile_settings.get_strv(self.SETTING_KEY_PROFILE_PALETTE)
-                    if str_colors:
-                        for str_color in str_colors:
-                            try:
-                                rgba = Gdk.RGBA()
-                                rgba.parse(str_color)
-                                palette.append(rgba)
-                            except:
-                                palette = []
-                                break
-                except:
+                    return os.readlink(f"/proc/{self.child_pid}/cwd")
+                except OSError:
                     pass
+            return None
 
-            # 应用颜色配置
-            self.set_colors(fg, bg, palette)
+        def get_row_range(self):
+            """终端内容（滚动回滚+屏幕）的行号范围 (首行, 末行+1)"""
+            adjustment = self.get_vadjustment()
+            return int(adjustment.get_lower()), int(adjustment.get_upper())
 
-            # 其他终端配置（容错：无配置时用硬编码默认值）
-            if self.profile_settings is not None:
-                try:
-                    self.set_audible_bell(self.profile_settings.get_boolean(self.SETTING_KEY_PROFILE_AUDIBLE_BELL))
-                except:
-                    self.set_audible_bell(self.defaults['audible_bell'])
-                try:
-                    self.set_scroll_on_keystroke(self.profile_settings.get_boolean(self.SETTING_KEY_PROFILE_SCROLL_ON_KEYSTROKE))
-                except:
-                    self.set_scroll_on_keystroke(True)
-                try:
-                    self.set_scroll_on_output(self.profile_settings.get_boolean(self.SETTING_KEY_PROFILE_SCROLL_ON_OUTPUT))
-                except:
-                    self.set_scroll_on_output(True)
-                
-                # 滚动回滚配置
-                try:
-                    if self.profile_settings.get_boolean(self.SETTING_KEY_PROFILE_SCROLLBACK_UNLIMITED):
-                        self.set_scrollback_lines(-1)
-                    else:
-                        self.set_scrollback_lines(self.profile_settings.get_int(self.SETTING_KEY_PROFILE_SCROLLBACK_LINES))
-                except:
-                    self.set_scrollback_lines(1000)
-            else:
-                # 无配置时用硬编码默认值
-                self.set_audible_bell(self.defaults['audible_bell'])
-                self.set_scroll_on_keystroke(True)
-                self.set_scroll_on_output(True)
-                self.set_scrollback_lines(1000)  # 默认滚动行数
+        def get_text_rows(self, start_row, end_row):
+            """[start_row, end_row) 行的纯文本，失败时返回空串"""
+            columns = self.get_column_count()
+            try:
+                if hasattr(self, 'get_text_range_format'):
+                    text = self.get_text_range_format(Vte.Format.TEXT, start_row, 0, end_row - 1, columns)[0]
+                else:
+                    text = self.get_text_range(start_row, 0, end_row - 1, columns, None)[0]
+            except Exception as e:
+                LOG.warning("Read terminal text failed: %s", e)
+                return ''
+            return text or ''
+
+        def get_history(self, lines):
+            """最后lines行终端内容（滚动回滚+屏幕）的纯文本"""
+            if lines <= 0:
+                return ''
+            first_row, end_row = self.get_row_range()
+            return self.get_text_rows(max(first_row, end_row - lines), end_row).rstrip()
+
+        def get_foreground_pgrp(self):
+            """PTY的前台进程组，无法获取时返回-1"""
+            pty = self.get_pty()
+            if pty is None or self.child_pid <= 0:
+                return -1
+            try:
+                return os.tcgetpgrp(pty.get_fd())
+            except OSError:
+                return -1
+
+        def is_at_prompt(self):
+            """shell是否空闲（前台进程组就是shell本身，没有运行vim、构建等前台程序）"""
+            return self.child_pid > 0 and self.get_foreground_pgrp() == self.child_pid
+
+        def get_foreground_command(self):
+            """shell中正在运行的前台命令行（从/proc读取），shell空闲时返回None"""
+            pgrp = self.get_foreground_pgrp()
+            if pgrp <= 0 or pgrp == self.child_pid:
+                return None
+            try:
+                with open(f"/proc/{pgrp}/cmdline", 'rb') as f:
+                    argv = f.read().split(b'\0')
+            except OSError:
+                return None
+            if not argv or not argv[0]:
+                return None
+            argv[0] = os.path.basename(argv[0])
+            return b' '.join(arg for arg in argv if arg).decode('utf-8', 'replace')
+
+        def on_commit(self, term, text, size):
+            # 以回车/换行结束表示命令行已提交，Ctrl+C清空命令行；其他输入（含方向键）都视为未执行
+            self.pending_input = not text.endswith(('\r', '\n', '\x03'))
+
+        def is_prompt_empty(self):
+            """shell空闲且命令行上没有未执行的输入（输入cd等命令前检查，避免拼接到用户输入上）"""
+            return self.is_at_prompt() and not self.pending_input
+
+        def is_starting(self):
+            """shell是否仍在启动中（启动失败或已退出时为0）"""
+            return self.child_pid < 0
+
+        def _on_shell_spawned(self, term, pid):
+            if self._destroyed:
+                # 终端在shell启动期间已销毁：挂断刚启动的shell并交给ChildReaper回收
+                if pid > 0:
+                    try:
+                        os.kill(pid, signal.SIGHUP)
+                    except OSError as e:
+                        LOG.debug("SIGHUP %s failed: %s", pid, e)
+                    ChildReaper.reap(pid)
+                return
+            self.child_pid = max(pid, 0)
+            self.pending_input = False
+            self.emit("shell-spawned", pid)
+
+        def get_child_feeder(self):
+            """子进程的分块输入器"""
+            if self._feeder is None:
+                self._feeder = _ChildFeeder(self)
+            return self._feeder
+
+        def paste_text_chunked(self, text, bracketed):
+            """把文本作为粘贴内容分块输入给子进程
+
+            和VTE粘贴一样把换行转换为回车；bracketed为True时用括号粘贴序列包裹，shell
+            不会执行其中的换行（去掉文本中的结束序列，防止提前结束粘贴）。
+            """
+            text = text.replace('\r\n', '\r').replace('\n', '\r')
+            if bracketed:
+                text = '\x1b[200~' + text.replace('\x1b[201~', '') + '\x1b[201~'
+            # 直接写入PTY，不经过VTE的commit信号
+            self.pending_input = bracketed or not text.endswith('\r')
+            self.get_child_feeder().feed(text.encode('utf-8'))
+
+        def do_drag_data_received(self, drag_context, x, y, data, info, time):
+            try:
+                if info == self.TARGET_URI_LIST:
+                    uris = Gedit.utils_drop_get_uris(data)
+                    Gtk.drag_finish(drag_context, True, False, time)
+                    self.drop_uris(uris)
+                else:
+                    Vte.Terminal.do_drag_data_received(self, drag_context, x, y, data, info, time)
+            except Exception as e:
+                LOG.warning("Drag data received error: %s", e)
+
+        def drop_uris(self, uris):
+            """把拖放的URI转换为shell转义后的路径输入给shell
+
+            在空闲回调中分片解析，解析结果交给分块输入器，大量文件也不阻塞主循环。
+            """
+            if not uris:
+                return
+            self._drop_uris.extend(uris)
+            if not self._drop_id:
+                self._drop_started = False
+                self._drop_id = GLib.idle_add(self._resolve_drop_slice)
+
+        def _resolve_drop_slice(self):
+            words = []
+            for _i in range(min(self.DROP_SLICE, len(self._drop_uris))):
+                path = self.uri_to_path(self._drop_uris.popleft())
+                if path:
+                    words.append(shlex.quote(path))
+            if words:
+                # 各分片之间用空格分隔，最后不加空格（与一次性输入的结果相同）
+                text = ' '.join(words)
+                if self._drop_started:
+                    text = ' ' + text
+                self._drop_started = True
+                self.pending_input = True
+                self.get_child_feeder().feed(text.encode('utf-8'))
+            if self._drop_uris:
+                return True
+            self._drop_id = 0
+            return False
 
+        @classmethod
+        def uri_to_path(cls, uri):
+            """URI对应的本地路径；远程文件按配置使用GVFS的FUSE路径或URI本身"""
+            location = Gio.File.new_for_uri(uri)
+            if location.is_native() or cls.DROP_FUSE_PATHS:
+                path = location.get_path()
+                if path:
+                    return path
+            return uri
+
+        def apply_profile(self, profile, groups=None):
+            """应用共享配置服务推送的配置
+
+            groups为None时应用全部配置组，否则只应用列出的组。
+            返回本次引起的整屏失效（set_font/set_colors）次数。
+            """
+            self.profile = profile
+            before = self.invalidation_count
+            with log_span("Reconfigure %s", groups or 'all'):
+                for group in (TerminalProfile.GROUPS if groups is None else groups):
+                    try:
+                        getattr(self, '_apply_' + group)(profile)
+                    except Exception as e:
+                        LOG.warning("Apply profile %s error: %s", group, e)
+            return self.invalidation_count - before
+
+        def reconfigure_vte(self):
+            """重新应用全部配置"""
+            if self.profile is not None:
+                self.apply_profile(self.profile)
+
+        def _apply_font(self, profile):
+            self.invalidation_count += 1
+            self.set_font(profile.font)
+
+        def _apply_colors(self, profile):
+            # 未自定义时使用主题颜色
+            context = self.get_style_context()
+            fg = profile.fg or context.get_color(Gtk.StateFlags.NORMAL)
+            bg = profile.bg or context.get_background_color(Gtk.StateFlags.NORMAL)
+            self.invalidation_count += 1
+            self.set_colors(fg, bg, profile.palette)
+
+        def _apply_cursor_blink_mode(self, profile):
+            self.set_cursor_blink_mode(profile.cursor_blink_mode)
+
+        def _apply_cursor_shape(self, profile):
+            self.set_cursor_shape(profile.cursor_shape)
+
+        def _apply_audible_bell(self, profile):
+            self.set_audible_bell(profile.audible_bell)
+
+        def _apply_scroll_on_keystroke(self, profile):
+            self.set_scroll_on_keystroke(profile.scroll_on_keystroke)
+
+        def _apply_scroll_on_output(self, profile):
+            self.set_scroll_on_output(profile.scroll_on_output)
+
+        def _apply_scrollback_lines(self, profile):
+            # 配置的行数不超过滚动回滚预算分配的上限
+            lines = profile.scrollback_lines
+            limit = self.scrollback_limit
+            if limit is not None and (lines < 0 or lines > limit):
+                lines = limit
+            if lines != self.get_scrollback_lines():
+                self.set_scrollback_lines(lines)
+
+        def set_scrollback_limit(self, lines):
+            """设置滚动回滚行数上限（None表示只使用配置值）"""
+            if lines == self.scrollback_limit:
+                return
+            self.scrollback_limit = lines
+            if self.profile is not None:
+                self._apply_scrollback_lines(self.profile)
+
+        def get_scrollback_usage(self):
+            """估算滚动回滚占用：返回 (行数, 字节数)"""
+            vadj = self.get_vadjustment()
+            rows = max(0, int(vadj.get_upper() - vadj.get_lower()))
+            return rows, rows * self.get_column_count() * ScrollbackBudget.BYTES_PER_CELL
+
+    return GeditTerminal
+
+class TerminalPool(object):
+    """预热终端池
+
+    在低优先级空闲回调中预先创建并启动好shell的终端，新建Tab和终端退出重建时
+    直接取用，取走后再补充。空闲超过超时时间的终端会被销毁重建，限制内存占用。
+    池大小由 GEDIT_TERMINAL_MULTITAB_POOL_SIZE 配置（默认0，即关闭）。
+    """
+    _default = None
+
+    @classmethod
+    def get_default(cls):
+        """获取进程内唯一的终端池"""
+        if cls._default is None:
+            cls._default = cls(env_int('POOL_SIZE', 0), env_int('POOL_IDLE_TIMEOUT', 600))
+        return cls._default
+
+    @classmethod
+    def release_default(cls):
+        """销毁进程内的终端池"""
+        if cls._default is not None:
+            cls._default.clear()
+            cls._default = None
+
+    def __init__(self, size, idle_timeout):
+        self.size = max(0, size)
+        self.idle_timeout = idle_timeout  # 秒，<=0 表示不过期
+        self._entries = []  # [(terminal, 入池时间, [信号处理器])]
+        self._refill_id = 0
+        self._expire_id = 0
+
+    def acquire(self):
+        """取出一个终端（优先已就绪的），池空时返回None；随后在空闲时补充"""
+        if self.size <= 0:
+            return None
+        entry = None
+        for candidate in self._entries:
+            if candidate[0].child_pid > 0:
+                entry = candidate
+                break
+        if entry is None:
+            # 没有已就绪的终端时取仍在启动中的（启动失败的终端已被丢弃）
+            entry = next((candidate for candidate in self._entries if candidate[0].is_starting()), None)
+        if entry is not None:
+            self._remove(entry)
+        self.schedule_refill()
+        return entry[0] if entry else None
+
+    def schedule_refill(self):
+        """在低优先级空闲回调中补充终端"""
+        if self.size > 0 and not self._refill_id:
+            self._refill_id = GLib.idle_add(self._refill, priority=GLib.PRIORITY_LOW)
+
+    def clear(self):
+        """销毁池中所有终端"""
+        for entry in list(self._entries):
+            self._remove(entry)
+            entry[0].terminate()
+            entry[0].destroy()
+        for source_id in (self._refill_id, self._expire_id):
+            if source_id:
+                GLib.source_remove(source_id)
+        self._refill_id = self._expire_id = 0
+
+    def _remove(self, entry):
+        self._entries.remove(entry)
+        for handler in entry[2]:
+            entry[0].disconnect(handler)
+
+    def _refill(self):
+        # 每次空闲回调只创建一个终端，避免长时间占用主循环
+        if len(self._entries) >= self.size:
+            self._refill_id = 0
+            return False
+        try:
+            term = GeditTerminal()
         except Exception as e:
-            print(f"[Terminal Multitab] Reconfigure VTE error: {e}", file=sys.stderr)
+            LOG.warning("Pool refill failed: %s", e)
+            self._refill_id = 0
+            return False
+        handlers = [term.connect("child-exited", self._on_child_exited),
+                    term.connect("shell-spawned", self._on_shell_spawned)]
+        self._entries.append((term, time.monotonic(), handlers))
+        LOG.debug("Pool refilled: %s/%s", len(self._entries), self.size)
+        if self.idle_timeout > 0 and not self._expire_id:
+            self._expire_id = GLib.timeout_add_seconds(max(1, self.idle_timeout // 2), self._expire)
+        if len(self._entries) >= self.size:
+            self._refill_id = 0
+            return False
+        return True
+
+    def _on_child_exited(self, term, status):
+        """池中的shell意外退出：丢弃并补充"""
+        self._discard(term)
+        self.schedule_refill()
+
+    def _on_shell_spawned(self, term, pid):
+        """池中的终端启动shell失败：丢弃（不补充，避免反复启动失败）"""
+        if pid < 0:
+            LOG.warning("Pool terminal failed to start a shell, discard it")
+            self._discard(term)
+
+    def _discard(self, term):
+        for entry in self._entries:
+            if entry[0] is term:
+                self._remove(entry)
+                term.terminate()
+                term.destroy()
+                break
+
+    def _expire(self):
+        """销毁空闲过久的终端并重新补充"""
+        now = time.monotonic()
+        for entry in list(self._entries):
+            if now - entry[1] >= self.idle_timeout:
+                LOG.debug("Pool terminal expired, restart")
+                self._remove(entry)
+                entry[0].terminate()
+                entry[0].destroy()
+        self.schedule_refill()
+        if not self._entries and not self._refill_id:
+            self._expire_id = 0
+            return False
+        return True
+
+class TerminalPane(object):
+    """Tab中分屏出来的终端窗格：终端、容器（终端+滚动条）与面板连接的信号处理器"""
+    __slots__ = ('terminal', 'box', 'handlers')
+
+    def __init__(self, terminal, box):
+        self.terminal = terminal
+        self.box = box
+        self.handlers = []
+
+class TerminalTab(object):
+    """一个终端会话的记录：终端、页面容器与标签
+
+    会话归TerminalSessionManager所有，panel为当前显示它的面板（None表示已分离）。
+    terminal为None时表示尚未创建终端的占位Tab。
+
+    分屏时page中是由Gtk.Paned组成的窗格树：terminal（及pane_box）为主窗格，
+    splits为分出的其他窗格，focus为最近获得焦点的终端（复制、粘贴、切换目录都作用于它）。
+    """
+    __slots__ = ('index', 'title', 'terminal', 'handlers', 'page', 'label', 'tab_widget', 'panel',
+                 'working_directory', 'history_file', 'command', 'command_start', 'cwd_name', 'mark',
+                 'seen_activity', 'pane_box', 'splits', 'focus', 'run_name', 'run_pending', 'run_source',
+                 'run_active', 'exit_status')
+
+    # 标签前的状态标记：后台有新输出 / 后台命令已结束
+    MARK_ACTIVITY = '\u25cf '
+    MARK_DONE = '\u2714 '
+    # 标签上显示的命令最大长度
+    MAX_COMMAND_LENGTH = 32
+
+    def __init__(self, index):
+        self.index = index
+        self.title = f"{_('Terminal')} {index}"
+        self.terminal = None
+        self.handlers = []  # 面板连接到终端上的信号处理器
+        self.page = None
+        self.label = None
+        self.tab_widget = None  # Notebook标签（标题+关闭按钮）
+        self.panel = None
+        # 分屏窗格
+        self.pane_box = None
+        self.splits = []
+        self.focus = None
+        # 命令Tab（见GeditTerminalPanel.run_command）
+        self.run_name = None  # 命令Tab的名称，普通Tab为None
+        self.run_pending = None  # 等待运行的 (命令, 工作目录)
+        self.run_source = 0
+        self.run_active = False  # 命令进程是否还在运行
+        self.exit_status = None  # 上一次命令的退出码
+        # 从保存的会话恢复的启动目录和滚动回滚文件（见SessionStore），创建终端时才读取
+        self.working_directory = None
+        self.history_file = None
+        # 进程监视器维护的状态（见ProcessMonitor）
+        self.command = None  # 前台命令，shell空闲时为None
+        self.command_start = 0.0
+        self.cwd_name = None
+        self.mark = ''
+        self.seen_activity = 0.0
+
+    def get_terminals(self):
+        """Tab中所有窗格的终端（主窗格在前）"""
+        if self.terminal is None:
+            return []
+        return [self.terminal] + [pane.terminal for pane in self.splits]
+
+    def get_focused_terminal(self):
+        """最近获得焦点的窗格的终端（没有分屏时即主终端，占位Tab为None）"""
+        return self.focus if self.focus is not None else self.terminal
+
+    def update_label(self):
+        """按标记、前台命令或当前目录刷新标签文字（无变化时不重绘）"""
+        if self.label is None:
+            return
+        if self.command:
+            detail = self.command
+            if len(detail) > self.MAX_COMMAND_LENGTH:
+                detail = detail[:self.MAX_COMMAND_LENGTH - 1] + '\u2026'
+            text = f"{self.mark}{self.title}: {detail}"
+        elif self.cwd_name:
+            text = f"{self.mark}{self.title}: {self.cwd_name}"
+        else:
+            text = f"{self.mark}{self.title}"
+        if self.exit_status is not None and not self.command:
+            text += f" ({_('exit')} {self.exit_status})"
+        if self.label.get_text() != text:
+            self.label.set_text(text)
+
+    def set_working_directory(self, cwd):
+        """记录标签上显示的当前目录名"""
+        self.cwd_name = (os.path.basename(cwd.rstrip('/')) or cwd) if cwd else None
+
+    def clear_marks(self):
+        """Tab被查看后清除新输出/命令结束标记"""
+        self.mark = ''
+        if isinstance(self.terminal, GeditTerminal):
+            self.seen_activity = self.terminal.last_activity
+        self.update_label()
+
+class TerminalSessionManager(object):
+    """应用级终端会话管理器
+
+    所有窗口的终端会话都归它所有，各窗口的面板只是会话的视图：会话可以在面板
+    之间移动，窗口关闭时会话分离并保留下来，由新窗口接管或移动到其他窗口。
+    插件在应用级停用时才真正结束所有会话。
+    """
+    _default = None
+
+    @classmethod
+    def get_default(cls):
+        """获取进程内唯一的会话管理器"""
+        if cls._default is None:
+            cls._default = cls()
+        return cls._default
+
+    @classmethod
+    def release_default(cls):
+        """结束所有会话并释放会话管理器"""
+        if cls._default is not None:
+            cls._default.shutdown()
+            cls._default = None
+
+    def __init__(self):
+        self._sessions = []  # 所有会话，按创建顺序
+        self._panels = []
+        self._counter = 0
+
+    def next_index(self):
+        """分配全局唯一的终端编号"""
+        self._counter += 1
+        return self._counter
+
+    def reserve_index(self, index):
+        """恢复会话时保留已用的终端编号，之后新建的编号不与之重复"""
+        self._counter = max(self._counter, index)
+
+    def add_session(self, tab):
+        self._sessions.append(tab)
+
+    def remove_session(self, tab):
+        if tab in self._sessions:
+            self._sessions.remove(tab)
+
+    def add_panel(self, panel):
+        self._panels.append(panel)
+
+    def remove_panel(self, panel):
+        if panel in self._panels:
+            self._panels.remove(panel)
+
+    def get_sessions(self):
+        return list(self._sessions)
+
+    def get_ordered_sessions(self):
+        """按显示顺序排列的会话：依次为各面板中的Tab，最后是已分离的会话"""
+        sessions = []
+        for panel in self._panels:
+            sessions.extend(panel.get_sessions())
+        sessions.extend(self.get_detached_sessions())
+        return sessions
+
+    def get_current_session(self):
+        for panel in self._panels:
+            tab = panel.get_current_tab()
+            if tab is not None:
+                return tab
+        return None
+
+    def get_detached_sessions(self):
+        """未被任何面板显示的会话"""
+        return [tab for tab in self._sessions if tab.panel is None]
 
-    def on_profile_settings_changed(self, settings, key):
+    def move_session(self, tab, panel):
+        """把会话移动到指定面板（终端和shell保持不变，原面板没有Tab时显示空视图）"""
+        if tab.panel is panel:
+            return
+        old_panel = tab.panel
+        if old_panel is not None:
+            old_panel.detach_tab(tab)
+        panel.attach_tab(tab, select=True)
+
+    @traced
+    def shutdown(self):
+        """结束所有会话：挂断shell并销毁终端"""
+        for panel in list(self._panels):
+            panel.close_tabs(replace=False)
+        for tab in self.get_detached_sessions():
+            GeditTerminalPanel.destroy_session(tab)
+        self._sessions = []
+        self._panels = []
+
+class ProcessMonitor(object):
+    """终端进程监视器
+
+    低频轮询各Tab的PTY前台进程组（tcgetpgrp）和/proc，把正在运行的命令和当前目录
+    显示在Tab标签上，标记后台Tab的新输出和已结束的命令，长时间运行的命令结束时可发送
+    桌面通知。每次只轮流检查固定数量的Tab，Tab再多开销也有上限。
+    """
+    _default = None
+
+    @classmethod
+    def get_default(cls):
+        """获取进程内唯一的进程监视器"""
+        if cls._default is None:
+            cls._default = cls(env_int('MONITOR_INTERVAL', 1000), env_int('MONITOR_BATCH', 8),
+                               env_int('MONITOR_NOTIFY_AFTER', 10))
+        return cls._default
+
+    @classmethod
+    def release_default(cls):
+        """停止进程监视器"""
+        if cls._default is not None:
+            cls._default.shutdown()
+            cls._default = None
+
+    def __init__(self, interval, batch, notify_after):
+        self.interval = interval  # 毫秒，<=0 表示关闭
+        self.batch = max(1, batch)
+        self.notify_after = notify_after  # 秒，<=0 表示不通知
+        self._cursor = 0
+        self._source_id = 0
+        if interval > 0:
+            self._source_id = GLib.timeout_add(interval, self._poll)
+
+    def shutdown(self):
+        if self._source_id:
+            GLib.source_remove(self._source_id)
+            self._source_id = 0
+
+    def _poll(self):
+        sessions = TerminalSessionManager.get_default().get_sessions()
+        count = min(self.batch, len(sessions))
+        for i in range(count):
+            tab = sessions[(self._cursor + i) % len(sessions)]
+            try:
+                self.update(tab)
+            except Exception as e:
+                LOG.warning("Monitor %s failed: %s", tab.title, e)
+        self._cursor = (self._cursor + count) % len(sessions) if sessions else 0
+        return True
+
+    def update(self, tab):
+        """检查一个Tab的前台命令、当前目录和新输出，并刷新标签"""
+        term = tab.terminal
+        if not isinstance(term, GeditTerminal) or term.is_starting():
+            return
+        visible = tab.page.get_mapped()
+        if not term.shell_integrated:
+            # 没有shell集成事件时轮询前台进程和当前目录
+            command = term.get_foreground_command()
+            now = time.monotonic()
+            if command != tab.command:
+                if tab.command is not None and command is None:
+                    self.on_command_finished(tab, tab.command, now - tab.command_start, visible)
+                tab.command = command
+                tab.command_start = now
+            tab.set_working_directory(term.get_working_directory())
+        elif tab.command is not None and tab.run_name is None:
+            # 命令边界由shell上报，只需补全命令名（命令开始时shell可能还没创建前台进程）
+            tab.command = term.get_foreground_command() or tab.command
+        if visible:
+            tab.mark = ''
+            tab.seen_activity = term.last_activity
+        elif not tab.mark and term.last_activity > tab.seen_activity:
+            tab.mark = TerminalTab.MARK_ACTIVITY
+        tab.update_label()
+
+    def on_command_finished(self, tab, command, elapsed, visible):
+        LOG.debug("%s: '%s' finished after %.1f s", tab.title, command, elapsed)
+        if not visible:
+            tab.mark = TerminalTab.MARK_DONE
+        if self.notify_after <= 0 or elapsed < self.notify_after:
+            return
+        toplevel = tab.page.get_toplevel()
+        if visible and isinstance(toplevel, Gtk.Window) and toplevel.is_active():
+            return
+        app = Gio.Application.get_default()
+        if app is None:
+            return
+        notification = Gio.Notification.new(_("Command finished"))
+        notification.set_body(f"{tab.title}: {command} ({int(elapsed)} s)")
+        app.send_notification(f"terminal-multitab-{tab.index}", notification)
+
+class TerminalSearch(object):
+    """跨Tab增量搜索任务
+
+    在低优先级空闲回调中逐个终端、每次读取CHUNK_ROWS行文本并统计匹配，从不一次复制
+    整个滚动回滚，新的输入到来时可随时取消。完成一个终端后调用 on_progress(results)，
+    全部完成后调用 on_done(results)，results为 [(Tab, 匹配数)]（只含有匹配的Tab）。
+    """
+    CHUNK_ROWS = 500
+
+    def __init__(self, regex, tabs, on_progress, on_done):
+        self.regex = regex  # 编译好的Python正则
+        self.results = []
+        # 排队的 (Tab, 终端)：Tab关闭或终端退出重建后该项作废，不再读取
+        self._queue = collections.deque((tab, tab.terminal) for tab in tabs
+                                        if isinstance(tab.terminal, GeditTerminal))
+        self._on_progress = on_progress
+        self._on_done = on_done
+        self._row = self._end_row = 0
+        self._count = 0
+        self._source_id = 0
+
+    def start(self):
+        self._start_tab()
+        self._source_id = GLib.idle_add(self._step, priority=GLib.PRIORITY_LOW)
+
+    def cancel(self):
+        if self._source_id:
+            GLib.source_remove(self._source_id)
+            self._source_id = 0
+
+    def _start_tab(self):
+        """跳过已作废的项，从下一个终端的第一行开始"""
+        while self._queue and self._queue[0][0].terminal is not self._queue[0][1]:
+            self._queue.popleft()
+        if self._queue:
+            self._row, self._end_row = self._queue[0][1].get_row_range()
+        self._count = 0
+
+    def _step(self):
+        if not self._queue:
+            self._source_id = 0
+            self._on_done(self.results)
+            return False
+        tab, term = self._queue[0]
+        if tab.terminal is not term:
+            # 搜索期间Tab已关闭或终端已重建，丢弃已统计的部分
+            self._queue.popleft()
+            self._start_tab()
+            return True
+        end = min(self._row + self.CHUNK_ROWS, self._end_row)
+        text = term.get_text_rows(self._row, end)
+        self._count += sum(1 for _m in self.regex.finditer(text))
+        self._row = end
+        if self._row < self._end_row:
+            return True
+        # 当前终端搜索完成
+        self._queue.popleft()
+        if self._count:
+            self.results.append((tab, self._count))
+            self._on_progress(self.results)
+        self._start_tab()
+        return True
+
+class ScrollbackExporter(object):
+    """分块导出终端内容（滚动回滚+屏幕）
+
+    在低优先级空闲回调中每次读取CHUNK_ROWS行交给 write(text)，内存占用与滚动回滚
+    大小无关；终端销毁时自动取消。完成后调用 on_done(ok)。
+    """
+    CHUNK_ROWS = 1000
+
+    def __init__(self, terminal, write, on_done=None, strip=False):
+        self.terminal = terminal
+        self._write = write
+        self._on_done = on_done
+        self._strip = strip
+        self._row, self._end_row = terminal.get_row_range()
+        self._source_id = 0
+        self._destroy_handler = terminal.connect("destroy", lambda term: self._finish(False))
+
+    def start(self):
+        self._source_id = GLib.idle_add(self._step, priority=GLib.PRIORITY_LOW)
+
+    def _step(self):
+        end = min(self._row + self.CHUNK_ROWS, self._end_row)
+        text = self.terminal.get_text_rows(self._row, end)
+        self._row = end
+        if self._strip:
+            text = CONTROL_SEQUENCES.sub('', text)
         try:
-            self.reconfigure_vte()
-        except Exception as e:
-            print(f"[Terminal Multitab] Profile settings change error: {e}", file=sys.stderr)
+            if text:
+                self._write(text)
+        except GLib.Error as e:
+            LOG.warning("Export scrollback failed: %s", e)
+            self._source_id = 0
+            self._finish(False)
+            return False
+        if self._row < self._end_row:
+            return True
+        self._source_id = 0
+        self._finish(True)
+        return False
+
+    def _finish(self, ok):
+        if self._source_id:
+            GLib.source_remove(self._source_id)
+            self._source_id = 0
+        if self._destroy_handler:
+            self.terminal.disconnect(self._destroy_handler)
+            self._destroy_handler = 0
+            if self._on_done is not None:
+                self._on_done(ok)
+
+class SessionStore(object):
+    """终端会话的保存与恢复
+
+    会话索引（顺序、标题、当前目录）以gzip压缩的JSON保存在用户数据目录下，可选的
+    最后若干行滚动回滚每个Tab单独压缩保存在history目录中（索引只记录文件名），
+    在空闲定时器中和插件释放时写入。恢复时只读取索引并创建占位Tab，终端和shell在
+    Tab首次可见时才创建并读取该Tab的滚动回滚，恢复耗时与保存的内容多少无关。
+    """
+    VERSION = 2
+    # 每个Tab保存的滚动回滚内容上限（字节）
+    MAX_HISTORY_BYTES = 256 * 1024
+
+    _default = None
+
+    @classmethod
+    def get_default(cls):
+        """获取进程内唯一的会话存储"""
+        if cls._default is None:
+            cls._default = cls(os.path.join(GLib.get_user_data_dir(), 'gedit', 'terminal_multitab',
+                                            'session.json.gz'),
+                               env_int('SESSION_RESTORE', 1) != 0,
+                               env_int('SESSION_SCROLLBACK_LINES', 0),
+                               env_int('SESSION_SAVE_INTERVAL', 60))
+        return cls._default
+
+    @classmethod
+    def release_default(cls):
+        """保存会话并释放会话存储（须在结束会话之前调用）"""
+        if cls._default is not None:
+            cls._default.shutdown()
+            cls._default = None
+
+    def __init__(self, path, enabled, scrollback_lines, save_interval):
+        self.path = path
+        self.history_dir = os.path.join(os.path.dirname(path), 'history')
+        self.enabled = enabled
+        self.scrollback_lines = max(0, scrollback_lines)
+        self._restored = False
+        self._last_data = None
+        self._last_history = {}  # 文件名 -> 上次写入的内容
+        self._save_id = 0
+        if enabled and save_interval > 0:
+            self._save_id = GLib.timeout_add_seconds(save_interval, self._on_save_timer)
+
+    def shutdown(self):
+        if self._save_id:
+            GLib.source_remove(self._save_id)
+            self._save_id = 0
+        self.save()
+
+    def _on_save_timer(self):
+        self.save()
+        return True
+
+    def _tab_state(self, tab, histories):
+        """Tab的索引项；要写入的滚动回滚放入histories（文件名 -> 内容）"""
+        if tab.run_name is not None:
+            # 命令Tab恢复为同名的命令Tab（命令不会重新运行，之后的run_command继续使用它）
+            return {'index': tab.index, 'title': tab.title, 'run_name': tab.run_name}
+        state = {'index': tab.index, 'title': tab.title}
+        name = f"{tab.index}.txt.gz"
+        term = tab.terminal
+        if isinstance(term, GeditTerminal):
+            working_directory = term.get_working_directory()
+            history = term.get_history(self.scrollback_lines) if self.scrollback_lines else None
+            if history:
+                histories[name] = history.encode('utf-8')[-self.MAX_HISTORY_BYTES:]
+                state['history'] = name
+        else:
+            # 未创建终端的占位Tab保留恢复时的状态（滚动回滚文件原样保留，不读取）
+            working_directory = tab.working_directory
+            if self.scrollback_lines and tab.history_file is not None:
+                state['history'] = os.path.basename(tab.history_file)
+        if working_directory:
+            state['cwd'] = working_directory
+        return state
+
+    @traced
+    def save(self):
+        """写入当前所有会话的状态（内容未变化时跳过）"""
+        if not self.enabled:
+            return
+        manager = TerminalSessionManager.get_default()
+        sessions = manager.get_ordered_sessions()
+        current = manager.get_current_session()
+        histories = {}
+        tabs = [self._tab_state(tab, histories) for tab in sessions]
+        data = json.dumps({
+            'version': self.VERSION,
+            'current': sessions.index(current) if current in sessions else 0,
+            'tabs': tabs,
+        }, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        try:
+            # 先写滚动回滚（只写有变化的），再写引用它们的索引
+            for name, history in histories.items():
+                if self._last_history.get(name) != history:
+                    os.makedirs(self.history_dir, exist_ok=True)
+                    self._write(os.path.join(self.history_dir, name), history)
+                    self._last_history[name] = history
+            if data != self._last_data:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                self._write(self.path, data)
+                self._last_data = data
+                LOG.debug("Session saved: %s tabs, %s bytes", len(sessions), len(data))
+        except OSError as e:
+            LOG.warning("Save session failed: %s", e)
+            return
+        self._remove_unused_histories(set(tab['history'] for tab in tabs if 'history' in tab))
+
+    @staticmethod
+    def _write(path, data):
+        """压缩写入临时文件后替换，写入中途退出不会损坏原文件"""
+        tmp_path = path + '.tmp'
+        with gzip.open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def _remove_unused_histories(self, used):
+        """删除索引不再引用的滚动回滚文件（已关闭的Tab）"""
+        try:
+            names = os.listdir(self.history_dir)
+        except FileNotFoundError:
+            return
+        except OSError as e:
+            LOG.warning("List session histories failed: %s", e)
+            return
+        for name in names:
+            if name not in used:
+                self._last_history.pop(name, None)
+                try:
+                    os.remove(os.path.join(self.history_dir, name))
+                except OSError as e:
+                    LOG.warning("Remove session history failed: %s", e)
+
+    @staticmethod
+    def read_history(path):
+        """读取一个Tab保存的滚动回滚（创建该Tab的终端时调用），没有或读取失败时返回None"""
+        if path is None:
+            return None
+        try:
+            with gzip.open(path, 'rb') as f:
+                data = f.read(SessionStore.MAX_HISTORY_BYTES)
+        except FileNotFoundError:
+            return None
+        except (OSError, EOFError) as e:
+            LOG.warning("Load session history failed: %s", e)
+            return None
+        return data.decode('utf-8', 'ignore')
+
+    def take_saved(self):
+        """读取保存的会话（每个进程只恢复一次），返回(Tab状态列表, 当前Tab序号)"""
+        if not self.enabled or self._restored:
+            return [], 0
+        self._restored = True
+        try:
+            with gzip.open(self.path, 'rb') as f:
+                state = json.loads(f.read().decode('utf-8'))
+        except FileNotFoundError:
+            return [], 0
+        except (OSError, EOFError, ValueError) as e:
+            LOG.warning("Load session failed: %s", e)
+            return [], 0
+        if not isinstance(state, dict) or state.get('version') != self.VERSION:
+            return [], 0
+        tabs = state.get('tabs')
+        if not isinstance(tabs, list):
+            return [], 0
+        # 文件可能损坏或被手工修改：类型不对的Tab直接丢弃
+        tabs = [tab for tab in tabs if self._is_valid_tab_state(tab)]
+        for tab in tabs:
+            # 滚动回滚只记录文件名，创建终端时才读取
+            name = tab.pop('history', None)
+            if name:
+                tab['history_file'] = os.path.join(self.history_dir, name)
+        current = state.get('current')
+        if not self._is_int(current):
+            current = 0
+        return tabs, current
+
+    @staticmethod
+    def _is_int(value):
+        return isinstance(value, int) and not isinstance(value, bool)
+
+    @classmethod
+    def _is_valid_tab_state(cls, tab):
+        """保存的Tab状态是否可用于恢复"""
+        if not isinstance(tab, dict) or not cls._is_int(tab.get('index')) or tab['index'] <= 0:
+            return False
+        if not all(tab.get(key) is None or isinstance(tab[key], str) for key in ('title', 'cwd', 'history', 'run_name')):
+            return False
+        # 滚动回滚文件名不能指向history目录之外
+        history = tab.get('history')
+        return history is None or (history == os.path.basename(history) and history not in ('.', '..'))
 
 class GeditTerminalPanel(Gtk.Box):
     """改造为多Tab终端面板，保留原插件所有功能"""
@@ -275,30 +2135,63 @@ class GeditTerminalPanel(Gtk.Box):
             GObject.SignalFlags.RUN_LAST,
             None,
             (GObject.TYPE_OBJECT,)
+        ),
+        # run_command的命令结束：(Tab名称, 退出码)
+        "command-finished": (
+            GObject.SignalFlags.RUN_LAST,
+            None,
+            (GObject.TYPE_STRING, GObject.TYPE_INT)
         )
     }
 
-    @debug_log
+    # 懒加载：终端在所在页首次可见时才创建（GEDIT_TERMINAL_MULTITAB_LAZY=0 关闭）
+    LAZY = env_int('LAZY', 1) != 0
+
+    # run_command的防抖时间（毫秒）：期间再次运行同一Tab的命令只执行最后一次
+    RUN_DEBOUNCE = env_int('RUN_DEBOUNCE', 300)
+    # shell集成上报命令开始后，读不到前台命令名时再次读取的延迟（毫秒）
+    COMMAND_NAME_DELAY = 100
+
+    ACCEL_BASE = '<gedit>/plugins/terminal_multitab'
+    # 快捷键名 -> (默认keyval, 默认修饰键, 处理方法名)
+    ACCELS = {
+        'copy-clipboard': (Gdk.KEY_C, Gdk.ModifierType.CONTROL_MASK | Gdk.ModifierType.SHIFT_MASK, 'copy_clipboard'),
+        'paste-clipboard': (Gdk.KEY_V, Gdk.ModifierType.CONTROL_MASK | Gdk.ModifierType.SHIFT_MASK, 'paste_clipboard'),
+        'search': (Gdk.KEY_F, Gdk.ModifierType.CONTROL_MASK | Gdk.ModifierType.SHIFT_MASK, 'show_search_bar'),
+        'split-right': (Gdk.KEY_E, Gdk.ModifierType.CONTROL_MASK | Gdk.ModifierType.SHIFT_MASK, 'split_right'),
+        'split-below': (Gdk.KEY_O, Gdk.ModifierType.CONTROL_MASK | Gdk.ModifierType.SHIFT_MASK, 'split_below'),
+        'close-pane': (Gdk.KEY_W, Gdk.ModifierType.CONTROL_MASK | Gdk.ModifierType.SHIFT_MASK, 'close_current_pane'),
+    }
+    # 可能触发gedit快捷键的修饰键，不含这些修饰键的可打印字符直接交给终端
+    ACCEL_MODIFIERS = int(Gdk.ModifierType.CONTROL_MASK | Gdk.ModifierType.MOD1_MASK |
+                          Gdk.ModifierType.SUPER_MASK)
+    # 终端自身处理、不交给gedit的快捷键（Ctrl+A/C/D/E/H/K/L/R/T/U/W/Z、Alt+B/F）
+    PASSTHROUGH_KEYS = frozenset(
+        [(keyval, int(Gdk.ModifierType.CONTROL_MASK))
+         for c in 'ACDEHKLRTUWZ'
+         for keyval in (Gdk.keyval_from_name(c), Gdk.keyval_from_name(c.lower()))] +
+        [(keyval, int(Gdk.ModifierType.MOD1_MASK))
+         for c in 'BF'
+         for keyval in (Gdk.keyval_from_name(c), Gdk.keyval_from_name(c.lower()))])
+
+    # 按键分发表（所有面板共享，AccelMap变化时重建）
+    _key_actions = None
+    _mod_mask = 0
+    _accel_map_handler = 0
+
+    @traced
     def __init__(self):
         # 面板初始化（垂直布局）
         Gtk.Box.__init__(self, orientation=Gtk.Orientation.VERTICAL)
         self.set_border_width(2)  # 补充边框初始化
 
-        # 快捷键配置初始化
-        self._accel_base = '<gedit>/plugins/terminal_multitab'
-        self._accels = {
-            'copy-clipboard': [Gdk.KEY_C, Gdk.ModifierType.CONTROL_MASK | Gdk.ModifierType.SHIFT_MASK, self.copy_clipboard],
-            'paste-clipboard': [Gdk.KEY_V, Gdk.ModifierType.CONTROL_MASK | Gdk.ModifierType.SHIFT_MASK, self.paste_clipboard]
-        }
+        # 首个面板加载Vte/Tepl并创建终端类
+        load_terminal_support()
 
-        # 注册快捷键（容错）
-        for name in self._accels:
-            try:
-                path = self._accel_base + '/' + name
-                if not Gtk.AccelMap.lookup_entry(path)[0]:
-                    Gtk.AccelMap.add_entry(path, self._accels[name][0], self._accels[name][1])
-            except Exception as e:
-                print(f"[Terminal Multitab] Register accel {name} failed: {e}", file=sys.stderr)
+        # 快捷键配置初始化（首个面板注册快捷键并编译分发表）
+        if GeditTerminalPanel._key_actions is None:
+            GeditTerminalPanel._register_accels()
+        self._handlers = []  # [(对象, handler_id)]，释放面板时断开
 
         # ========== 多Tab核心初始化 ==========
         # 1. 创建Tab操作栏
@@ -309,10 +2202,84 @@ class GeditTerminalPanel(Gtk.Box):
         self._notebook.set_show_tabs(True)
         self._notebook.set_show_border(True)
         self.pack_start(self._notebook, True, True, 0)
-
-        # 3. 默认创建第一个终端Tab
-        self._terminal_count = 0
-        self.create_new_terminal_tab()
+        self._notebook.show()
+        # 没有Tab时代替Notebook显示的空视图
+        self._create_empty_view()
+        # 搜索栏（默认隐藏）
+        self._create_search_bar()
+
+        # 3. Tab登记表：页面/终端 -> TerminalTab（查找、关闭、重建均不依赖页序号）
+        self._tabs_by_page = {}
+        self._tabs_by_terminal = {}
+
+        # 4. 懒加载模式（见LAZY）
+        self._lazy = self.LAZY
+        # 批量增删Tab的状态（见batch_update）
+        self._batch_depth = 0
+        self._batch_select = None
+        self._batch_replace = False
+        self._handlers.append((self._notebook, self._notebook.connect("switch-page", self.on_notebook_switch_page)))
+        self._handlers.append((self, self.connect("map", self.on_panel_map)))
+
+        # 5. 接管已分离的会话（来自已关闭的窗口）；应用中还没有任何会话时恢复保存的会话或
+        # 创建第一个终端Tab；其他窗口已有会话时以空视图开始，用户新建或移入Tab时才有终端
+        manager = TerminalSessionManager.get_default()
+        first = not manager.get_sessions()
+        manager.add_panel(self)
+        ProcessMonitor.get_default()
+        with log_span("Panel first tab (%s mode)", 'lazy' if self._lazy else 'eager'):
+            detached = manager.get_detached_sessions()
+            with self.batch_update():
+                for tab in detached:
+                    self.attach_tab(tab)
+            if first and not self.restore_session():
+                self.create_new_terminal_tab()
+        self._update_empty_view()
+
+    @classmethod
+    def _register_accels(cls):
+        """注册快捷键，并在AccelMap变化时重新编译按键分发表"""
+        for name, (keyval, mods, method) in cls.ACCELS.items():
+            try:
+                path = cls.ACCEL_BASE + '/' + name
+                if not Gtk.AccelMap.lookup_entry(path)[0]:
+                    Gtk.AccelMap.add_entry(path, keyval, mods)
+            except Exception as e:
+                LOG.warning("Register accel %s failed: %s", name, e)
+        cls._compile_key_table()
+        cls._accel_map_handler = Gtk.AccelMap.get().connect("changed", lambda *args: cls._compile_key_table())
+
+    @classmethod
+    def unregister_accels(cls):
+        """停止跟踪AccelMap变化（插件在所有窗口停用时调用）"""
+        if cls._accel_map_handler:
+            Gtk.AccelMap.get().disconnect(cls._accel_map_handler)
+            cls._accel_map_handler = 0
+        cls._key_actions = None
+
+    @classmethod
+    def _compile_key_table(cls):
+        """把快捷键编译成 (keyval, mods) -> 方法名 的字典，按键时只需一次查表"""
+        ctrl = Gdk.ModifierType.CONTROL_MASK
+        shift = Gdk.ModifierType.SHIFT_MASK
+        actions = {}
+
+        # Tab切换快捷键
+        for keyval in (Gdk.KEY_Tab, Gdk.KEY_KP_Tab, Gdk.KEY_ISO_Left_Tab):
+            actions[(keyval, ctrl)] = 'focus_next_widget'
+            actions[(keyval, ctrl | shift)] = 'focus_previous_widget'
+
+        # 复制粘贴等快捷键（大小写keyval都登记，无需每次转换）
+        for name, (keyval, mods, method) in cls.ACCELS.items():
+            found, key = Gtk.AccelMap.lookup_entry(cls.ACCEL_BASE + '/' + name)
+            if found and key.accel_key:
+                keyval, mods = key.accel_key, key.accel_mods
+            for variant in (Gdk.keyval_to_lower(keyval), Gdk.keyval_to_upper(keyval)):
+                actions[(variant, int(mods))] = method
+
+        cls._mod_mask = Gtk.accelerator_get_default_mod_mask()
+        cls._key_actions = actions
+        LOG.debug("Key table compiled: %d entries", len(actions))
 
     def _create_tab_toolbar(self):
         """创建Tab操作工具栏（新建/关闭按钮）"""
@@ -337,43 +2304,315 @@ class GeditTerminalPanel(Gtk.Box):
         self.pack_start(toolbar, False, False, 0)
         toolbar.show_all()
 
-    @debug_log
-    def create_new_terminal_tab(self):
-        """创建新的终端Tab（核心多Tab方法）"""
-        self._terminal_count += 1
-        tab_index = self._terminal_count
-        print(f"[Terminal Multitab] Create new terminal tab: {tab_index}", file=sys.stdout)
-
-        # 1. 创建终端容器（终端+滚动条）
-        terminal_box = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL)
-        
-        # 2. 创建终端实例（容错）
-        try:
-            vte = GeditTerminal()
-            vte.show()
-        except Exception as e:
-            print(f"[Terminal Multitab] Create terminal failed: {e}", file=sys.stderr)
-            # 降级创建基础VTE终端
-            vte = Vte.Terminal()
-            vte.spawn_sync(Vte.PtyFlags.DEFAULT, None, ["/bin/bash"], None, 
-                          GLib.SpawnFlags.SEARCH_PATH, None, None, None)
-            vte.show()
-        terminal_box.pack_start(vte, True, True, 0)
+    def _create_empty_view(self):
+        """创建空视图：提示并提供新建Tab、移入其他窗口的Tab的按钮"""
+        view = Gtk.Box(orientation=Gtk.Orientation.VERTICAL, spacing=5)
+        view.set_valign(Gtk.Align.CENTER)
+        view.set_halign(Gtk.Align.CENTER)
+        view.pack_start(Gtk.Label(label=_("No terminal in this window")), False, False, 0)
+
+        buttons = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=5)
+        button = Gtk.Button.new_with_label(_("New Terminal Tab"))
+        button.connect("clicked", lambda btn: self.create_new_terminal_tab())
+        buttons.pack_start(button, False, False, 0)
+        button = Gtk.Button.new_with_label(_("Move Tab Here"))
+        button.connect("clicked", self.on_move_button_clicked)
+        buttons.pack_start(button, False, False, 0)
+        view.pack_start(buttons, False, False, 0)
+
+        view.show_all()
+        view.set_no_show_all(True)
+        view.hide()
+        self.pack_start(view, True, True, 0)
+        self._empty_view = view
+
+    def _update_empty_view(self):
+        """没有Tab时用空视图代替Notebook"""
+        empty = self._notebook.get_n_pages() == 0
+        if empty != self._empty_view.get_visible():
+            self._notebook.set_visible(not empty)
+            self._empty_view.set_visible(empty)
+
+    def on_move_button_clicked(self, button):
+        menu = self.create_move_menu()
+        if menu is None:
+            return
+        menu.attach_to_widget(button, None)
+        menu.show_all()
+        menu.popup_at_widget(button, Gdk.Gravity.SOUTH_WEST, Gdk.Gravity.NORTH_WEST, None)
 
-        # 3. 添加滚动条
-        scrollbar = Gtk.Scrollbar.new(Gtk.Orientation.VERTICAL, vte.get_vadjustment())
-        scrollbar.show()
-        terminal_box.pack_start(scrollbar, False, False, 0)
+    def create_move_menu(self):
+        """其他窗口（或已关闭窗口遗留）的会话菜单，选中的会话移动到本面板；没有时返回None"""
+        manager = TerminalSessionManager.get_default()
+        others = [tab for tab in manager.get_sessions() if tab.panel is not self]
+        if not others:
+            return None
+        menu = Gtk.Menu()
+        for tab in others:
+            item = Gtk.MenuItem.new_with_label(tab.title)
+            item.connect("activate", lambda menu_item, t: manager.move_session(t, self), tab)
+            menu.append(item)
+        return menu
 
-        # 4. 绑定终端事件
-        vte.connect("child-exited", self.on_vte_child_exited, tab_index)
-        vte.connect("key-press-event", self.on_vte_key_press)
-        vte.connect("button-press-event", self.on_vte_button_press)
-        vte.connect("popup-menu", self.on_vte_popup_menu)
+    def _create_search_bar(self):
+        """创建搜索栏：在当前终端中增量搜索，可选统计所有Tab中的匹配"""
+        bar = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=5)
+        bar.set_margin_left(5)
+        bar.set_margin_right(5)
+        bar.set_margin_top(2)
+        bar.set_margin_bottom(2)
+
+        # 输入时增量搜索；回车/向上按钮找更早的匹配，Ctrl+G/向下按钮找更晚的匹配
+        self._search_entry = Gtk.SearchEntry()
+        self._search_entry.connect("search-changed", self.on_search_changed)
+        self._search_entry.connect("activate", lambda entry: self.search_previous())
+        self._search_entry.connect("previous-match", lambda entry: self.search_previous())
+        self._search_entry.connect("next-match", lambda entry: self.search_next())
+        self._search_entry.connect("stop-search", lambda entry: self.hide_search_bar())
+        bar.pack_start(self._search_entry, True, True, 0)
+
+        for icon, tooltip, callback in (("go-up-symbolic", _("Find Previous"), self.search_previous),
+                                         ("go-down-symbolic", _("Find Next"), self.search_next)):
+            button = Gtk.Button.new_from_icon_name(icon, Gtk.IconSize.MENU)
+            button.set_tooltip_text(tooltip)
+            button.connect("clicked", lambda btn, cb: cb(), callback)
+            bar.pack_start(button, False, False, 0)
+
+        self._search_all = Gtk.CheckButton.new_with_label(_("All Tabs"))
+        self._search_all.connect("toggled", self.on_search_changed)
+        bar.pack_start(self._search_all, False, False, 0)
+
+        self._search_status = Gtk.Label()
+        bar.pack_start(self._search_status, False, False, 0)
+
+        button = Gtk.Button.new_from_icon_name("window-close-symbolic", Gtk.IconSize.MENU)
+        button.set_tooltip_text(_("Close Search"))
+        button.connect("clicked", lambda btn: self.hide_search_bar())
+        bar.pack_end(button, False, False, 0)
+
+        bar.show_all()
+        bar.set_no_show_all(True)
+        bar.hide()
+        self.pack_end(bar, False, False, 0)
+        self._search_bar = bar
+        self._search_regex = None  # 当前的Vte.Regex，None表示未搜索
+        self._search_job = None
+        self._search_results = []  # 跨Tab搜索结果 [(Tab, 匹配数)]
+        # 导出终端内容时去除转义序列和控制字符
+        self._export_strip = True
+
+    # 粘贴管道（GEDIT_TERMINAL_MULTITAB_PASTE_PIPELINE=1 开启）：异步读取剪贴板，
+    # 超过大小或行数阈值时先确认；旧版VTE上分块输入，开启PASTE_BRACKETED时shell空闲时使用括号粘贴
+    PASTE_PIPELINE = env_int('PASTE_PIPELINE', 0) != 0
+    PASTE_WARN_BYTES = env_int('PASTE_WARN_BYTES', 64 * 1024)
+    PASTE_WARN_LINES = env_int('PASTE_WARN_LINES', 10)
+    PASTE_BRACKETED = env_int('PASTE_BRACKETED', 0) != 0
+
+    def show_search_bar(self):
+        self._search_bar.show()
+        self._search_entry.grab_focus()
+
+    def hide_search_bar(self):
+        """关闭搜索栏：取消搜索并清除终端中的高亮"""
+        self._cancel_search()
+        self._search_regex = None
+        for tab in self.get_sessions():
+            for term in tab.get_terminals():
+                term.search_set_regex(None, 0)
+        self._search_bar.hide()
+        current_term = self.get_current_terminal()
+        if current_term:
+            current_term.grab_focus()
 
-        # 5. 创建Tab标签（带关闭按钮）
+    def _cancel_search(self):
+        if self._search_job is not None:
+            self._search_job.cancel()
+            self._search_job = None
+        self._search_results = []
+        self._search_status.set_text('')
+
+    def _apply_search(self, term):
+        """把当前搜索设置到终端上（跨Tab搜索时不回绕，到头后转到下一个Tab）"""
+        term.search_set_regex(self._search_regex, 0)
+        term.search_set_wrap_around(not self._search_all.get_active())
+
+    def on_search_changed(self, widget):
+        """搜索内容或范围变化：重新设置正则，必要时重新开始跨Tab搜索"""
+        self._cancel_search()
+        pattern = self._search_entry.get_text()
+        style = self._search_entry.get_style_context()
+        style.remove_class(Gtk.STYLE_CLASS_ERROR)
+        self._search_regex = None
+        current_term = self.get_current_terminal()
+        if pattern:
+            # 全小写时忽略大小写
+            caseless = pattern == pattern.lower()
+            flags = PCRE2_UTF | PCRE2_MULTILINE | (PCRE2_CASELESS if caseless else 0)
+            try:
+                self._search_regex = Vte.Regex.new_for_search(pattern, -1, flags)
+            except GLib.Error as e:
+                style.add_class(Gtk.STYLE_CLASS_ERROR)
+                self._search_status.set_text(_("Invalid pattern"))
+                LOG.debug("Invalid search pattern %r: %s", pattern, e)
+        if current_term:
+            self._apply_search(current_term)
+            if self._search_regex is not None:
+                current_term.search_find_previous()
+        if self._search_regex is None or not self._search_all.get_active():
+            return
+        try:
+            regex = re.compile(pattern, re.MULTILINE | (re.IGNORECASE if caseless else 0))
+        except re.error:
+            return
+        self._search_status.set_text(_("Searching…"))
+        self._search_job = TerminalSearch(regex, self.get_sessions(),
+                                          self._on_search_progress, self._on_search_done)
+        self._search_job.start()
+
+    def _on_search_progress(self, results):
+        self._search_results = list(results)
+        matches = sum(count for tab, count in results)
+        self._search_status.set_text(_("%d matches in %d tabs") % (matches, len(results)))
+
+    def _on_search_done(self, results):
+        self._search_job = None
+        self._on_search_progress(results)
+        if not results:
+            self._search_status.set_text(_("No matches"))
+
+    def search_next(self):
+        self._search_step(True)
+
+    def search_previous(self):
+        self._search_step(False)
+
+    def _search_step(self, forward):
+        """在当前终端中查找下一个/上一个匹配；跨Tab搜索时到头后转到下一个有匹配的Tab"""
+        if self._search_regex is None:
+            return
+        current_term = self.get_current_terminal()
+        if current_term is not None:
+            found = current_term.search_find_next() if forward else current_term.search_find_previous()
+            if found or not self._search_all.get_active():
+                return
+        matched = set(tab for tab, count in self._search_results)
+        sessions = self.get_sessions()
+        current = self.get_current_tab()
+        if not matched or current not in sessions:
+            return
+        start = sessions.index(current)
+        step = 1 if forward else -1
+        for offset in range(1, len(sessions)):
+            tab = sessions[(start + step * offset) % len(sessions)]
+            if tab in matched and tab.terminal is not None:
+                self._notebook.set_current_page(self._notebook.page_num(tab.page))
+                term = tab.get_focused_terminal()
+                if forward:
+                    term.search_find_next()
+                else:
+                    term.search_find_previous()
+                return
+
+    @traced
+    def restore_session(self):
+        """从保存的会话恢复Tab（均为占位Tab，只有可见的Tab会立即创建终端）"""
+        states, current = SessionStore.get_default().take_saved()
+        if not states:
+            return False
+        manager = TerminalSessionManager.get_default()
+        for state in states:
+            manager.reserve_index(state['index'])
+        self.open_tabs(states, min(max(current, 0), len(states) - 1))
+        return True
+
+    @contextlib.contextmanager
+    def batch_update(self):
+        """批量增删Tab
+
+        期间冻结Notebook的子部件通知，不切换当前页、不创建终端、不抢焦点，
+        最外层结束时统一选中页面、创建可见终端并聚焦一次。可以嵌套。
+        """
+        self._batch_depth += 1
+        if self._batch_depth == 1:
+            self._notebook.freeze_child_notify()
+        try:
+            yield
+        finally:
+            self._batch_depth -= 1
+            if self._batch_depth == 0:
+                self._notebook.thaw_child_notify()
+                self._finish_batch()
+
+    def _finish_batch(self):
+        tab, self._batch_select = self._batch_select, None
+        if tab is not None and tab.panel is self:
+            self._notebook.set_current_page(self._notebook.page_num(tab.page))
+        if self._batch_replace:
+            self._batch_replace = False
+            if self._notebook.get_n_pages() == 0:
+                LOG.debug("No tabs left, create new one")
+                self.create_new_terminal_tab()
+                return
+        self._update_empty_view()
+        tab = self.get_current_tab()
+        if tab is None:
+            return
+        if tab.terminal is None and self.get_mapped():
+            self._materialize_tab(tab)
+        elif tab.terminal is not None and tab.page.get_mapped():
+            tab.terminal.grab_focus()
+
+    def open_tabs(self, states, current=None):
+        """批量创建Tab（states中None表示新建空白Tab，否则为保存的会话状态）
+
+        只做一次布局和聚焦；current为选中的Tab序号，默认选中最后一个。
+        """
+        with log_span("Open %s tabs", len(states)), self.batch_update():
+            tabs = [self.create_new_terminal_tab(state, select=False) for state in states]
+            if tabs:
+                self._batch_select = tabs[-1 if current is None else current]
+        return tabs
+
+    def close_tabs(self, predicate=None, replace=True):
+        """批量关闭满足predicate的Tab（None表示全部），返回关闭的数量
+
+        只做一次布局和聚焦；replace为True时全部关闭后自动新建一个Tab。
+        """
+        closed = 0
+        with log_span("Close tabs"), self.batch_update():
+            for tab in self.get_sessions():
+                if predicate is None or predicate(tab):
+                    self.close_tab(tab, replace)
+                    closed += 1
+        return closed
+
+    @traced
+    def create_new_terminal_tab(self, state=None, select=True):
+        """创建新的终端Tab（核心多Tab方法）
+
+        懒加载模式下只创建占位页，终端和shell在该页首次可见时才创建。
+        state为保存的会话状态时按其恢复编号、标题、目录和滚动回滚内容（命令Tab为其名称），并总是懒加载。
+        """
+        if state is None:
+            tab = TerminalTab(TerminalSessionManager.get_default().next_index())
+        else:
+            tab = TerminalTab(state['index'])
+            tab.title = state.get('title') or tab.title
+            tab.working_directory = state.get('cwd')
+            tab.history_file = state.get('history_file')
+            tab.run_name = state.get('run_name')
+        LOG.debug("Create new terminal tab: %s", tab.index)
+
+        # 1. 创建终端容器（终端+滚动条），先作为占位页
+        tab.page = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL)
+
+        # 2. 创建Tab标签（悬停时显示滚动回滚内存估算）
+        tab.label = Gtk.Label(label=tab.title)
+        tab.label.set_has_tooltip(True)
+        tab.label.connect("query-tooltip", GeditTerminalPanel.on_tab_label_query_tooltip, tab)
+
+        # 3. 组装Tab标签（带关闭按钮）
         tab_label_box = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=3)
-        tab_label = Gtk.Label(label=f"{_('Terminal')} {tab_index}")
         
         # ========== 修复：兼容所有Gtk 3版本的图标按钮创建 ==========
         # 步骤1：创建GtkImage对象（加载关闭图标）
@@ -385,75 +2624,531 @@ class GeditTerminalPanel(Gtk.Box):
         
         tab_close_btn.set_size_request(20, 20)
         tab_close_btn.set_tooltip_text(_("Close Tab"))
-        tab_close_btn.connect("clicked", lambda _, idx=self._notebook.get_n_pages(): self.close_tab_by_index(idx))
+        # 关闭按钮绑定Tab记录本身（而不是页序号或面板），移动或重排后仍关闭正确的Tab
+        tab_close_btn.connect("clicked", lambda _: tab.panel and tab.panel.close_tab(tab))
         
-        tab_label_box.pack_start(tab_label, False, False, 0)
+        tab_label_box.pack_start(tab.label, False, False, 0)
         tab_label_box.pack_start(tab_close_btn, False, False, 0)
         tab_label_box.show_all()
+        tab.tab_widget = tab_label_box
+
+        # 4. 登记会话并添加到本面板（切换页时按需创建终端）
+        with self.batch_update():
+            TerminalSessionManager.get_default().add_session(tab)
+            self.attach_tab(tab, select=select)
+            if not self._lazy and state is None:
+                self._materialize_tab(tab)
+        return tab
+
+    def attach_tab(self, tab, select=False):
+        """把会话显示到本面板"""
+        with self.batch_update():
+            tab.panel = self
+            self._tabs_by_page[tab.page] = tab
+            for term in tab.get_terminals():
+                self._tabs_by_terminal[term] = tab
+            if tab.terminal is not None:
+                self._connect_terminal(tab)
+            # 只显示新页面本身（终端和滚动条创建时各自显示），不遍历整个面板
+            tab.page.show()
+            self._notebook.append_page(tab.page, tab.tab_widget)
+            if select:
+                self._batch_select = tab
+
+    def detach_tab(self, tab):
+        """把会话从本面板分离（终端和shell保持运行）"""
+        if self._tabs_by_page.pop(tab.page, None) is None:
+            return
+        with self.batch_update():
+            if tab.terminal is not None:
+                self._disconnect_terminal(tab)
+            for term in tab.get_terminals():
+                self._tabs_by_terminal.pop(term, None)
+            self._notebook.remove_page(self._notebook.page_num(tab.page))
+            tab.panel = None
+        LOG.debug("%s detached", tab.title)
+
+    @traced
+    def _materialize_tab(self, tab, command=None):
+        """为占位Tab创建终端实例并启动shell或命令（已有终端时直接返回）"""
+        if tab.terminal is not None:
+            return tab.terminal
+        if tab.run_name is not None and command is None:
+            # 命令Tab的终端在运行命令时才创建
+            return None
+        tab.label.set_text(f"{tab.title} {_('(starting…)')}")
+
+        # 1. 优先取用预热池中的终端，否则新建（容错），shell在后台异步启动
+        try:
+            if command is not None:
+                vte = GeditTerminal(tab.working_directory, None, command)
+                tab.working_directory = tab.history_file = None
+            elif tab.working_directory is None and tab.history_file is None:
+                vte = TerminalPool.get_default().acquire() or GeditTerminal()
+            else:
+                # 恢复的会话：在保存的目录中启动shell（不使用预热终端），只读取本Tab的滚动回滚
+                vte = GeditTerminal(tab.working_directory, SessionStore.read_history(tab.history_file))
+                tab.working_directory = tab.history_file = None
+            vte.show()
+        except Exception as e:
+            LOG.warning("Create terminal failed: %s", e)
+            # 降级创建基础VTE终端
+            vte = Vte.Terminal()
+            spawn_shell_async(vte, [FALLBACK_SHELL],
+                              lambda term, pid: tab.panel and tab.panel.on_vte_shell_spawned(term, pid))
+            vte.show()
+        tab.terminal = vte
+        self._tabs_by_terminal[vte] = tab
+
+        # 2. 主窗格：终端+滚动条，分屏时作为窗格树的一个叶子
+        tab.pane_box = self._create_pane_box(vte)
+        tab.page.pack_start(tab.pane_box, True, True, 0)
 
-        # 6. 添加到Notebook并聚焦
-        self._notebook.append_page(terminal_box, tab_label_box)
-        self._notebook.set_current_page(self._notebook.get_n_pages() - 1)
-        # ========== 新增：强制显示所有子组件 ==========
-        terminal_box.show_all()  # 确保容器内所有组件显示
-        self._notebook.show_all()  # 确保Notebook显示
-        self.show_all()  # 确保面板本身显示
+        # 3. 绑定终端事件
+        self._connect_terminal(tab)
+
+        # 从池中取出的终端可能已经启动完成
+        if isinstance(vte, GeditTerminal) and not vte.is_starting():
+            self.on_vte_shell_spawned(vte, vte.child_pid)
+
+        if tab.page.get_mapped():
+            vte.grab_focus()
+        return vte
+
+    @staticmethod
+    def _create_pane_box(vte):
+        """窗格容器：终端+滚动条"""
+        box = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL)
+        box.pack_start(vte, True, True, 0)
+        scrollbar = Gtk.Scrollbar.new(Gtk.Orientation.VERTICAL, vte.get_vadjustment())
+        scrollbar.show()
+        box.pack_start(scrollbar, False, False, 0)
+        box.show()
+        return box
+
+    def _connect_vte(self, term):
+        """绑定一个终端的事件到本面板，返回处理器列表"""
+        handlers = [
+            term.connect("child-exited", self.on_vte_child_exited),
+            term.connect("key-press-event", self.on_vte_key_press),
+            term.connect("button-press-event", self.on_vte_button_press),
+            term.connect("popup-menu", self.on_vte_popup_menu),
+            term.connect("focus-in-event", self.on_vte_focus_in),
+        ]
+        if isinstance(term, GeditTerminal):
+            handlers += [
+                term.connect("shell-spawned", self.on_vte_shell_spawned),
+                term.connect("current-directory-uri-changed", self.on_vte_directory_changed),
+                term.connect("shell-command-started", self.on_vte_command_started),
+                term.connect("shell-command-finished", self.on_vte_command_finished),
+            ]
+        return handlers
+
+    def _connect_terminal(self, tab):
+        """绑定Tab中所有窗格的终端事件到本面板（记录处理器，分离或释放终端时断开）"""
+        tab.handlers = self._connect_vte(tab.terminal)
+        for pane in tab.splits:
+            pane.handlers = self._connect_vte(pane.terminal)
+
+    @staticmethod
+    def _disconnect_terminal(tab):
+        for handler in tab.handlers:
+            tab.terminal.disconnect(handler)
+        tab.handlers = []
+        for pane in tab.splits:
+            for handler in pane.handlers:
+                pane.terminal.disconnect(handler)
+            pane.handlers = []
+
+    @staticmethod
+    def _terminate_panes(tab):
+        """挂断Tab中所有窗格的shell并清空窗格记录"""
+        for term in tab.get_terminals():
+            if isinstance(term, GeditTerminal):
+                term.terminate()
+        tab.terminal = None
+        tab.pane_box = None
+        tab.splits = []
+        tab.focus = None
+
+    def _release_terminal(self, tab):
+        """断开信号、挂断shell并销毁Tab中的所有窗格，Tab恢复为占位状态"""
+        if tab.terminal is not None:
+            self._disconnect_terminal(tab)
+            for term in tab.get_terminals():
+                self._tabs_by_terminal.pop(term, None)
+            self._terminate_panes(tab)
+        for child in tab.page.get_children():
+            child.destroy()
+
+    @staticmethod
+    def destroy_session(tab):
+        """销毁未被任何面板显示的会话"""
+        TerminalSessionManager.get_default().remove_session(tab)
+        if tab.terminal is not None:
+            GeditTerminalPanel._disconnect_terminal(tab)
+            GeditTerminalPanel._terminate_panes(tab)
+        tab.page.destroy()
+        tab.tab_widget.destroy()
+
+    def split_right(self):
+        """左右分屏当前窗格"""
+        self.split_pane(Gtk.Orientation.HORIZONTAL)
+
+    def split_below(self):
+        """上下分屏当前窗格"""
+        self.split_pane(Gtk.Orientation.VERTICAL)
+
+    def split_pane(self, orientation):
+        """把当前窗格替换为Gtk.Paned，原窗格和新终端各占一侧（原终端不重建）"""
+        tab = self.get_current_tab()
+        current_term = self.get_current_terminal()
+        if tab is None or current_term is None:
+            return
+        box = self._get_pane_box(tab, current_term)
+        working_directory = None
+        if isinstance(current_term, GeditTerminal):
+            working_directory = current_term.get_working_directory()
+        try:
+            vte = GeditTerminal(working_directory)
+        except Exception as e:
+            LOG.warning("Create terminal failed: %s", e)
+            return
+        vte.show()
+        pane = TerminalPane(vte, self._create_pane_box(vte))
+        tab.splits.append(pane)
+        self._tabs_by_terminal[vte] = tab
+        pane.handlers = self._connect_vte(vte)
+
+        paned = Gtk.Paned(orientation=orientation)
+        self._replace_pane_widget(box.get_parent(), box, paned)
+        paned.pack1(box, True, True)
+        paned.pack2(pane.box, True, True)
+        paned.show()
         vte.grab_focus()
 
-    @debug_log
+    def close_current_pane(self):
+        """关闭当前窗格（只有一个窗格时关闭Tab）"""
+        tab = self.get_current_tab()
+        current_term = self.get_current_terminal()
+        if tab is not None and current_term is not None:
+            self.close_pane(tab, current_term)
+
+    def close_pane(self, tab, term):
+        """关闭一个窗格：兄弟窗格接替父Gtk.Paned的位置，其终端不重建"""
+        if not tab.splits:
+            self.close_tab(tab)
+            return
+        if term is tab.terminal:
+            # 关闭主窗格时第一个分屏窗格成为主窗格
+            pane = tab.splits.pop(0)
+            box, handlers = tab.pane_box, tab.handlers
+            tab.terminal, tab.handlers, tab.pane_box = pane.terminal, pane.handlers, pane.box
+        else:
+            pane = next((pane for pane in tab.splits if pane.terminal is term), None)
+            if pane is None:
+                return
+            tab.splits.remove(pane)
+            box, handlers = pane.box, pane.handlers
+        for handler in handlers:
+            term.disconnect(handler)
+        self._tabs_by_terminal.pop(term, None)
+        if isinstance(term, GeditTerminal):
+            term.terminate()
+        if tab.focus is term:
+            tab.focus = None
+
+        paned = box.get_parent()
+        sibling = paned.get_child2() if paned.get_child1() is box else paned.get_child1()
+        paned.remove(sibling)
+        self._replace_pane_widget(paned.get_parent(), paned, sibling)
+        paned.destroy()
+        current_term = self.get_current_terminal()
+        if current_term is not None and tab.page.get_mapped():
+            current_term.grab_focus()
+
+    @staticmethod
+    def _get_pane_box(tab, term):
+        if term is tab.terminal:
+            return tab.pane_box
+        for pane in tab.splits:
+            if pane.terminal is term:
+                return pane.box
+        return None
+
+    @staticmethod
+    def _replace_pane_widget(parent, old, new):
+        """在窗格树中用new替换old（parent为Gtk.Paned或Tab页面）"""
+        if isinstance(parent, Gtk.Paned):
+            first = parent.get_child1() is old
+            parent.remove(old)
+            if first:
+                parent.pack1(new, True, True)
+            else:
+                parent.pack2(new, True, True)
+        else:
+            parent.remove(old)
+            parent.pack_start(new, True, True, 0)
+
+    @traced
+    def shutdown(self):
+        """释放面板：断开所有信号；运行中的会话分离保留，占位Tab直接销毁"""
+        for obj, handler in self._handlers:
+            obj.disconnect(handler)
+        self._handlers = []
+        self._cancel_search()
+        with self.batch_update():
+            for tab in self.get_sessions():
+                self.detach_tab(tab)
+                if tab.terminal is None:
+                    self.destroy_session(tab)
+        TerminalSessionManager.get_default().remove_panel(self)
+
+    def get_sessions(self):
+        """本面板显示的会话"""
+        return list(self._tabs_by_page.values())
+
+    def get_tab_for_terminal(self, term):
+        """按终端查找Tab记录"""
+        return self._tabs_by_terminal.get(term)
+
+    def get_current_tab(self):
+        """获取当前激活的Tab记录"""
+        current_page = self._notebook.get_current_page()
+        if current_page < 0:
+            return None
+        return self._tabs_by_page.get(self._notebook.get_nth_page(current_page))
+
+    @staticmethod
+    def on_tab_label_query_tooltip(label, x, y, keyboard_mode, tooltip, tab):
+        """Tab标签提示：显示该终端滚动回滚的估算内存"""
+        term = tab.terminal
+        if not isinstance(term, GeditTerminal):
+            tooltip.set_text(tab.title)
+            return True
+        rows, size = term.get_scrollback_usage()
+        limit = term.get_scrollback_lines()
+        tooltip.set_text(_("%s\nScrollback: %d lines (limit %s), ~%.1f MB") %
+                         (tab.title, rows, _("unlimited") if limit < 0 else limit, size / 1048576.0))
+        return True
+
+    def on_notebook_switch_page(self, notebook, page, page_num):
+        """切换到占位页时创建终端（仅当面板可见，批量增删期间推迟到结束时）"""
+        if self._batch_depth:
+            return
+        tab = self._tabs_by_page.get(page)
+        if tab is None:
+            return
+        tab.clear_marks()
+        if tab.terminal is None and self.get_mapped():
+            self._materialize_tab(tab)
+        if tab.terminal is not None and self._search_regex is not None:
+            self._apply_search(tab.get_focused_terminal())
+
+    def on_panel_map(self, panel):
+        """面板首次显示时创建当前页的终端"""
+        tab = self.get_current_tab()
+        if tab is not None:
+            self._materialize_tab(tab)
+
+    @traced
     def close_current_tab(self):
         """关闭当前激活的Tab"""
-        current_idx = self._notebook.get_current_page()
-        print(f"[Terminal Multitab] Close current tab: {current_idx}", file=sys.stdout)
-        if current_idx >= 0:
-            self.close_tab_by_index(current_idx)
+        tab = self.get_current_tab()
+        if tab is not None:
+            LOG.debug("Close current tab: %s", tab.title)
+            self.close_tab(tab)
 
-    @debug_log
+    @traced
     def close_tab_by_index(self, idx):
         """按索引关闭Tab"""
         if idx < 0 or idx >= self._notebook.get_n_pages():
-            print(f"[Terminal Multitab] Tab index {idx} out of range", file=sys.stdout)
+            LOG.debug("Tab index %s out of range", idx)
             return
-        
-        # 移除并销毁Tab
-        terminal_box = self._notebook.get_nth_page(idx)
-        self._notebook.remove_page(idx)
-        terminal_box.destroy()
-        print(f"[Terminal Multitab] Tab {idx} closed, remaining tabs: {self._notebook.get_n_pages()}", file=sys.stdout)
-
-        # 空Tab时自动新建
-        if self._notebook.get_n_pages() == 0:
-            print("[Terminal Multitab] No tabs left, create new one", file=sys.stdout)
-            self.create_new_terminal_tab()
+        self.close_tab(self._tabs_by_page[self._notebook.get_nth_page(idx)])
+
+    def close_tab(self, tab, replace=True):
+        """关闭指定Tab并结束其会话（replace为True时关闭最后一个Tab后自动新建）"""
+        if tab.page not in self._tabs_by_page:
+            return
+
+        # 移除并销毁Tab；空Tab时自动新建，否则聚焦到下一个Tab（均在批量结束时处理）
+        with self.batch_update():
+            self.detach_tab(tab)
+            self.destroy_session(tab)
+            LOG.debug("%s closed, remaining tabs: %s", tab.title, self._notebook.get_n_pages())
+            if replace:
+                self._batch_replace = True
+
+    def run_command(self, name, command, working_directory=None):
+        """在名为name的命令Tab中运行命令（供其他插件和gedit动作调用）
+
+        同名Tab会被复用，输出追加在之前的输出后面。RUN_DEBOUNCE毫秒内的重复调用只运行
+        最后一次；上一次命令还在运行时先结束它。命令由 shell -c 运行，结束时发出
+        command-finished 信号。返回命令Tab。
+        """
+        tab = self.get_run_tab(name)
+        tab.run_pending = (command, working_directory)
+        if tab.run_source:
+            GLib.source_remove(tab.run_source)
+        tab.run_source = GLib.timeout_add(max(0, self.RUN_DEBOUNCE), self._start_run, tab)
+        self._notebook.set_current_page(self._notebook.page_num(tab.page))
+        return tab
+
+    def get_run_tab(self, name):
+        """查找或创建名为name的命令Tab"""
+        for tab in self.get_sessions():
+            if tab.run_name == name:
+                return tab
+        manager = TerminalSessionManager.get_default()
+        # 以占位Tab创建，终端在第一次运行命令时创建
+        return self.create_new_terminal_tab({'index': manager.next_index(), 'title': name, 'run_name': name},
+                                            select=False)
+
+    def _start_run(self, tab):
+        tab.run_source = 0
+        if tab.run_pending is None or tab.panel is not self:
+            return False
+        term = tab.terminal
+        if tab.run_active and isinstance(term, GeditTerminal):
+            # 上一次命令还在运行：挂断它，退出后再运行（见_on_run_exited）
+            LOG.debug("%s: cancel previous command", tab.title)
+            term.terminate()
+            return False
+        command, working_directory = tab.run_pending
+        tab.run_pending = None
+        tab.exit_status = None
+        tab.run_active = True
+        if term is None:
+            tab.working_directory = working_directory
+            self._materialize_tab(tab, command)
         else:
-            # 聚焦到下一个Tab
-            current_page = self._notebook.get_current_page()
-            terminal_box = self._notebook.get_nth_page(current_page)
-            terminal_box.get_children()[0].grab_focus()
+            term.feed(f"\r\n$ {command}\r\n".encode('utf-8'))
+            term.spawn_shell(working_directory, command)
+        tab.update_label()
+        return False
+
+    def _on_run_exited(self, tab, term, status):
+        """命令Tab的命令结束：显示退出码、发出信号，有等待的命令时接着运行"""
+        try:
+            code = os.waitstatus_to_exitcode(status)
+        except (AttributeError, ValueError):
+            code = status >> 8
+        LOG.debug("%s: command exited with %s", tab.title, code)
+        self._finish_run(tab, code)
+
+    def _finish_run(self, tab, code):
+        """命令Tab的命令结束或无法启动（code为-1）"""
+        tab.run_active = False
+        tab.exit_status = code
+        tab.command = None
+        if not tab.page.get_mapped():
+            tab.mark = TerminalTab.MARK_DONE
+        tab.update_label()
+        self.emit("command-finished", tab.run_name, code)
+        if tab.run_pending is not None and not tab.run_source:
+            self._start_run(tab)
 
     def get_current_terminal(self):
-        """获取当前激活的终端实例"""
-        current_page = self._notebook.get_current_page()
-        if current_page < 0:
+        """获取当前激活的终端实例：当前Tab中最近获得焦点的窗格（占位页返回None）"""
+        tab = self.get_current_tab()
+        if tab is None:
             return None
-        terminal_box = self._notebook.get_nth_page(current_page)
-        return terminal_box.get_children()[0]
+        return tab.get_focused_terminal()
+
+    def on_vte_directory_changed(self, term):
+        """shell上报了新的当前目录（OSC 7）"""
+        tab = self._tabs_by_terminal.get(term)
+        if tab is not None and term is tab.terminal:
+            tab.set_working_directory(term.get_working_directory())
+            tab.update_label()
+
+    def on_vte_command_started(self, term):
+        """shell集成：命令开始执行
+
+        OSC 133;C在shell创建前台进程之前到达，读不到命令名时稍后再读一次，
+        之后由ProcessMonitor继续补全。
+        """
+        tab = self._tabs_by_terminal.get(term)
+        if tab is None or term is not tab.terminal or tab.run_name is not None:
+            return
+        command = term.get_foreground_command()
+        tab.command = command or _("running")
+        tab.command_start = time.monotonic()
+        tab.exit_status = None
+        tab.update_label()
+        if command is None:
+            GLib.timeout_add(self.COMMAND_NAME_DELAY, self._refresh_command_name, tab, tab.command_start)
+
+    def _refresh_command_name(self, tab, command_start):
+        # 命令已结束或又开始了新命令时不再更新
+        if tab.terminal is not None and tab.command is not None and tab.command_start == command_start:
+            tab.command = tab.terminal.get_foreground_command() or tab.command
+            tab.update_label()
+        return False
+
+    def on_vte_command_finished(self, term, status):
+        """shell集成：命令结束，非0退出码显示在标签上"""
+        tab = self._tabs_by_terminal.get(term)
+        if tab is None or term is not tab.terminal or tab.run_name is not None:
+            return
+        if tab.command is not None:
+            ProcessMonitor.get_default().on_command_finished(
+                tab, tab.command, time.monotonic() - tab.command_start, tab.page.get_mapped())
+        tab.command = None
+        tab.exit_status = status if status > 0 else None
+        tab.update_label()
+
+    def on_vte_focus_in(self, term, event):
+        """记录Tab中获得焦点的窗格"""
+        tab = self._tabs_by_terminal.get(term)
+        if tab is not None:
+            tab.focus = term
+            # 搜索作用于获得焦点的窗格
+            if self._search_regex is not None:
+                self._apply_search(term)
+        return False
 
     # ========== 事件处理与兼容 ==========
-    def on_vte_child_exited(self, term, status, tab_index):
-        """终端退出后重建Tab"""
-        print(f"[Terminal Multitab] Terminal {tab_index} exited with status: {status}", file=sys.stdout)
+    def on_vte_child_exited(self, term, status):
+        """终端退出后在原Tab中重建终端"""
+        tab = self._tabs_by_terminal.get(term)
+        if tab is None:
+            return
+        LOG.debug("%s exited with status: %s", tab.title, status)
+        if tab.run_name is not None and term is tab.terminal:
+            # 命令Tab保留终端和输出，不重建shell
+            self._on_run_exited(tab, term, status)
+            return
+        if tab.splits:
+            # 分屏中的终端退出时关闭该窗格
+            self.close_pane(tab, term)
+            return
         try:
-            for idx in range(self._notebook.get_n_pages()):
-                terminal_box = self._notebook.get_nth_page(idx)
-                if terminal_box.get_children()[0] == term:
-                    self._notebook.remove_page(idx)
-                    terminal_box.destroy()
-                    self.create_new_terminal_tab()
-                    self._notebook.set_current_page(self._notebook.get_n_pages() - 1)
-                    break
+            self._release_terminal(tab)
+            tab.command = None
+            tab.update_label()
+            # 当前可见的Tab立即重建，其余的等到下次显示
+            if tab is self.get_current_tab() and self.get_mapped():
+                self._materialize_tab(tab)
         except Exception as e:
-            print(f"[Terminal Multitab] Handle terminal exit error: {e}", file=sys.stderr)
+            LOG.warning("Handle terminal exit error: %s", e)
+
+    def on_vte_shell_spawned(self, term, pid):
+        """shell启动完成，去掉标签上的启动中状态"""
+        tab = self._tabs_by_terminal.get(term)
+        if tab is None:
+            return
+        if pid < 0:
+            LOG.warning("%s: no shell could be started", tab.title)
+            if tab.run_active and term is tab.terminal:
+                # 命令无法启动（如工作目录已删除），不会再有child-exited
+                self._finish_run(tab, -1)
+                return
+            tab.label.set_text(f"{tab.title} {_('(failed)')}")
+            return
+        LOG.debug("%s: shell started, pid %s", tab.title, pid)
+        tab.update_label()
 
     def do_grab_focus(self):
         """聚焦到当前终端"""
@@ -461,39 +3156,39 @@ class GeditTerminalPanel(Gtk.Box):
         if current_term:
             current_term.grab_focus()
 
+    @traced
     def on_vte_key_press(self, term, event):
-        """快捷键处理"""
+        """快捷键处理（查预编译的分发表）"""
         try:
-            modifiers = event.state & Gtk.accelerator_get_default_mod_mask()
-            # Tab切换快捷键
-            if event.keyval in (Gdk.KEY_Tab, Gdk.KEY_KP_Tab, Gdk.KEY_ISO_Left_Tab):
-                if modifiers == Gdk.ModifierType.CONTROL_MASK:
-                    self.get_toplevel().child_focus(Gtk.DirectionType.TAB_FORWARD)
-                    return True
-                elif modifiers == Gdk.ModifierType.CONTROL_MASK | Gdk.ModifierType.SHIFT_MASK:
-                    self.get_toplevel().child_focus(Gtk.DirectionType.TAB_BACKWARD)
-                    return True
-
-            # 复制粘贴快捷键
-            for name in self._accels:
-                path = self._accel_base + '/' + name
-                entry = Gtk.AccelMap.lookup_entry(path)
-                if entry and entry[0] and entry[1].accel_key == event.keyval and entry[1].accel_mods == modifiers:
-                    self._accels[name][2]()
-                    return True
+            keyval = event.keyval
+            modifiers = int(event.state & self._mod_mask)
+            key = (keyval, modifiers)
+
+            # 插件快捷键（Tab切换、复制粘贴）
+            method = self._key_actions.get(key)
+            if method is not None:
+                getattr(self, method)()
+                return True
 
-            # 终端原生快捷键放行
-            keyval_name = Gdk.keyval_name(Gdk.keyval_to_upper(event.keyval))
-            if modifiers == Gdk.ModifierType.CONTROL_MASK and keyval_name in 'ACDEHKLRTUWZ':
+            # 普通输入（无Ctrl/Alt/Super的可打印字符）直接交给终端
+            if not modifiers & self.ACCEL_MODIFIERS and (keyval < 0xff00 or keyval >= 0x1000000):
                 return False
-            if modifiers == Gdk.ModifierType.MOD1_MASK and keyval_name in 'BF':
+
+            # 终端原生快捷键放行
+            if key in self.PASSTHROUGH_KEYS:
                 return False
 
-            return Gtk.accel_groups_activate(self.get_toplevel(), event.keyval, modifiers)
+            return Gtk.accel_groups_activate(self.get_toplevel(), keyval, modifiers)
         except Exception as e:
-            print(f"[Terminal Multitab] Key press error: {e}", file=sys.stderr)
+            LOG.warning("Key press error: %s", e)
             return False
 
+    def focus_next_widget(self):
+        self.get_toplevel().child_focus(Gtk.DirectionType.TAB_FORWARD)
+
+    def focus_previous_widget(self):
+        self.get_toplevel().child_focus(Gtk.DirectionType.TAB_BACKWARD)
+
     def on_vte_button_press(self, term, event):
         """右键菜单处理"""
         try:
@@ -503,7 +3198,7 @@ class GeditTerminalPanel(Gtk.Box):
                 return True
             return False
         except Exception as e:
-            print(f"[Terminal Multitab] Button press error: {e}", file=sys.stderr)
+            LOG.warning("Button press error: %s", e)
             return False
 
     def on_vte_popup_menu(self, term):
@@ -516,7 +3211,7 @@ class GeditTerminalPanel(Gtk.Box):
         # 复制项
         item = Gtk.ImageMenuItem.new_from_stock(Gtk.STOCK_COPY, None)
         item.connect("activate", lambda menu_item: self.copy_clipboard())
-        item.set_accel_path(self._accel_base + '/copy-clipboard')
+        item.set_accel_path(self.ACCEL_BASE + '/copy-clipboard')
         current_term = self.get_current_terminal()
         item.set_sensitive(current_term and current_term.get_has_selection())
         menu.append(item)
@@ -524,9 +3219,46 @@ class GeditTerminalPanel(Gtk.Box):
         # 粘贴项
         item = Gtk.ImageMenuItem.new_from_stock(Gtk.STOCK_PASTE, None)
         item.connect("activate", lambda menu_item: self.paste_clipboard())
-        item.set_accel_path(self._accel_base + '/paste-clipboard')
+        item.set_accel_path(self.ACCEL_BASE + '/paste-clipboard')
         menu.append(item)
 
+        # 导出终端内容
+        item = Gtk.MenuItem.new_with_label(_("Export Scrollback"))
+        item.set_sensitive(isinstance(current_term, GeditTerminal))
+        submenu = Gtk.Menu()
+        sub_item = Gtk.MenuItem.new_with_label(_("To File…"))
+        sub_item.connect("activate", lambda menu_item: self.export_scrollback_to_file())
+        submenu.append(sub_item)
+        sub_item = Gtk.MenuItem.new_with_label(_("To New Document"))
+        sub_item.connect("activate", lambda menu_item: self.export_scrollback_to_document())
+        submenu.append(sub_item)
+        submenu.append(Gtk.SeparatorMenuItem())
+        sub_item = Gtk.CheckMenuItem.new_with_label(_("Strip Control Characters"))
+        sub_item.set_active(self._export_strip)
+        sub_item.connect("toggled", lambda menu_item: setattr(self, '_export_strip', menu_item.get_active()))
+        submenu.append(sub_item)
+        item.set_submenu(submenu)
+        menu.append(item)
+
+        # 分屏
+        menu.append(Gtk.SeparatorMenuItem())
+        for label, name, method in ((_("Split Right"), 'split-right', self.split_right),
+                                    (_("Split Below"), 'split-below', self.split_below),
+                                    (_("Close Pane"), 'close-pane', self.close_current_pane)):
+            item = Gtk.MenuItem.new_with_label(label)
+            item.connect("activate", lambda menu_item, cb: cb(), method)
+            item.set_accel_path(self.ACCEL_BASE + '/' + name)
+            item.set_sensitive(current_term is not None)
+            menu.append(item)
+
+        # 移动其他窗口（或已关闭窗口遗留）的会话到本面板
+        submenu = self.create_move_menu()
+        if submenu is not None:
+            menu.append(Gtk.SeparatorMenuItem())
+            item = Gtk.MenuItem.new_with_label(_("Move Tab Here"))
+            item.set_submenu(submenu)
+            menu.append(item)
+
         # 自定义菜单扩展
         self.emit("populate-popup", menu)
         menu.show_all()
@@ -543,7 +3275,7 @@ class GeditTerminalPanel(Gtk.Box):
                 menu.popup_at_widget(self, Gdk.Gravity.NORTH_WEST, Gdk.Gravity.SOUTH_WEST, None)
                 menu.select_first(False)
         except Exception as e:
-            print(f"[Terminal Multitab] Show popup menu error: {e}", file=sys.stderr)
+            LOG.warning("Show popup menu error: %s", e)
 
     def copy_clipboard(self):
         """复制到剪贴板"""
@@ -555,96 +3287,276 @@ class GeditTerminalPanel(Gtk.Box):
     def paste_clipboard(self):
         """从剪贴板粘贴"""
         current_term = self.get_current_terminal()
-        if current_term:
+        if not current_term:
+            return
+        if self.PASTE_PIPELINE and isinstance(current_term, GeditTerminal):
+            clipboard = Gtk.Clipboard.get(Gdk.SELECTION_CLIPBOARD)
+            clipboard.request_text(self._on_clipboard_text, current_term)
+        else:
             current_term.paste_clipboard()
-            current_term.grab_focus()
+        current_term.grab_focus()
+
+    def _on_clipboard_text(self, clipboard, text, term):
+        """剪贴板内容到达：过大或多行时先确认再粘贴"""
+        if not text or term not in self._tabs_by_terminal:
+            return
+        size = len(text.encode('utf-8'))
+        lines = text.count('\n')
+        if (self.PASTE_WARN_BYTES > 0 and size > self.PASTE_WARN_BYTES) or \
+                (self.PASTE_WARN_LINES > 0 and lines >= self.PASTE_WARN_LINES):
+            dialog = Gtk.MessageDialog(transient_for=self.get_toplevel(), modal=True,
+                                       message_type=Gtk.MessageType.QUESTION,
+                                       buttons=Gtk.ButtonsType.OK_CANCEL,
+                                       text=_("Paste %d lines (%d KB) into the terminal?") % (lines, size // 1024))
+            dialog.connect("response", self._on_paste_confirm, text, term)
+            dialog.show()
+            return
+        self._paste_text(text, term)
+
+    def _on_paste_confirm(self, dialog, response, text, term):
+        dialog.destroy()
+        if response == Gtk.ResponseType.OK and term in self._tabs_by_terminal:
+            self._paste_text(text, term)
+
+    def _paste_text(self, text, term):
+        if hasattr(term, 'paste_text'):
+            # VTE 0.68+：由VTE按程序是否开启了括号粘贴模式（DECSET 2004）决定是否包裹
+            term.paste_text(text)
+            return
+        # 旧版VTE无法得知括号粘贴模式，只在明确开启且shell空闲时包裹
+        term.paste_text_chunked(text, self.PASTE_BRACKETED and term.is_at_prompt())
 
-    def change_directory(self, path):
-        """切换终端目录"""
+    def export_scrollback_to_file(self):
+        """把当前终端（获得焦点的窗格）的内容导出到文件"""
+        tab = self.get_current_tab()
         current_term = self.get_current_terminal()
-        if current_term and path:
+        if tab is None or not isinstance(current_term, GeditTerminal):
+            return
+        dialog = Gtk.FileChooserNative.new(_("Export Scrollback"), self.get_toplevel(),
+                                           Gtk.FileChooserAction.SAVE, None, None)
+        dialog.set_do_overwrite_confirmation(True)
+        dialog.set_current_name(f"{tab.title}.txt")
+        if dialog.run() != Gtk.ResponseType.ACCEPT:
+            return
+        try:
+            stream = dialog.get_file().replace(None, False, Gio.FileCreateFlags.NONE, None)
+        except GLib.Error as e:
+            LOG.warning("Export scrollback failed: %s", e)
+            return
+        if not self._export_strip:
+            # 不需要过滤时由VTE直接写入输出流
             try:
-                path = path.replace('\\', '\\\\').replace('"', '\\"')
-                current_term.feed_child(('cd "%s"\n' % path).encode('utf-8'))
+                current_term.write_contents_sync(stream, Vte.WriteFlags.DEFAULT, None)
+            except GLib.Error as e:
+                LOG.warning("Export scrollback failed: %s", e)
+            finally:
+                stream.close(None)
+            return
+        ScrollbackExporter(current_term, lambda text: stream.write_all(text.encode('utf-8'), None),
+                           lambda ok: stream.close(None), strip=True).start()
+
+    def export_scrollback_to_document(self):
+        """把当前终端的内容分块导出到新的gedit文档"""
+        window = self.get_toplevel()
+        current_term = self.get_current_terminal()
+        if not isinstance(window, Gedit.Window) or not isinstance(current_term, GeditTerminal):
+            return
+        doc = window.create_tab(True).get_document()
+
+        def write(text):
+            # 导出内容不进入撤销历史
+            doc.begin_not_undoable_action()
+            doc.insert(doc.get_end_iter(), text, -1)
+            doc.end_not_undoable_action()
+
+        ScrollbackExporter(current_term, write, strip=self._export_strip).start()
+
+    def change_directory(self, path, auto=False):
+        """切换终端目录
+
+        auto为True（跟随文档自动切换）时只在shell空闲、命令行上没有未执行的输入且不在该目录时
+        输入cd，不抢焦点，避免把命令输入到vim等前台程序中或拼接到用户输入了一半的命令上。
+        """
+        current_term = self.get_current_terminal()
+        if not current_term or not path:
+            return
+        if auto:
+            if not isinstance(current_term, GeditTerminal) or not current_term.is_prompt_empty():
+                LOG.debug("Shell busy, skip cd %s", path)
+                return
+            cwd = current_term.get_working_directory()
+            if cwd and os.path.realpath(cwd) == os.path.realpath(path):
+                return
+        try:
+            current_term.feed_child(('cd %s\n' % shlex.quote(path)).encode('utf-8'))
+            if not auto:
                 current_term.grab_focus()
-            except Exception as e:
-                print(f"[Terminal Multitab] Change directory error: {e}", file=sys.stderr)
+        except Exception as e:
+            LOG.warning("Change directory error: %s", e)
 
 class TerminalPlugin(GObject.Object, Gedit.WindowActivatable):
     """插件主类，添加完整调试日志和容错"""
     __gtype_name__ = "Terminal_Multitab_Plugin"
     window = GObject.Property(type=Gedit.Window)
 
-    @debug_log
+    # 已激活的窗口数，最后一个窗口停用时结束所有会话并释放进程级共享资源
+    _active_count = 0
+
+    # 运行命令的窗口动作名（win.terminal-multitab-run，参数为命令字符串）
+    RUN_ACTION = 'terminal-multitab-run'
+
+    # 为1时终端跟随当前文档自动切换目录
+    FOLLOW_DOCUMENT = env_int('FOLLOW_DOCUMENT', 0) != 0
+    # 切换文档后等待的毫秒数，快速连续切换时只处理最后一次
+    FOLLOW_DELAY = env_int('FOLLOW_DELAY', 300)
+
+    @traced
     def __init__(self):
         GObject.Object.__init__(self)
+        self._container = None  # 底部面板中的占位容器，终端面板首次显示时才创建在其中
+        self._map_handler = 0
         self._panel = None
-        print("[Terminal Multitab] Plugin initialized", file=sys.stdout)
+        self._handlers = []
+        self._dir_cache = {}  # 文档 -> (位置, 所在目录)
+        self._follow_id = 0
+        LOG.debug("Plugin initialized")
 
-    @debug_log
+    @traced
     def do_activate(self):
         """插件激活（核心入口）"""
-        print(f"[Terminal Multitab] Activate plugin for window: {self.window}", file=sys.stdout)
+        LOG.debug("Activate plugin for window: %s", self.window)
         try:
-            # 创建终端面板
-            self._panel = GeditTerminalPanel()
-            self._panel.connect("populate-popup", self.on_panel_populate_popup)
-            self._panel.show()
-
-            # 添加到底部面板
+            # 底部面板中先放一个空容器：Vte/Tepl、快捷键表和终端面板在它首次显示时才创建
+            self._container = Gtk.Box(orientation=Gtk.Orientation.VERTICAL)
+            self._container.show()
+            self._map_handler = self._container.connect("map", lambda container: self.get_panel())
             bottom = self.window.get_bottom_panel()
-            bottom.add_titled(self._panel, "GeditTerminalMultitabPanel", _("Terminal Multitab"))
-            print("[Terminal Multitab] Panel added to bottom panel", file=sys.stdout)
+            bottom.add_titled(self._container, "GeditTerminalMultitabPanel", _("Terminal Multitab"))
+            # 懒加载模式下不强制显示底部面板，终端在用户打开面板时才创建；
+            # 立即创建模式保持原行为：创建面板、显示底部面板并切换到终端标签
+            if not GeditTerminalPanel.LAZY:
+                self.get_panel()
+                self.show_panel()
+            LOG.debug("Panel added to bottom panel")
+
+            # 窗口动作：在"run"命令Tab中、以当前文档目录运行参数中的命令
+            action = Gio.SimpleAction.new(self.RUN_ACTION, GLib.VariantType.new('s'))
+            action.connect("activate", self.on_run_action)
+            self.window.add_action(action)
+
+            # 文档目录缓存随Tab关闭失效；可选地跟随当前文档切换目录
+            self._handlers.append(self.window.connect("tab-removed", self.on_window_tab_removed))
+            if self.FOLLOW_DOCUMENT:
+                self._handlers.append(self.window.connect("active-tab-changed", self.on_active_tab_changed))
+            TerminalPlugin._active_count += 1
         except Exception as e:
-            print(f"[Terminal Multitab] Activate plugin failed: {e}", file=sys.stderr)
+            LOG.exception("Activate plugin failed: %s", e)
             raise
 
-    @debug_log
-    def do_activate(self):
-        """插件激活（核心入口）"""
-        print(f"[Terminal Multitab] Activate plugin for window: {self.window}", file=sys.stdout)
+    @traced
+    def do_deactivate(self):
+        """插件停用：从底部面板移除并释放终端面板"""
+        LOG.debug("Deactivate plugin for window: %s", self.window)
+        if self._container is None:
+            return
+        for handler in self._handlers:
+            self.window.disconnect(handler)
+        self._handlers = []
+        self.window.remove_action(self.RUN_ACTION)
+        if self._follow_id:
+            GLib.source_remove(self._follow_id)
+            self._follow_id = 0
+        self._dir_cache = {}
+        if self._map_handler:
+            self._container.disconnect(self._map_handler)
+            self._map_handler = 0
         try:
-            # 创建终端面板
-            self._panel = GeditTerminalPanel()
-            self._panel.connect("populate-popup", self.on_panel_populate_popup)
-            self._panel.show()
-
-            # 添加到底部面板
-            bottom = self.window.get_bottom_panel()
-            bottom.add_titled(self._panel, "GeditTerminalMultitabPanel", _("Terminal Multitab"))
-            # ========== 新增：强制显示底部面板 + 切换到终端标签 ==========
-            bottom.set_visible(True)  # 显示底部面板
-            # ========== 修复：兼容新版Gedit的Gtk.Stack面板 ==========
-        
-            # 切换到终端面板（兼容不同Gedit版本）
-            if hasattr(bottom, 'activate_item'):
-                # 老版本Gedit：使用activate_item
-                bottom.activate_item(self._panel)
-            elif hasattr(bottom, 'set_visible_child'):
-                # 新版本Gedit（Gtk.Stack）：使用set_visible_child
-                bottom.set_visible_child(self._panel)
-            # ==========================================================
-            print("[Terminal Multitab] Panel added to bottom panel", file=sys.stdout)
+            self.window.get_bottom_panel().remove(self._container)
         except Exception as e:
-            print(f"[Terminal Multitab] Activate plugin failed: {e}", file=sys.stderr)
-            raise
+            LOG.warning("Remove panel failed: %s", e)
+        if TerminalPlugin._active_count <= 1:
+            # 最后一个窗口：在面板释放占位Tab之前保存会话
+            SessionStore.release_default()
+        if self._panel is not None:
+            self._panel.shutdown()
+            self._panel = None
+        self._container.destroy()
+        self._container = None
+
+        TerminalPlugin._active_count -= 1
+        if TerminalPlugin._active_count <= 0:
+            TerminalPlugin._active_count = 0
+            release_shared_resources()
 
     def do_update_state(self):
         pass
 
+    def get_panel(self):
+        """终端面板，首次调用时创建（加载Vte/Tepl、注册快捷键、接管或恢复会话）"""
+        if self._panel is None:
+            if self._map_handler:
+                self._container.disconnect(self._map_handler)
+                self._map_handler = 0
+            self._panel = GeditTerminalPanel()
+            self._panel.connect("populate-popup", self.on_panel_populate_popup)
+            self._panel.show()
+            self._container.pack_start(self._panel, True, True, 0)
+        return self._panel
+
+    def show_panel(self):
+        """显示底部面板并切换到终端面板"""
+        bottom = self.window.get_bottom_panel()
+        bottom.set_visible(True)  # 显示底部面板
+        # ========== 修复：兼容新版Gedit的Gtk.Stack面板 ==========
+        # 切换到终端面板（兼容不同Gedit版本）
+        if hasattr(bottom, 'activate_item'):
+            # 老版本Gedit：使用activate_item
+            bottom.activate_item(self._container)
+        elif hasattr(bottom, 'set_visible_child'):
+            # 新版本Gedit（Gtk.Stack）：使用set_visible_child
+            bottom.set_visible_child(self._container)
+        # ==========================================================
+
     def get_active_document_directory(self):
-        """获取当前文档目录"""
+        """获取当前文档目录（按文档缓存，文档位置变化后重新计算）"""
         try:
             doc = self.window.get_active_document()
             if doc:
                 location = doc.get_file().get_location()
+                cached = self._dir_cache.get(doc)
+                if cached is not None and location is not None and cached[0].equal(location):
+                    return cached[1]
+                directory = None
                 if location and location.has_uri_scheme("file"):
-                    directory = location.get_parent()
-                    return directory.get_path()
+                    directory = location.get_parent().get_path()
+                    self._dir_cache[doc] = (location, directory)
+                return directory
         except Exception as e:
-            print(f"[Terminal Multitab] Get document directory error: {e}", file=sys.stderr)
+            LOG.warning("Get document directory error: %s", e)
         return None
 
+    def on_run_action(self, action, parameter):
+        if self._container is not None:
+            # 显式运行命令时显示终端面板（懒加载模式下面板可能从未打开过）
+            self.show_panel()
+            self.get_panel().run_command('run', parameter.get_string(), self.get_active_document_directory())
+
+    def on_window_tab_removed(self, window, tab):
+        self._dir_cache.pop(tab.get_document(), None)
+
+    def on_active_tab_changed(self, window, tab):
+        """切换文档：防抖后让终端跟随到文档所在目录"""
+        if self._follow_id:
+            GLib.source_remove(self._follow_id)
+        self._follow_id = GLib.timeout_add(max(0, self.FOLLOW_DELAY), self._follow_active_document)
+
+    def _follow_active_document(self):
+        self._follow_id = 0
+        path = self.get_active_document_directory()
+        if path is not None and self._panel is not None:
+            self._panel.change_directory(path, auto=True)
+        return False
+
     def on_panel_populate_popup(self, panel, menu):
         """右键菜单添加目录切换项"""
         try:
@@ -655,15 +3567,25 @@ class TerminalPlugin(GObject.Object, Gedit.WindowActivatable):
             item.set_sensitive(path is not None)
             menu.prepend(item)
         except Exception as e:
-            print(f"[Terminal Multitab] Populate popup menu error: {e}", file=sys.stderr)
-
-# ========== 插件注册（关键，修复启动错误） ==========
-try:
-    GObject.type_register(TerminalPlugin)
-    print("[Terminal Multitab] Plugin registered successfully", file=sys.stdout)
-except Exception as e:
-    print(f"[Terminal Multitab] Register plugin failed: {e}", file=sys.stderr)
-    raise
+            LOG.warning("Populate popup menu error: %s", e)
+
+def release_shared_resources():
+    """释放进程级共享资源：写入性能指标，保存并结束终端会话、进程监视器、终端池、滚动回滚预算、配置服务和快捷键表"""
+    if Metrics.enabled:
+        Metrics.dump()
+    SessionStore.release_default()
+    ProcessMonitor.release_default()
+    TerminalSessionManager.release_default()
+    TerminalPool.release_default()
+    ScrollbackBudget.release_default()
+    TerminalProfileSettings.release_default()
+    GeditTerminalPanel.unregister_accels()
+
+# TerminalPlugin作为GObject.Object子类在定义时已自动注册类型，无需再调用type_register
+_import_ms = (time.monotonic() - _IMPORT_START) * 1000
+LOG.debug("Module import took %.2f ms", _import_ms)
+if Metrics.enabled:
+    Metrics.record("module import", _import_ms)
 
 # 兼容旧版插件加载
 def activate_plugin(plugin):
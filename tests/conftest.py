@@ -0,0 +1,121 @@
+# -*- coding: utf8 -*-
+"""测试夹具：用桩Gedit窗口驱动插件，基准结果写入JSON
+
+需要GTK显示，可在Xvfb或broadway后端下运行：
+    xvfb-run -a python -m pytest tests
+    GDK_BACKEND=broadway BROADWAY_DISPLAY=:5 python -m pytest tests   （先运行 broadwayd :5）
+基准结果写入 --bench-json 指定的文件（默认 benchmark-results.json），用于比较不同版本。
+"""
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+
+import pytest
+
+from .helpers import PluginWindow, wait_reaped
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def pytest_configure(config):
+    # 测试不读写用户的会话文件，也不恢复上一个测试保存的会话
+    os.environ['XDG_DATA_HOME'] = tempfile.mkdtemp(prefix='gedit-terminal-multitab-tests-')
+    os.environ['GEDIT_TERMINAL_MULTITAB_SESSION_RESTORE'] = '0'
+
+
+def pytest_addoption(parser):
+    parser.addoption('--bench-json', default=os.environ.get('GEDIT_TERMINAL_MULTITAB_BENCH_JSON',
+                                                             'benchmark-results.json'),
+                     help="基准结果JSON文件路径")
+
+
+class BenchmarkResults(object):
+    """收集各基准的结果，测试结束时写入JSON"""
+
+    def __init__(self, path):
+        self.path = path
+        self.results = {}
+
+    def record(self, name, **values):
+        self.results[name] = values
+
+    def dump(self, module):
+        if not self.results:
+            return
+        try:
+            revision = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOT, capture_output=True,
+                                      text=True, timeout=10).stdout.strip() or None
+        except (OSError, subprocess.SubprocessError):
+            revision = None
+        vte = getattr(module, 'Vte', None) if module is not None else None
+        data = {
+            'revision': revision,
+            'time': datetime.datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'vte': '%d.%d.%d' % (vte.get_major_version(), vte.get_minor_version(),
+                                 vte.get_micro_version()) if vte is not None else None,
+            'results': self.results,
+        }
+        with open(self.path, 'w') as f:
+            json.dump(data, f, indent=2, ensure_ascii=False)
+
+
+_module = None
+
+
+@pytest.fixture(scope='session')
+def bench(request):
+    results = BenchmarkResults(request.config.getoption('--bench-json'))
+    yield results
+    results.dump(_module)
+
+
+@pytest.fixture(scope='session')
+def tm():
+    """导入插件模块（先注册桩Gedit），没有显示或VTE时跳过"""
+    global _module
+    pytest.importorskip('gi')
+    from . import gedit_stub
+    gedit_stub.install()
+    from gi.repository import Gdk
+    if Gdk.Display.get_default() is None:
+        pytest.skip("no display: run under xvfb-run or GDK_BACKEND=broadway")
+    import gi
+    try:
+        gi.require_version('Vte', '2.91')
+    except ValueError:
+        pytest.skip("Vte 2.91 typelib not installed")
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+    import terminal_multitab
+    terminal_multitab.load_terminal_support()
+    _module = terminal_multitab
+    return terminal_multitab
+
+
+@pytest.fixture
+def open_window(tm):
+    """打开桩gedit窗口的工厂，测试结束时按打开的相反顺序停用插件并关闭窗口"""
+    windows = []
+
+    def open_window():
+        window = PluginWindow(tm)
+        windows.append(window)
+        return window
+
+    yield open_window
+    for window in reversed(windows):
+        window.close()
+    # 等待挂断的shell全部回收，不影响下一个测试
+    wait_reaped(tm)
+
+
+@pytest.fixture
+def panel(open_window):
+    """已打开（可见）的终端面板"""
+    return open_window().show_panel()
+
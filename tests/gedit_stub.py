@@ -0,0 +1,74 @@
+# -*- coding: utf8 -*-
+"""代替gedit的最小Gedit命名空间
+
+Gedit的typelib只能在gedit进程内使用，测试时用这里的桩代替：Window是带底部面板
+（Gtk.Stack，默认隐藏，同gedit关闭底部面板时）和一个文本编辑区的普通窗口，
+WindowActivatable是普通的混入类。须在导入terminal_multitab之前调用install()。
+"""
+import sys
+import types
+
+import gi
+
+
+def install():
+    """注册桩模块 gi.repository.Gedit（重复调用时直接返回已注册的模块）"""
+    if 'gi.repository.Gedit' in sys.modules:
+        return sys.modules['gi.repository.Gedit']
+
+    gi.require_version('Gtk', '3.0')
+    from gi.repository import GObject, Gtk
+    import gi.repository
+
+    require_version = gi.require_version
+
+    def require_version_stub(namespace, version):
+        # 桩模块没有typelib，跳过Gedit的版本检查
+        if namespace != 'Gedit':
+            require_version(namespace, version)
+
+    gi.require_version = require_version_stub
+
+    class Window(Gtk.ApplicationWindow):
+        """gedit窗口的替身：文本编辑区 + 底部面板"""
+        __gtype_name__ = 'GeditStubWindow'
+        __gsignals__ = {
+            "tab-removed": (GObject.SignalFlags.RUN_LAST, None, (GObject.TYPE_PYOBJECT,)),
+            "active-tab-changed": (GObject.SignalFlags.RUN_LAST, None, (GObject.TYPE_PYOBJECT,)),
+        }
+
+        def __init__(self):
+            Gtk.ApplicationWindow.__init__(self)
+            self.set_default_size(800, 600)
+            box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL)
+            self.view = Gtk.TextView()
+            box.pack_start(self.view, True, True, 0)
+            self._bottom_panel = Gtk.Stack()
+            self._bottom_panel.set_size_request(-1, 250)
+            box.pack_start(self._bottom_panel, False, False, 0)
+            self.add(box)
+            box.show_all()
+            self._bottom_panel.hide()
+
+        def get_bottom_panel(self):
+            return self._bottom_panel
+
+        def get_active_document(self):
+            return None
+
+        def create_tab(self, jump_to):
+            raise NotImplementedError("documents are not available in the stub window")
+
+    class WindowActivatable(object):
+        """Gedit.WindowActivatable的替身（插件类通过window属性拿到窗口）"""
+
+    def utils_drop_get_uris(selection_data):
+        return selection_data.get_uris()
+
+    module = types.ModuleType('gi.repository.Gedit')
+    module.Window = Window
+    module.WindowActivatable = WindowActivatable
+    module.utils_drop_get_uris = utils_drop_get_uris
+    sys.modules['gi.repository.Gedit'] = module
+    gi.repository.Gedit = module
+    return module
@@ -0,0 +1,156 @@
+# -*- coding: utf8 -*-
+"""测试与基准共用的工具：驱动主循环、统计耗时、读取进程资源"""
+import os
+import time
+
+
+def iterate(until=None, timeout=5.0):
+    """运行默认主循环：until为None时处理完当前待处理事件，否则运行到until()为真或超时
+
+    返回until()的最终结果（until为None时返回True）。
+    """
+    from gi.repository import GLib
+    context = GLib.MainContext.default()
+    if until is None:
+        while context.pending():
+            context.iteration(False)
+        return True
+    deadline = time.monotonic() + timeout
+    while not until():
+        if time.monotonic() >= deadline:
+            return bool(until())
+        if not context.iteration(False):
+            time.sleep(0.001)
+    return True
+
+
+def wait_spawned(terminals, timeout=10.0):
+    """等待终端的shell全部启动完成，返回是否都成功"""
+    iterate(lambda: not any(term.is_starting() for term in terminals), timeout=timeout)
+    return all(term.child_pid > 0 for term in terminals)
+
+
+def wait_reaped(tm):
+    """等待挂断的shell全部回收"""
+    return iterate(lambda: not tm.ChildReaper.pending(), timeout=tm.ChildReaper.KILL_AFTER + 2)
+
+
+def run_for(seconds):
+    """运行主循环一段时间"""
+    deadline = time.monotonic() + seconds
+    iterate(lambda: time.monotonic() >= deadline, timeout=seconds + 1)
+
+
+def stats(samples_ms):
+    """耗时样本（毫秒）的分布"""
+    ordered = sorted(samples_ms)
+    if not ordered:
+        return {'count': 0}
+    return {
+        'count': len(ordered),
+        'mean_ms': sum(ordered) / len(ordered),
+        'p50_ms': ordered[len(ordered) // 2],
+        'p95_ms': ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+        'max_ms': ordered[-1],
+    }
+
+
+def time_calls(func, count):
+    """调用func count次，返回每次调用的平均耗时（微秒）"""
+    start = time.perf_counter()
+    for _i in range(count):
+        func()
+    return (time.perf_counter() - start) * 1e6 / count
+
+
+class StallMonitor(object):
+    """测量主循环卡顿：高优先级定时器每INTERVAL毫秒触发一次，记录相邻两次触发的最大间隔
+
+    with语句中执行的同步代码本身也计入卡顿（期间定时器无法触发）。
+    """
+    INTERVAL = 1
+
+    def __init__(self):
+        self.max_gap_ms = 0.0
+        self._last = 0.0
+        self._source_id = 0
+
+    def __enter__(self):
+        from gi.repository import GLib
+        self._last = time.monotonic()
+        self._source_id = GLib.timeout_add(self.INTERVAL, self._tick, priority=GLib.PRIORITY_HIGH)
+        return self
+
+    def _tick(self):
+        self._update()
+        return True
+
+    def _update(self):
+        now = time.monotonic()
+        self.max_gap_ms = max(self.max_gap_ms, (now - self._last) * 1000)
+        self._last = now
+
+    def __exit__(self, *exc_info):
+        from gi.repository import GLib
+        self._update()
+        GLib.source_remove(self._source_id)
+        return False
+
+
+def child_pids(pid=None):
+    """pid（默认本进程）的直接子进程"""
+    pid = os.getpid() if pid is None else pid
+    children = []
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                stat = f.read()
+        except OSError:
+            continue
+        # 第4个字段为父进程号（进程名可能含空格，从最后一个右括号之后开始数）
+        fields = stat[stat.rfind(')') + 2:].split()
+        if int(fields[1]) == pid:
+            children.append(int(entry))
+    return children
+
+
+def fd_count():
+    """本进程打开的文件描述符数"""
+    return len(os.listdir('/proc/self/fd'))
+
+
+def rss_kb(pid=None):
+    """进程的常驻内存（KB）"""
+    try:
+        with open(f"/proc/{pid or 'self'}/statm") as f:
+            pages = int(f.read().split()[1])
+    except (OSError, IndexError, ValueError):
+        return 0
+    return pages * os.sysconf('SC_PAGE_SIZE') // 1024
+
+
+class PluginWindow(object):
+    """一个激活了插件的桩gedit窗口"""
+
+    def __init__(self, tm):
+        from gi.repository import Gedit
+        self.tm = tm
+        self.window = Gedit.Window()
+        self.plugin = tm.TerminalPlugin()
+        self.plugin.props.window = self.window
+        self.window.show()
+        self.plugin.do_activate()
+        iterate()
+
+    def show_panel(self):
+        """打开底部面板（同用户按F9并切换到终端面板），返回终端面板"""
+        self.plugin.show_panel()
+        iterate()
+        return self.plugin.get_panel()
+
+    def close(self):
+        self.plugin.do_deactivate()
+        self.window.destroy()
+        iterate()
@@ -0,0 +1,84 @@
+# -*- coding: utf8 -*-
+"""启动探针：在全新进程中导入插件并在若干个桩gedit窗口中激活，以JSON输出结果
+
+由test_startup在子进程中运行（每次都从未导入插件的状态开始），模式由环境变量
+GEDIT_TERMINAL_MULTITAB_LAZY决定：
+    python -m tests.startup_probe --windows 5
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--windows', type=int, default=5, help="激活插件的窗口数")
+    parser.add_argument('--settle', type=float, default=1.0, help="激活后等待shell启动的秒数")
+    parser.add_argument('--show-panel', action='store_true', help="最后打开第一个窗口的终端面板（同用户按F9）")
+    args = parser.parse_args()
+
+    # gedit进程启动插件前已经加载了GTK，不计入插件的导入耗时
+    import gi
+    gi.require_version('Gtk', '3.0')
+    from gi.repository import Gtk  # noqa: F401
+    from . import gedit_stub
+    from .helpers import child_pids, iterate, run_for
+    Gedit = gedit_stub.install()
+    sys.path.insert(0, ROOT)
+
+    start = time.perf_counter()
+    import terminal_multitab
+    import_ms = (time.perf_counter() - start) * 1000
+    vte_after_import = 'gi.repository.Vte' in sys.modules
+
+    windows = []
+    activate_ms = []
+    for _i in range(args.windows):
+        window = Gedit.Window()
+        window.show()
+        iterate()
+        plugin = terminal_multitab.TerminalPlugin()
+        plugin.props.window = window
+        start = time.perf_counter()
+        plugin.do_activate()
+        iterate()
+        activate_ms.append((time.perf_counter() - start) * 1000)
+        windows.append((window, plugin))
+    run_for(args.settle)
+
+    result = {
+        'lazy': terminal_multitab.GeditTerminalPanel.LAZY,
+        'windows': args.windows,
+        'import_ms': import_ms,
+        'vte_loaded_on_import': vte_after_import,
+        'activate_ms': activate_ms,
+        'activate_total_ms': sum(activate_ms),
+        'vte_loaded': 'gi.repository.Vte' in sys.modules,
+        'panels': sum(1 for window, plugin in windows if plugin._panel is not None),
+        'bottom_panels_visible': sum(1 for window, plugin in windows if window.get_bottom_panel().get_visible()),
+        'shells': len(child_pids()),
+    }
+    if args.show_panel:
+        windows[0][1].show_panel()
+        iterate()
+        run_for(args.settle)
+        result['after_show'] = {
+            'vte_loaded': 'gi.repository.Vte' in sys.modules,
+            'panels': sum(1 for window, plugin in windows if plugin._panel is not None),
+            'shells': len(child_pids()),
+        }
+
+    for window, plugin in reversed(windows):
+        plugin.do_deactivate()
+        window.destroy()
+    iterate(lambda: not terminal_multitab.ChildReaper.pending(),
+            timeout=terminal_multitab.ChildReaper.KILL_AFTER + 2)
+    json.dump(result, sys.stdout)
+
+
+if __name__ == '__main__':
+    main()
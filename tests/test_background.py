@@ -0,0 +1,94 @@
+# -*- coding: utf8 -*-
+"""后台Tab大量输出时编辑器的按键延迟
+
+后台Tab持续输出，同时每KEY_INTERVAL毫秒模拟一次编辑器按键（向编辑区插入一个字符），
+记录每次按键比预定时间晚了多少，分别测默认、后台限速和后台暂停三种模式。
+"""
+import time
+
+import pytest
+
+pytest.importorskip('gi')
+
+from .helpers import iterate, run_for, stats, wait_spawned
+
+KEY_INTERVAL = 10
+FLOOD_SECONDS = 3.0
+FLOOD_COMMAND = b'while :; do seq 1 100000; done\r'
+
+
+class EditorTyping(object):
+    """在默认优先级（同输入事件）的定时器中向编辑区插入字符，记录延迟"""
+
+    def __init__(self, view):
+        self.view = view
+        self.latencies = []
+        self._last = 0.0
+        self._source_id = 0
+
+    def start(self):
+        from gi.repository import GLib
+        self._last = time.monotonic()
+        self._source_id = GLib.timeout_add(KEY_INTERVAL, self._on_key)
+
+    def _on_key(self):
+        now = time.monotonic()
+        self.latencies.append(max(0.0, (now - self._last) * 1000 - KEY_INTERVAL))
+        self._last = now
+        buf = self.view.get_buffer()
+        buf.insert(buf.get_end_iter(), 'x')
+        return True
+
+    def stop(self):
+        from gi.repository import GLib
+        GLib.source_remove(self._source_id)
+
+
+def select(panel, tab):
+    panel._notebook.set_current_page(panel._notebook.page_num(tab.page))
+
+
+@pytest.mark.parametrize('mode, rate_cap, pause', [
+    ('idle', 0, False),
+    ('default', 0, False),
+    ('rate_cap', 1000, False),
+    ('pause', 0, True),
+])
+def test_editor_latency_with_background_flood(tm, open_window, bench, monkeypatch, mode, rate_cap, pause):
+    monkeypatch.setattr(tm.GeditTerminal, 'BACKGROUND_RATE_CAP', rate_cap)
+    monkeypatch.setattr(tm.GeditTerminal, 'BACKGROUND_PAUSE', pause)
+    window = open_window()
+    panel = window.show_panel()
+    editor_tab = panel.get_current_tab()
+    flood_tab = panel.create_new_terminal_tab()
+    term = flood_tab.terminal
+    assert wait_spawned([editor_tab.terminal, term])
+
+    # 切回第一个Tab，输出的Tab进入后台
+    select(panel, editor_tab)
+    iterate()
+    assert term.background
+
+    if mode != 'idle':
+        term.get_child_feeder().feed(FLOOD_COMMAND)
+        iterate(lambda: not term.is_at_prompt(), timeout=5)
+    typing = EditorTyping(window.window.view)
+    rows = int(term.get_vadjustment().get_upper())
+    typing.start()
+    try:
+        run_for(FLOOD_SECONDS)
+    finally:
+        typing.stop()
+    rows = int(term.get_vadjustment().get_upper()) - rows
+    if pause:
+        assert rows <= term.get_row_count()
+
+    # 重新可见时恢复输出，结束输出命令
+    select(panel, flood_tab)
+    iterate()
+    assert not term.background
+    term.get_child_feeder().feed(b'\x03')
+    assert iterate(term.is_at_prompt, timeout=10)
+
+    bench.record(f'editor_latency_{mode}', keys=len(typing.latencies), output_rows=rows,
+                 **stats(typing.latencies))
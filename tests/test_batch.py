@@ -0,0 +1,54 @@
+# -*- coding: utf8 -*-
+"""批量新建/关闭Tab：逐个调用与open_tabs/close_tabs的对比（50个Tab）"""
+import time
+
+import pytest
+
+pytest.importorskip('gi')
+
+from .helpers import StallMonitor, iterate
+
+TABS = 50
+
+
+def terminal_count(panel):
+    return sum(1 for tab in panel.get_sessions() if tab.terminal is not None)
+
+
+@pytest.mark.parametrize('mode', ['per_tab', 'batched'])
+def test_open_and_close_50_tabs(tm, panel, bench, mode):
+    panel.close_tabs(replace=False)
+    iterate()
+    assert not panel.get_sessions()
+
+    with StallMonitor() as monitor:
+        start = time.perf_counter()
+        if mode == 'batched':
+            tabs = panel.open_tabs([None] * TABS)
+        else:
+            tabs = [panel.create_new_terminal_tab() for _i in range(TABS)]
+        iterate()
+        open_ms = (time.perf_counter() - start) * 1000
+    open_stall_ms = monitor.max_gap_ms
+    assert panel.get_sessions() == tabs
+    assert panel.get_current_tab() is tabs[-1]
+    assert tabs[-1].terminal is not None
+    materialized = terminal_count(panel)
+    if mode == 'batched':
+        # 批量打开只为选中的Tab创建终端
+        assert materialized == 1
+
+    with StallMonitor() as monitor:
+        start = time.perf_counter()
+        if mode == 'batched':
+            assert panel.close_tabs() == TABS
+        else:
+            for tab in list(tabs):
+                panel.close_tab(tab)
+        iterate()
+        close_ms = (time.perf_counter() - start) * 1000
+    # 全部关闭后自动新建一个Tab
+    assert len(panel.get_sessions()) == 1
+    bench.record(f'tabs{TABS}_{mode}', tabs=TABS, open_ms=open_ms, open_stall_ms=open_stall_ms,
+                 close_ms=close_ms, close_stall_ms=monitor.max_gap_ms,
+                 terminals_created=materialized)
@@ -0,0 +1,120 @@
+# -*- coding: utf8 -*-
+"""热点路径基准：新建Tab、启动shell、按键分发、配置变更扇出、输出吞吐量、每个Tab的内存
+
+结果写入基准JSON（见conftest），断言只检查功能是否正常，不对耗时设硬性上限。
+"""
+import gc
+import time
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip('gi')
+
+from .helpers import iterate, rss_kb, stats, time_calls, wait_spawned
+
+TABS = 20
+SPAWNS = 10
+KEYS = 20000
+FANOUT_TERMINALS = 20
+PROFILE_CHANGES = 20
+FLOOD_LINES = 200000
+MEMORY_TABS = 20
+
+
+def test_tab_create_latency(tm, panel, bench):
+    """新建并显示一个Tab（含创建终端、发起shell启动）的同步耗时"""
+    samples = []
+    tabs = []
+    for _i in range(TABS):
+        start = time.perf_counter()
+        tabs.append(panel.create_new_terminal_tab())
+        samples.append((time.perf_counter() - start) * 1000)
+    assert all(tab.terminal is not None for tab in tabs)
+    assert wait_spawned([tab.terminal for tab in tabs])
+    bench.record('tab_create', **stats(samples))
+
+
+def test_shell_spawn_latency(tm, panel, bench):
+    """从创建终端到shell启动完成（shell-spawned）的耗时"""
+    samples = []
+    for _i in range(SPAWNS):
+        start = time.perf_counter()
+        term = tm.GeditTerminal()
+        assert wait_spawned([term])
+        samples.append((time.perf_counter() - start) * 1000)
+        term.terminate()
+        term.destroy()
+    bench.record('shell_spawn', **stats(samples))
+
+
+def test_key_dispatch_cost(tm, panel, bench):
+    """普通字符按键经过on_vte_key_press的开销"""
+    from gi.repository import Gdk
+    term = panel.get_current_terminal()
+    event = SimpleNamespace(keyval=Gdk.KEY_a, state=0)
+    assert panel.on_vte_key_press(term, event) is False
+    bench.record('key_dispatch', keys=KEYS,
+                 per_key_us=time_calls(lambda: panel.on_vte_key_press(term, event), KEYS))
+
+
+def test_profile_change_fanout(tm, panel, bench, monkeypatch):
+    """字体变化推送给所有终端的耗时和整屏失效次数；值未变化时不触碰终端"""
+    tabs = [panel.create_new_terminal_tab() for _i in range(FANOUT_TERMINALS - 1)]
+    assert wait_spawned([tab.terminal for tab in tabs])
+    terminals = [term for tab in panel.get_sessions() for term in tab.get_terminals()]
+    service = tm.TerminalProfileSettings.get_default()
+    fonts = ('Monospace 11', 'Monospace 12')
+    samples = []
+    for i in range(PROFILE_CHANGES):
+        monkeypatch.setattr(service, 'get_font', lambda font=fonts[i % 2]: font)
+        start = time.perf_counter()
+        service.on_settings_changed(None, 'monospace-font-name')
+        samples.append((time.perf_counter() - start) * 1000)
+    key, group, count, invalidations = service.get_invalidation_stats()[-1]
+    assert (key, group) == ('monospace-font-name', 'font')
+    assert count == len(terminals)
+    assert invalidations == len(terminals)
+
+    before = sum(term.invalidation_count for term in terminals)
+    start = time.perf_counter()
+    service.on_settings_changed(None, 'monospace-font-name')
+    unchanged_ms = (time.perf_counter() - start) * 1000
+    assert sum(term.invalidation_count for term in terminals) == before
+    bench.record('profile_fanout', terminals=len(terminals), invalidations_per_change=invalidations,
+                 unchanged_ms=unchanged_ms, **stats(samples))
+
+
+def test_output_flood_throughput(tm, panel, bench, monkeypatch):
+    """可见Tab中命令大量输出时的吞吐量（行/秒）"""
+    monkeypatch.setattr(panel, 'RUN_DEBOUNCE', 0)
+    finished = []
+    handler = panel.connect('command-finished', lambda p, name, code: finished.append(code))
+    try:
+        start = time.perf_counter()
+        tab = panel.run_command('flood', f'seq 1 {FLOOD_LINES}')
+        assert iterate(lambda: finished, timeout=120)
+        elapsed = time.perf_counter() - start
+    finally:
+        panel.disconnect(handler)
+    assert finished == [0]
+    assert str(FLOOD_LINES) in tab.terminal.get_history(5)
+    bench.record('output_flood', lines=FLOOD_LINES, seconds=elapsed, lines_per_s=FLOOD_LINES / elapsed)
+
+
+def test_memory_per_tab(tm, panel, bench):
+    """每个Tab增加的gedit进程内存、shell进程内存和滚动回滚估算"""
+    assert wait_spawned([panel.get_current_terminal()])
+    gc.collect()
+    iterate()
+    base = rss_kb()
+    tabs = [panel.create_new_terminal_tab() for _i in range(MEMORY_TABS)]
+    assert wait_spawned([tab.terminal for tab in tabs])
+    iterate()
+    gc.collect()
+    grown = rss_kb() - base
+    shells = [rss_kb(tab.terminal.child_pid) for tab in tabs]
+    scrollback = [tab.terminal.get_scrollback_usage()[1] for tab in tabs]
+    bench.record('memory_per_tab', tabs=MEMORY_TABS, rss_kb_per_tab=grown / MEMORY_TABS,
+                 shell_rss_kb_mean=sum(shells) / len(shells),
+                 scrollback_bytes_mean=sum(scrollback) / len(scrollback))
@@ -0,0 +1,80 @@
+# -*- coding: utf8 -*-
+"""按键分发：分发表的正确性和每次按键的开销（按按键类别分别计时）"""
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip('gi')
+
+from .helpers import time_calls
+
+KEYS = 20000
+
+
+def key_event(keyval, state=0):
+    from gi.repository import Gdk
+    return SimpleNamespace(keyval=keyval, state=Gdk.ModifierType(state))
+
+
+def test_key_table(tm, panel, monkeypatch):
+    from gi.repository import Gdk
+    ctrl = int(Gdk.ModifierType.CONTROL_MASK)
+    shift = int(Gdk.ModifierType.SHIFT_MASK)
+    term = panel.get_current_terminal()
+    actions = tm.GeditTerminalPanel._key_actions
+
+    # 大小写keyval都能匹配插件快捷键
+    assert actions[(Gdk.KEY_C, ctrl | shift)] == 'copy_clipboard'
+    assert actions[(Gdk.KEY_c, ctrl | shift)] == 'copy_clipboard'
+    assert actions[(Gdk.KEY_Tab, ctrl)] == 'focus_next_widget'
+
+    # 终端原生快捷键只有单个字母，名字含这些字母的功能键不放行
+    passthrough = tm.GeditTerminalPanel.PASSTHROUGH_KEYS
+    assert (Gdk.KEY_c, ctrl) in passthrough
+    assert (Gdk.KEY_D, ctrl) in passthrough
+    for keyval in (Gdk.KEY_Delete, Gdk.KEY_End, Gdk.KEY_F1, Gdk.KEY_Escape):
+        assert (keyval, ctrl) not in passthrough
+
+    calls = []
+    monkeypatch.setattr(panel, 'copy_clipboard', lambda: calls.append('copy'))
+    assert panel.on_vte_key_press(term, key_event(Gdk.KEY_c, ctrl | shift)) is True
+    assert panel.on_vte_key_press(term, key_event(Gdk.KEY_c, ctrl)) is False
+    assert panel.on_vte_key_press(term, key_event(Gdk.KEY_a)) is False
+    assert calls == ['copy']
+
+
+def test_key_table_follows_accel_map(tm, panel):
+    """修改快捷键后分发表重建，旧按键不再触发"""
+    from gi.repository import Gdk, Gtk
+    ctrl_shift = int(Gdk.ModifierType.CONTROL_MASK | Gdk.ModifierType.SHIFT_MASK)
+    path = tm.GeditTerminalPanel.ACCEL_BASE + '/copy-clipboard'
+    assert Gtk.AccelMap.change_entry(path, Gdk.KEY_Y, Gdk.ModifierType(ctrl_shift), True)
+    try:
+        actions = tm.GeditTerminalPanel._key_actions
+        assert actions.get((Gdk.KEY_y, ctrl_shift)) == 'copy_clipboard'
+        assert (Gdk.KEY_c, ctrl_shift) not in actions
+    finally:
+        Gtk.AccelMap.change_entry(path, Gdk.KEY_C, Gdk.ModifierType(ctrl_shift), True)
+    assert tm.GeditTerminalPanel._key_actions[(Gdk.KEY_c, ctrl_shift)] == 'copy_clipboard'
+
+
+def test_key_dispatch_per_category(tm, panel, bench, monkeypatch):
+    """每次按键的开销：普通字符、功能键、终端原生快捷键、插件快捷键、交给gedit的快捷键"""
+    from gi.repository import Gdk
+    ctrl = int(Gdk.ModifierType.CONTROL_MASK)
+    term = panel.get_current_terminal()
+    # 插件快捷键只计分发开销，不真正移动焦点
+    monkeypatch.setattr(panel, 'focus_next_widget', lambda: None)
+    categories = {
+        'char': (key_event(Gdk.KEY_a), False),
+        'cjk_char': (key_event(Gdk.unicode_to_keyval(ord('中'))), False),
+        'function_key': (key_event(Gdk.KEY_Return), False),
+        'passthrough': (key_event(Gdk.KEY_c, ctrl), False),
+        'plugin_accel': (key_event(Gdk.KEY_Tab, ctrl), True),
+        'gedit_accel': (key_event(Gdk.KEY_j, ctrl), False),
+    }
+    results = {}
+    for name, (event, handled) in categories.items():
+        assert panel.on_vte_key_press(term, event) is handled, name
+        results[f'{name}_us'] = time_calls(lambda: panel.on_vte_key_press(term, event), KEYS)
+    bench.record('key_dispatch_per_category', keys=KEYS, **results)
@@ -0,0 +1,75 @@
+# -*- coding: utf8 -*-
+"""资源泄漏：反复激活/停用插件后，Python对象、文件描述符和子进程数量保持不变
+
+循环次数可用 GEDIT_TERMINAL_MULTITAB_TEST_LEAK_CYCLES 调整（默认200）。一半的循环
+等shell启动完成后停用，另一半在shell仍在启动时就停用。
+"""
+import gc
+import os
+
+import pytest
+
+pytest.importorskip('gi')
+
+from .helpers import PluginWindow, child_pids, fd_count, iterate, wait_reaped, wait_spawned
+
+CYCLES = int(os.environ.get('GEDIT_TERMINAL_MULTITAB_TEST_LEAK_CYCLES', 200))
+WARMUP = 5
+SPAWN_CYCLES = 20
+# GTK可能在首次使用某些功能时打开文件（主题、字体缓存等），预热后仍允许的少量差异
+FD_SLACK = 2
+
+
+def cycle(tm, wait):
+    window = PluginWindow(tm)
+    panel = window.show_panel()
+    if wait:
+        assert wait_spawned([panel.get_current_terminal()])
+    window.close()
+
+
+def snapshot(tm):
+    wait_reaped(tm)
+    iterate()
+    gc.collect()
+    classes = (tm.GeditTerminal, tm.GeditTerminalPanel, tm.TerminalTab, tm.TerminalPlugin)
+    counts = dict.fromkeys((cls.__name__ for cls in classes), 0)
+    for obj in gc.get_objects():
+        for cls in classes:
+            if isinstance(obj, cls):
+                counts[cls.__name__] += 1
+    return {
+        'objects': counts,
+        'fds': fd_count(),
+        'children': child_pids(),
+    }
+
+
+def test_activate_deactivate_cycles(tm, bench):
+    for i in range(WARMUP):
+        cycle(tm, i % 2 == 0)
+    before = snapshot(tm)
+
+    for i in range(CYCLES):
+        cycle(tm, i % 2 == 0)
+    after = snapshot(tm)
+
+    bench.record('leaks', cycles=CYCLES, before=before, after=after)
+    assert after['objects'] == before['objects']
+    assert after['children'] == before['children'] == []
+    assert after['fds'] <= before['fds'] + FD_SLACK
+
+
+def test_destroy_while_spawning(tm, monkeypatch):
+    """终端在shell启动完成前销毁（关闭刚新建的Tab、停用插件、清空预热池）时shell也被挂断回收"""
+    reaped = []
+    reap = tm.ChildReaper.reap
+    monkeypatch.setattr(tm.ChildReaper, 'reap', staticmethod(lambda pid: (reaped.append(pid), reap(pid))))
+    for _i in range(SPAWN_CYCLES):
+        term = tm.GeditTerminal()
+        assert term.is_starting()
+        term.destroy()
+    # 启动完成的回调在主循环中才到达
+    assert iterate(lambda: len(reaped) == SPAWN_CYCLES, timeout=30)
+    assert wait_reaped(tm)
+    assert child_pids() == []
@@ -0,0 +1,31 @@
+# -*- coding: utf8 -*-
+"""命令Tab：run_command的运行、结束信号和启动失败后的恢复"""
+import pytest
+
+pytest.importorskip('gi')
+
+from .helpers import iterate
+
+
+def test_run_after_failed_spawn(tm, panel, monkeypatch, tmp_path):
+    """工作目录不存在时命令无法启动：发出command-finished(-1)，之后的命令照常运行"""
+    monkeypatch.setattr(panel, 'RUN_DEBOUNCE', 0)
+    missing = str(tmp_path / 'missing')
+    out = tmp_path / 'cwd.txt'
+    finished = []
+    handler = panel.connect('command-finished', lambda p, name, code: finished.append((name, code)))
+    try:
+        # 第一次在新建终端时失败，第三次在已有终端中重新启动时失败
+        for cwd, expected in ((missing, -1), (str(tmp_path), 0), (missing, -1), (str(tmp_path), 0)):
+            count = len(finished)
+            tab = panel.run_command('build', f'pwd > {out}', cwd)
+            assert iterate(lambda: len(finished) > count, timeout=10), cwd
+            assert finished[-1] == ('build', expected)
+            assert not tab.run_active
+            assert tab.exit_status == expected
+            if expected == 0:
+                assert out.read_text().strip() == str(tmp_path)
+                out.unlink()
+    finally:
+        panel.disconnect(handler)
+    assert len(finished) == 4
@@ -0,0 +1,35 @@
+# -*- coding: utf8 -*-
+"""跨Tab搜索：搜索期间关闭Tab或终端退出重建"""
+import re
+
+import pytest
+
+pytest.importorskip('gi')
+
+from .helpers import iterate, wait_spawned
+
+
+def test_search_skips_closed_and_respawned_tabs(tm, panel):
+    tabs = [panel.get_current_tab()] + [panel.create_new_terminal_tab() for _i in range(3)]
+    # 后台Tab的终端在显示时才创建
+    for tab in tabs:
+        panel._notebook.set_current_page(panel._notebook.page_num(tab.page))
+        iterate()
+    assert wait_spawned([tab.terminal for tab in tabs])
+    for tab in tabs:
+        tab.terminal.feed(b'needle\r\n')
+    iterate()
+
+    done = []
+    job = tm.TerminalSearch(re.compile('needle'), tabs, lambda results: None, done.append)
+    # 排队之后：第一个Tab关闭，第三个Tab关闭，当前（最后一个）Tab的shell退出并重建
+    panel.close_tab(tabs[0])
+    panel.close_tab(tabs[2])
+    old = tabs[3].terminal
+    old.get_child_feeder().feed(b'exit\r')
+    assert iterate(lambda: tabs[3].terminal is not None and tabs[3].terminal is not old, timeout=10)
+
+    job.start()
+    assert iterate(lambda: done, timeout=10)
+    assert done == [[(tabs[1], 1)]]
+    assert job._source_id == 0
@@ -0,0 +1,76 @@
+# -*- coding: utf8 -*-
+"""会话保存与恢复：索引只含Tab列表，滚动回滚按Tab单独保存，创建终端时才读取"""
+import gzip
+import json
+
+import pytest
+
+pytest.importorskip('gi')
+
+from .helpers import iterate, wait_spawned
+
+TABS = 4
+
+
+def select(panel, tab):
+    panel._notebook.set_current_page(panel._notebook.page_num(tab.page))
+    iterate()
+
+
+def test_history_saved_per_tab_and_read_on_first_show(tm, panel, monkeypatch, tmp_path):
+    path = str(tmp_path / 'session.json.gz')
+    tabs = [panel.get_current_tab()] + [panel.create_new_terminal_tab() for _i in range(TABS - 1)]
+    for tab in tabs:
+        select(panel, tab)
+    assert wait_spawned([tab.terminal for tab in tabs])
+    for tab in tabs:
+        tab.terminal.feed(f'marker-{tab.index}\r\n'.encode())
+    iterate()
+
+    store = tm.SessionStore(path, True, 100, 0)
+    store.save()
+    with gzip.open(path, 'rb') as f:
+        index = json.loads(f.read().decode('utf-8'))
+    # 索引中只有文件名，没有滚动回滚内容
+    assert all('marker' not in json.dumps(state) for state in index['tabs'])
+    names = [state['history'] for state in index['tabs']]
+    assert sorted(p.name for p in (tmp_path / 'history').iterdir()) == sorted(names)
+
+    # 恢复：读取索引时不读任何滚动回滚，只有显示出来的Tab读取自己的
+    reads = []
+    read_history = tm.SessionStore.read_history
+    monkeypatch.setattr(tm.SessionStore, 'read_history',
+                        staticmethod(lambda p: (reads.append(p), read_history(p))[1]))
+    restored_store = tm.SessionStore(path, True, 100, 0)
+    states, current = restored_store.take_saved()
+    assert reads == []
+    assert len(states) == TABS
+    panel.close_tabs(replace=False)
+    restored = panel.open_tabs(states, 0)
+    iterate()
+    assert len(reads) == 1
+    assert f'marker-{tabs[0].index}' in restored[0].terminal.get_history(50)
+    select(panel, restored[2])
+    assert len(reads) == 2
+    assert f'marker-{tabs[2].index}' in restored[2].terminal.get_history(50)
+
+    # 未显示过的Tab再次保存时保留原文件（不读取），关闭的Tab的文件被删除
+    never_shown = tmp_path / 'history' / f'{restored[3].index}.txt.gz'
+    saved = never_shown.read_bytes()
+    panel.close_tab(restored[1])
+    restored_store.save()
+    assert len(reads) == 2
+    assert not (tmp_path / 'history' / f'{restored[1].index}.txt.gz').exists()
+    assert never_shown.read_bytes() == saved
+
+
+def test_history_name_outside_directory_is_rejected(tm, tmp_path):
+    path = str(tmp_path / 'session.json.gz')
+    with gzip.open(path, 'wb') as f:
+        f.write(json.dumps({'version': tm.SessionStore.VERSION, 'current': 0, 'tabs': [
+            {'index': 1, 'history': '../../etc/passwd'},
+            {'index': 2, 'history': '2.txt.gz'},
+        ]}).encode('utf-8'))
+    states, current = tm.SessionStore(path, True, 100, 0).take_saved()
+    assert [state['index'] for state in states] == [2]
+    assert states[0]['history_file'] == str(tmp_path / 'history' / '2.txt.gz')
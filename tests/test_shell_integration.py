@@ -0,0 +1,64 @@
+# -*- coding: utf8 -*-
+"""shell集成：bash通过OSC 666/7上报的命令边界、退出码和当前目录（需要VTE 0.78+）"""
+import shutil
+
+import pytest
+
+pytest.importorskip('gi')
+
+from .helpers import iterate, run_for, wait_spawned
+
+
+@pytest.fixture
+def integrated_bash(tm, monkeypatch, tmp_path):
+    """开启shell集成的bash终端（HOME指向空目录，不加载用户自己的配置）"""
+    if (tm.Vte.get_major_version(), tm.Vte.get_minor_version()) < (0, 78):
+        pytest.skip("command boundaries need VTE 0.78+ termprops")
+    bash = shutil.which('bash')
+    if bash is None:
+        pytest.skip("bash not installed")
+    home = tmp_path / 'home'
+    home.mkdir()
+    monkeypatch.setenv('HOME', str(home))
+    monkeypatch.setattr(tm.ShellIntegration, 'enabled', True)
+    monkeypatch.setattr(tm.Vte, 'get_user_shell', lambda: bash)
+    term = tm.GeditTerminal(str(tmp_path))
+    try:
+        assert wait_spawned([term])
+        # 第一个提示符
+        assert iterate(lambda: term.shell_integrated, timeout=10)
+        yield term
+    finally:
+        term.terminate()
+        term.destroy()
+
+
+def test_command_boundaries(integrated_bash):
+    term = integrated_bash
+    events = []
+    term.connect('shell-command-started', lambda t: events.append('started'))
+    term.connect('shell-command-finished', lambda t, status: events.append(status))
+
+    for command, status in ((b'false', 1), (b'true', 0), (b'(exit 3)', 3)):
+        del events[:]
+        term.get_child_feeder().feed(command + b'\r')
+        assert iterate(lambda: len(events) == 2, timeout=10), command
+        assert events == ['started', status]
+
+    # 空行不是命令：不发出结束信号
+    del events[:]
+    term.get_child_feeder().feed(b'\r')
+    run_for(0.5)
+    assert events == []
+
+
+def test_directory_with_special_characters(integrated_bash, tmp_path):
+    """OSC 7中的路径经过URL编码，空格、%和非ASCII字符都能还原"""
+    directory = tmp_path / 'a b%c' / 'ü'
+    directory.mkdir(parents=True)
+    from gi.repository import GLib
+    term = integrated_bash
+    term.get_child_feeder().feed(b"cd 'a b%c/\xc3\xbc'\r")
+    # 直接检查shell上报的URI（get_working_directory没有URI时会读/proc）
+    assert iterate(lambda: (term.get_current_directory_uri() or '').endswith('/%C3%BC'), timeout=10)
+    assert GLib.filename_from_uri(term.get_current_directory_uri())[0] == str(directory)
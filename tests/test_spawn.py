@@ -0,0 +1,62 @@
+# -*- coding: utf8 -*-
+"""shell异步启动：新建Tab和shell退出重建时主循环的卡顿时间
+
+卡顿上限可用 GEDIT_TERMINAL_MULTITAB_TEST_STALL_MS 调整（默认150毫秒，Xvfb下
+创建VTE控件本身也要十几毫秒）。
+"""
+import os
+import time
+
+import pytest
+
+pytest.importorskip('gi')
+
+from .helpers import StallMonitor, iterate, stats, wait_spawned
+
+STALL_BUDGET_MS = float(os.environ.get('GEDIT_TERMINAL_MULTITAB_TEST_STALL_MS', 150))
+TABS = 10
+
+
+def test_tab_creation_does_not_block_main_loop(tm, panel, bench):
+    """新建Tab立即返回（shell仍在启动中），从创建到shell启动完成主循环一直在运行"""
+    stalls = []
+    for _i in range(TABS):
+        with StallMonitor() as monitor:
+            tab = panel.create_new_terminal_tab()
+            assert tab.terminal.is_starting()
+            assert '…' in tab.label.get_text()
+            assert wait_spawned([tab.terminal])
+        assert '…' not in tab.label.get_text()
+        stalls.append(monitor.max_gap_ms)
+    bench.record('tab_create_stall', budget_ms=STALL_BUDGET_MS, **stats(stalls))
+    assert max(stalls) < STALL_BUDGET_MS
+
+
+def test_respawn_does_not_block_main_loop(tm, panel, bench):
+    """shell退出后在同一Tab中重建，重建期间主循环不卡顿"""
+    tab = panel.get_current_tab()
+    stalls = []
+    for _i in range(TABS):
+        old = tab.terminal
+        assert wait_spawned([old])
+        with StallMonitor() as monitor:
+            old.get_child_feeder().feed(b'exit\r')
+            assert iterate(lambda: tab.terminal is not None and tab.terminal is not old, timeout=10)
+            assert wait_spawned([tab.terminal])
+        stalls.append(monitor.max_gap_ms)
+    bench.record('respawn_stall', budget_ms=STALL_BUDGET_MS, **stats(stalls))
+    assert max(stalls) < STALL_BUDGET_MS
+
+
+def test_fallback_shell_after_failed_spawn(tm, panel, monkeypatch):
+    """用户shell无法启动时在回调中回退到/bin/bash"""
+    monkeypatch.setattr(tm.Vte, 'get_user_shell', lambda: '/nonexistent/shell')
+    start = time.perf_counter()
+    term = tm.GeditTerminal()
+    assert term.is_starting()
+    assert (time.perf_counter() - start) * 1000 < STALL_BUDGET_MS
+    try:
+        assert wait_spawned([term])
+    finally:
+        term.terminate()
+        term.destroy()
@@ -0,0 +1,75 @@
+# -*- coding: utf8 -*-
+"""启动开销：懒加载和立即创建两种模式下导入、激活插件的耗时和启动的shell数
+
+每种模式在新的子进程中运行startup_probe，保证从未加载Vte的状态开始。
+"""
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+pytest.importorskip('gi')
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WINDOWS = 5
+# 插件模块导入耗时上限（毫秒），不含gi和GTK本身
+IMPORT_BUDGET_MS = float(os.environ.get('GEDIT_TERMINAL_MULTITAB_TEST_IMPORT_MS', 50))
+
+
+def run_probe(lazy, probe_args=(), python_args=()):
+    """运行启动探针，返回 (JSON结果, 标准错误输出)"""
+    env = dict(os.environ, GEDIT_TERMINAL_MULTITAB_LAZY='1' if lazy else '0')
+    proc = subprocess.run([sys.executable, *python_args, '-m', 'tests.startup_probe',
+                           '--windows', str(WINDOWS), *probe_args],
+                          cwd=ROOT, env=env, capture_output=True, text=True, timeout=120)
+    assert proc.returncode == 0, proc.stderr
+    return json.loads(proc.stdout), proc.stderr
+
+
+def test_lazy_vs_eager_startup(tm, bench):
+    lazy = run_probe(True)[0]
+    eager = run_probe(False)[0]
+
+    # 懒加载：激活时不加载Vte、不创建终端面板、不启动shell，也不打开底部面板
+    assert lazy['lazy'] and not eager['lazy']
+    assert not lazy['vte_loaded_on_import'] and not eager['vte_loaded_on_import']
+    assert not lazy['vte_loaded']
+    assert lazy['panels'] == 0
+    assert lazy['bottom_panels_visible'] == 0
+    assert lazy['shells'] == 0
+
+    # 立即创建：每个窗口都有终端面板，只有第一个窗口新建Tab，其余窗口为空面板
+    assert eager['vte_loaded']
+    assert eager['panels'] == WINDOWS
+    assert eager['bottom_panels_visible'] == WINDOWS
+    assert eager['shells'] == 1
+
+    bench.record('startup_lazy', **lazy)
+    bench.record('startup_eager', **eager)
+
+
+def import_time_us(stderr, module='terminal_multitab'):
+    """从 -X importtime 的输出中取出模块的累计导入耗时（微秒）"""
+    for line in stderr.splitlines():
+        fields = line.split('|')
+        if line.startswith('import time:') and len(fields) == 3 and fields[2].strip() == module:
+            return int(fields[1])
+    raise AssertionError(f"{module} not found in -X importtime output")
+
+
+def test_import_time_budget(tm, bench):
+    """导入插件（gedit已加载GTK之后）不加载Vte/Tepl，累计耗时不超过预算"""
+    result, stderr = run_probe(True, python_args=['-X', 'importtime'])
+    import_ms = import_time_us(stderr) / 1000
+    bench.record('import_time', budget_ms=IMPORT_BUDGET_MS, cumulative_ms=import_ms)
+    assert not result['vte_loaded_on_import']
+    assert import_ms < IMPORT_BUDGET_MS
+
+
+def test_panel_built_on_first_map(tm):
+    """终端面板、Vte和shell在用户第一次打开面板时才创建，且只在该窗口中创建"""
+    result = run_probe(True, probe_args=['--show-panel'])[0]
+    assert not result['vte_loaded'] and result['panels'] == 0
+    assert result['after_show'] == {'vte_loaded': True, 'panels': 1, 'shells': 1}